@@ -1,27 +1,42 @@
 import os
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+from app.routing import RoutingSQLAlchemy
 
-app = Flask(__name__)
 url_prefix = '/api'
-POSTGRES = {
-    'user': 'postgres',
-    'pw': '',
-    'db': 'shoppinglistdb',
-    'host': 'localhost',
-    'port': '5432',
-}
-DB_URI = 'postgresql://%(user)s:%(pw)s@%(host)s:%(port)s/%(db)s' % POSTGRES
-# set debug to true for development purposes
-app.config['DEBUG'] = True
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-if os.environ.get('DATABASE_URL'):
-    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = DB_URI
-app.config['SECRET_KEY'] = 'this-really-needs-to-be-changed'
-db = SQLAlchemy(app)
+# engines are created on first use, in the worker processes when gunicorn
+# preloads the app
+db = RoutingSQLAlchemy()
 
-from app import views, models  # at the end to avoid circular imports
 
-app.register_blueprint(views.api)
+def create_app(config=None):
+    """Build the application with one of the configurations of app.config,
+    given by name or as a class, by default the one named in APP_CONFIG
+    and otherwise production
+    """
+    from app.config import configs
+    from app import models, views
+    if config is None:
+        config = os.environ.get('APP_CONFIG', 'production')
+    if isinstance(config, str):
+        if config not in configs:
+            raise ValueError('Unknown configuration {!r}'.format(config))
+        config = configs[config]
+    app = Flask(__name__)
+    app.config.from_object(config)
+    db.init_app(app)
+    models.init_app(app)
+    app.register_blueprint(views.api)
+    if app.config.get('SERVE_THROUGH_ASGI'):
+        from app.asgi import serve_through_asgi
+        serve_through_asgi(app)
+
+    @app.before_first_request
+    def start_tasks():
+        # threads do not survive a fork, each worker starts its own
+        from app.tasks import start_periodic, prune_blacklist, reap_deleted
+        if app.config['BLACKLIST_SWEEP_INTERVAL']:
+            start_periodic(app, app.config['BLACKLIST_SWEEP_INTERVAL'],
+                           prune_blacklist, 'blacklist-sweeper')
+        if app.config['REAPER_INTERVAL']:
+            start_periodic(app, app.config['REAPER_INTERVAL'], reap_deleted, 'reaper')
+    return app
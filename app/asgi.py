@@ -0,0 +1,186 @@
+import sys
+import asyncio
+import tempfile
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor
+
+# request bodies larger than this are spooled to a temporary file
+MAX_BODY_IN_MEMORY = 1024 * 1024
+
+
+def asgi_environ(scope, body, length):
+    """Return the WSGI environ of an ASGI http scope whose body of length
+    bytes was read into the file body
+    """
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    # chunked request bodies come without a length
+    environ['CONTENT_LENGTH'] = str(length)
+    return environ
+
+
+class AsgiAdapter(object):
+    """Serves a WSGI application to an ASGI server. The event loop holds the
+    client connections while each request runs, from start to end of its
+    response, on one of `workers` threads, so no more requests than there
+    are database connections use the database at once
+    """
+
+    def __init__(self, wsgi_app, workers):
+        self.wsgi_app = wsgi_app
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='asgi-worker')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError('Unsupported ASGI scope {!r}'.format(scope['type']))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        body = tempfile.SpooledTemporaryFile(max_size=MAX_BODY_IN_MEMORY)
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return
+            body.write(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        length = body.tell()
+        body.seek(0)
+        environ = asgi_environ(scope, body, length)
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.executor, self.run, environ, send, loop)
+        finally:
+            body.close()
+
+    def run(self, environ, send, loop):
+        """Call the application and send its response, on a worker thread.
+        Streamed responses are produced on the thread that started them and
+        wait for the server to take every chunk before making the next
+        """
+        def call(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['message'] = {
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in headers]
+            }
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in result:
+                if not chunk:
+                    continue
+                if 'message' in started:
+                    # headers go out with the first chunk of the body
+                    call(started.pop('message'))
+                call({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        if 'message' in started:
+            call(started.pop('message'))
+        call({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+def asgi_to_wsgi(asgi_app):
+    """Return a WSGI application calling asgi_app, each request runs in its
+    own event loop. Lets the tests use the WSGI test client on the ASGI
+    entry point
+    """
+    def wsgi_app(environ, start_response):
+        headers = [(name[5:].replace('_', '-').lower().encode('latin-1'), value.encode('latin-1'))
+                   for name, value in environ.items() if name.startswith('HTTP_') and
+                   name not in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH')]
+        for name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            if environ.get(name):
+                headers.append((name.replace('_', '-').lower().encode('latin-1'),
+                                environ[name].encode('latin-1')))
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': environ['SERVER_PROTOCOL'].split('/')[-1],
+            'method': environ['REQUEST_METHOD'],
+            'scheme': environ['wsgi.url_scheme'],
+            'path': environ['PATH_INFO'].encode('latin-1').decode('utf-8'),
+            'root_path': environ.get('SCRIPT_NAME', '').encode('latin-1').decode('utf-8'),
+            'query_string': environ.get('QUERY_STRING', '').encode('latin-1'),
+            'headers': headers,
+            'server': (environ['SERVER_NAME'], int(environ['SERVER_PORT'])),
+            'client': (environ.get('REMOTE_ADDR', '127.0.0.1'), 0)
+        }
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        request = {'type': 'http.request',
+                   'body': environ['wsgi.input'].read(length) if length else b'',
+                   'more_body': False}
+        messages = []
+
+        async def receive():
+            return request
+
+        async def send(message):
+            messages.append(message)
+        asyncio.run(asgi_app(scope, receive, send))
+        start = messages[0]
+        start_response('{} {}'.format(start['status'], HTTPStatus(start['status']).phrase),
+                       [(name.decode('latin-1'), value.decode('latin-1'))
+                        for name, value in start['headers']])
+        return [message.get('body', b'') for message in messages[1:]]
+    return wsgi_app
+
+
+def serve_through_asgi(app):
+    """Route the requests of app through its ASGI entry point"""
+    app.wsgi_app = asgi_to_wsgi(AsgiAdapter(app.wsgi_app, asgi_workers(app.config)))
+    return app
+
+
+def asgi_workers(config):
+    """Return the threads running requests, by default as many as the
+    database connections a process may open
+    """
+    return config['ASGI_WORKERS'] or (
+        config['DATABASE_POOL_SIZE'] + max(config['DATABASE_MAX_OVERFLOW'], 0))
@@ -0,0 +1,63 @@
+import hmac
+from functools import wraps
+from flask import current_app, g, jsonify, make_response, request
+from app.models import Users
+
+
+def clear_identity():
+    """Forget the identity of a previous request sharing the app context"""
+    for name in ('access_token', 'auth_result', 'user_id', 'user'):
+        g.pop(name, None)
+
+
+def authenticate():
+    """Decode the token of the current request once and return the user
+    id, or the error message when the token is not valid
+    """
+    if 'auth_result' not in g:
+        access_token = request.headers.get('Authorization')
+        g.access_token = access_token
+        g.auth_result = Users.decode_token(access_token) if access_token else None
+    return g.auth_result
+
+
+def require_auth(f):
+    """Decorator for views that need an authenticated user, the user id is
+    available as g.user_id inside the view
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        user_id = authenticate()
+        if user_id is None:
+            return make_response(jsonify({'message': 'Please register or login.'})), 401
+        if isinstance(user_id, str):
+            # user is not legit, so the payload is an error message
+            return make_response(jsonify({'message': user_id})), 401
+        g.user_id = user_id
+        return f(*args, **kwargs)
+    return decorated
+
+
+def require_metrics_token(f):
+    """Decorator for the monitoring views, callers send METRICS_TOKEN as
+    the Authorization header and without one the views are not served
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = current_app.config['METRICS_TOKEN']
+        if not token:
+            return make_response(jsonify({'message': 'Metrics are disabled'})), 404
+        sent = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(sent.encode(), token.encode()):
+            return make_response(jsonify({'message': 'Invalid metrics token'})), 401
+        return f(*args, **kwargs)
+    return decorated
+
+
+def current_user():
+    """Return the Users row of the authenticated user, it is only loaded
+    when a view asks for it and at most once per request
+    """
+    if 'user' not in g:
+        g.user = Users.query.get(g.user_id)
+    return g.user
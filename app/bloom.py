@@ -0,0 +1,39 @@
+import math
+
+
+class BloomFilter(object):
+    """Probabilistic set used to rule out membership without a lookup.
+
+    Keys are hex digests, so the bit positions are derived from the digest
+    itself by double hashing instead of hashing the key again.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        # optimal number of bits and hash functions for the capacity
+        self.size = int(math.ceil(
+            -self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        first = int(key[:16], 16)
+        second = int(key[16:32], 16) | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, key):
+        """Add a hex digest to the filter"""
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+    def is_full(self):
+        """Check if the filter holds more keys than it was sized for"""
+        return self.count >= self.capacity
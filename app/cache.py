@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import OrderedDict
+from flask import current_app
+
+
+class LRUCache(object):
+    """Bounded in-process cache with per entry expiry and LRU eviction"""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for key or default if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+            # mark the entry as most recently used
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        """Cache value for ttl seconds, never beyond expires_at"""
+        expiry = time.time() + (self.ttl if ttl is None else ttl)
+        if expires_at is not None:
+            expiry = min(expiry, expires_at)
+        with self._lock:
+            self._data[key] = (value, expiry)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """Remove key from the cache if present"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove all entries and reset the counters"""
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Return hit, miss and size counters for the cache"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._data),
+                'maxsize': self.maxsize
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache(object):
+    """Cache kept in a sqlite file so the worker processes of a host share
+    it, the file should live on a memory backed filesystem like /dev/shm
+    """
+
+    def __init__(self, path, maxsize=1024, ttl=300):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+
+    def _connection(self):
+        # connections are not shared between threads or forked workers
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS entries ('
+                               'key TEXT PRIMARY KEY, value TEXT, '
+                               'expires_at REAL, used_at REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_entries_used_at '
+                               'ON entries (used_at)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key, default=None):
+        """Return the cached value for key or default if missing or expired"""
+        connection = self._connection()
+        row = connection.execute('SELECT value, expires_at FROM entries WHERE key = ?',
+                                 (key,)).fetchone()
+        now = time.time()
+        if row is None or row[1] <= now:
+            self.misses += 1
+            return default
+        connection.execute('UPDATE entries SET used_at = ? WHERE key = ?', (now, key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        """Cache value for ttl seconds, never beyond expires_at"""
+        now = time.time()
+        expiry = now + (self.ttl if ttl is None else ttl)
+        if expires_at is not None:
+            expiry = min(expiry, expires_at)
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                           (key, json.dumps(value), expiry, now))
+        # least recently used entries go first, expired or not
+        evicted = connection.execute(
+            'DELETE FROM entries WHERE key IN (SELECT key FROM entries '
+            'ORDER BY used_at LIMIT max(0, (SELECT count(*) FROM entries) - ?))',
+            (self.maxsize,)).rowcount
+        self.evictions += max(evicted, 0)
+
+    def delete(self, key):
+        """Remove key from the cache if present"""
+        self._connection().execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def clear(self):
+        """Remove all entries and reset the counters"""
+        self._connection().execute('DELETE FROM entries')
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Return hit, miss and size counters for the cache, hits and
+        misses are counted per process
+        """
+        size = self._connection().execute('SELECT count(*) FROM entries').fetchone()[0]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': size,
+            'maxsize': self.maxsize
+        }
+
+
+class RedisCache(object):
+    """Cache in redis or any server speaking its protocol, memory is bounded
+    by the server's maxmemory and eviction policy
+    """
+
+    def __init__(self, client, ttl=300, prefix='shoppinglist:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def from_url(url, ttl=300):
+        """Return a cache for the redis server at url"""
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('The redis package is required for the redis cache')
+        return RedisCache(redis.Redis.from_url(url), ttl=ttl)
+
+    def get(self, key, default=None):
+        """Return the cached value for key or default if missing or expired"""
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None, expires_at=None):
+        """Cache value for ttl seconds, never beyond expires_at"""
+        ttl = self.ttl if ttl is None else ttl
+        if expires_at is not None:
+            ttl = min(ttl, expires_at - time.time())
+        if ttl > 0:
+            self.client.set(self.prefix + key, json.dumps(value),
+                            px=max(1, int(ttl * 1000)))
+
+    def delete(self, key):
+        """Remove key from the cache if present"""
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        """Remove all entries with the cache's prefix and reset the counters"""
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+        self.hits = self.misses = 0
+
+    def stats(self):
+        """Return hit and miss counters of this process"""
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class ResponseCache(object):
+    """Cache of rendered GET responses. Entry keys contain the current
+    generation of every user and shopping list the response depends on,
+    so a write invalidates all its cached responses by replacing those
+    generations and the stale entries age out of the backend
+    """
+    # generations outlive the entries keyed by them, an evicted
+    # generation only makes its entries unreachable
+    generation_ttl = 24 * 3600
+
+    def __init__(self, backend, ttl=60, max_entry_size=65536):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entry_size = max_entry_size
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.invalidations = 0
+
+    def generation(self, name):
+        """Return the current generation of a user or shopping list"""
+        generation = self.backend.get('gen:' + name)
+        if generation is None:
+            generation = uuid.uuid4().hex
+            self.backend.set('gen:' + name, generation, ttl=self.generation_ttl)
+        return generation
+
+    def invalidate(self, names):
+        """Make every cached response depending on names stale"""
+        for name in names:
+            self.backend.set('gen:' + name, uuid.uuid4().hex, ttl=self.generation_ttl)
+            self.invalidations += 1
+
+    def key(self, parts, names):
+        """Return the entry key of a response made of parts and depending
+        on the users and shopping lists in names
+        """
+        generations = [self.generation(name) for name in names]
+        return 'resp:' + json.dumps([parts, generations], sort_keys=True, default=str)
+
+    def get(self, key):
+        """Return the cached status, headers and body for key or None"""
+        entry = self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def set(self, key, status, headers, body):
+        """Cache a response unless its body is larger than max_entry_size"""
+        if len(body) > self.max_entry_size:
+            self.skipped += 1
+            return
+        self.backend.set(key, {'status': status, 'headers': headers,
+                               'body': body}, ttl=self.ttl)
+
+    def stats(self):
+        """Return the response counters and the backend's counters"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'skipped': self.skipped,
+            'invalidations': self.invalidations,
+            'backend': self.backend.stats()
+        }
+
+
+def make_response_cache(config):
+    """Return the response cache chosen by the RESPONSE_CACHE setting,
+    or None when responses are not cached
+    """
+    kind = config['RESPONSE_CACHE']
+    ttl = config['RESPONSE_CACHE_TTL']
+    if kind == 'null':
+        return None
+    if kind == 'local':
+        backend = LRUCache(maxsize=config['RESPONSE_CACHE_SIZE'], ttl=ttl)
+    elif kind == 'shared':
+        backend = SQLiteCache(config['RESPONSE_CACHE_PATH'],
+                              maxsize=config['RESPONSE_CACHE_SIZE'], ttl=ttl)
+    elif kind == 'redis':
+        backend = RedisCache.from_url(config['RESPONSE_CACHE_URL'], ttl=ttl)
+    else:
+        raise ValueError('Unknown response cache {!r}'.format(kind))
+    return ResponseCache(backend, ttl=ttl,
+                         max_entry_size=config['RESPONSE_CACHE_MAX_ENTRY_SIZE'])
+
+
+def response_cache():
+    """Return the response cache of the current app, it is created on
+    first use so every worker opens its own connections
+    """
+    if 'response_cache' not in current_app.extensions:
+        current_app.extensions['response_cache'] = make_response_cache(current_app.config)
+    return current_app.extensions['response_cache']
@@ -0,0 +1,140 @@
+import os
+import tempfile
+
+POSTGRES = {
+    'user': 'postgres',
+    'pw': '',
+    'db': 'shoppinglistdb',
+    'host': 'localhost',
+    'port': '5432',
+}
+DB_URI = 'postgresql://%(user)s:%(pw)s@%(host)s:%(port)s/%(db)s' % POSTGRES
+
+
+class Config(object):
+    """Settings of the production configuration, the others start from it.
+    Most can be changed through environment variables of the same name
+    """
+    DEBUG = False
+    TESTING = False
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', DB_URI)
+    # connections kept open per process and per database, the extra ones
+    # opened under load, the seconds a request waits for a connection before
+    # failing and the age in seconds after which connections are replaced
+    # (-1 never). Pre-ping tests connections before handing them out
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 5))
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+    DATABASE_POOL_TIMEOUT = float(os.environ.get('DATABASE_POOL_TIMEOUT', 30))
+    DATABASE_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE', -1))
+    DATABASE_POOL_PRE_PING = os.environ.get('DATABASE_POOL_PRE_PING', '').lower() in ('1', 'true')
+    # milliseconds a statement run by a request may take before it is
+    # cancelled and the request answered with 503, 0 disables the limit
+    DATABASE_STATEMENT_TIMEOUT = int(os.environ.get('DATABASE_STATEMENT_TIMEOUT', 0))
+    # read only handlers query the replicas listed, comma separated, in
+    # DATABASE_REPLICA_URLS. Clients that wrote read from the primary for
+    # REPLICA_PIN seconds, a replica lagging more than REPLICA_MAX_LAG seconds
+    # at its last check, done every REPLICA_CHECK_INTERVAL seconds, is skipped
+    # and one that failed is skipped for REPLICA_RETRY seconds
+    SQLALCHEMY_BINDS = {
+        'replica_{}'.format(number): url for number, url in enumerate(
+            url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url)
+    }
+    REPLICA_PIN = float(os.environ.get('REPLICA_PIN', 5))
+    REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 1))
+    REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', 1))
+    REPLICA_RETRY = float(os.environ.get('REPLICA_RETRY', 10))
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'this-really-needs-to-be-changed')
+    # verified tokens are cached per process to skip the signature check on
+    # every request, the blacklist filter is still checked
+    TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+    TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', 300))
+    # seconds a worker may keep using a user's token version after another
+    # worker revoked the user's tokens
+    TOKEN_VERSION_CACHE_TTL = int(os.environ.get('TOKEN_VERSION_CACHE_TTL', 30))
+    # revoked tokens are kept in an in-memory filter so most requests skip
+    # the blacklist table, tokens revoked by other workers are picked up
+    # after BLACKLIST_FILTER_REFRESH seconds. Each refresh reads the tokens
+    # revoked since BLACKLIST_FILTER_OVERLAP seconds before the previous one,
+    # longer than any transaction and the clock skew between hosts
+    BLACKLIST_FILTER = True
+    BLACKLIST_FILTER_CAPACITY = 100000
+    BLACKLIST_FILTER_REFRESH = int(os.environ.get('BLACKLIST_FILTER_REFRESH', 5))
+    BLACKLIST_FILTER_OVERLAP = int(os.environ.get('BLACKLIST_FILTER_OVERLAP', 60))
+    # interval in seconds between sweeps of expired blacklisted tokens, 0 disables
+    BLACKLIST_SWEEP_INTERVAL = int(os.environ.get('BLACKLIST_SWEEP_INTERVAL', 0))
+    # deleting accounts and shopping lists only marks them deleted, the reaper
+    # removes them in batches of REAPER_BATCH_SIZE rows, pausing REAPER_PAUSE
+    # seconds between batches, every REAPER_INTERVAL seconds (0 disables the
+    # in-process reaper, run python manage.py reap_deleted instead)
+    SOFT_DELETE = os.environ.get('SOFT_DELETE', '').lower() in ('1', 'true')
+    REAPER_INTERVAL = int(os.environ.get('REAPER_INTERVAL', 0))
+    REAPER_BATCH_SIZE = int(os.environ.get('REAPER_BATCH_SIZE', 500))
+    REAPER_PAUSE = float(os.environ.get('REAPER_PAUSE', 0.1))
+    # upper bound on the page size of cursor paginated endpoints
+    MAX_PAGE_SIZE = 100
+    # items nested in each shopping list with ?include=items unless the
+    # request asks for fewer or more, up to MAX_PAGE_SIZE
+    EMBEDDED_ITEMS_LIMIT = 20
+    # rows fetched per round trip by streaming endpoints
+    STREAM_BATCH_SIZE = 500
+    # largest number of items that can be added in one request
+    MAX_BULK_ITEMS = 1000
+    # records inserted per transaction by imports
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+    # method and cost of new password hashes, stored hashes made otherwise
+    # are upgraded when their user logs in
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:150000')
+    # processes computing password hashes off the request threads, 0 hashes
+    # on the request thread, and the number of hashes that may wait for them
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 0))
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 64))
+    # GET responses of shopping lists and items can be cached: 'null' turns the
+    # cache off, 'local' keeps it in each process, 'shared' in a file shared by
+    # the workers of a host and 'redis' in the redis server at RESPONSE_CACHE_URL
+    RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', 'null')
+    RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL', 'redis://localhost:6379/0')
+    RESPONSE_CACHE_PATH = os.environ.get('RESPONSE_CACHE_PATH', os.path.join(
+        '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+        'shoppinglist-responses.db'))
+    RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 10000))
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 60))
+    # larger responses are not cached, in bytes
+    RESPONSE_CACHE_MAX_ENTRY_SIZE = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRY_SIZE', 65536))
+    # GET /api/metrics is only served to requests sending this token as their
+    # Authorization header, it is disabled when empty
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+    # threads running the requests of the ASGI entry point, 0 runs as many as
+    # the database connections a process may open
+    ASGI_WORKERS = int(os.environ.get('ASGI_WORKERS', 0))
+
+
+class DevelopmentConfig(Config):
+    """Debugger and reloader for the development server"""
+    DEBUG = True
+
+
+class TestConfig(Config):
+    """Runs the tests against TEST_DATABASE_URL, or DATABASE_URL, and with
+    TEST_ASGI=true through the ASGI entry point
+    """
+    TESTING = True
+    METRICS_TOKEN = 'test-metrics-token'
+    SERVE_THROUGH_ASGI = os.environ.get('TEST_ASGI', '').lower() in ('1', 'true')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL', Config.SQLALCHEMY_DATABASE_URI)
+
+
+class BenchmarkConfig(Config):
+    """Production settings on the scratch database at BENCHMARK_DATABASE_URL,
+    or DATABASE_URL
+    """
+    SQLALCHEMY_DATABASE_URI = os.environ.get('BENCHMARK_DATABASE_URL',
+                                             Config.SQLALCHEMY_DATABASE_URI)
+
+
+configs = {
+    'production': Config,
+    'development': DevelopmentConfig,
+    'test': TestConfig,
+    'benchmark': BenchmarkConfig
+}
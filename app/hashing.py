@@ -0,0 +1,116 @@
+import os
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+from werkzeug.security import (DEFAULT_PBKDF2_ITERATIONS, check_password_hash,
+                               generate_password_hash)
+
+
+class HashingBusy(Exception):
+    """Raised when too many password hashes are already waiting"""
+
+
+class HashingPool(object):
+    """Runs password hashing in a pool of worker processes so that request
+    threads are not blocked on the CPU. At most max_pending hashes may wait
+    for or run in the pool, further requests are turned away
+    """
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        # forked workers start their own processes
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._pid = os.getpid()
+        return self._executor
+
+    def run(self, func, *args):
+        """Return func(*args) computed by a worker process"""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingBusy()
+            self.pending += 1
+        started = time.perf_counter()
+        try:
+            return self.executor().submit(func, *args).result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+                self.wait_time += time.perf_counter() - started
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown()
+        self._executor = None
+
+    def stats(self):
+        """Return the queue depth and counters of the pool"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'pending': self.pending,
+                'max_pending': self.max_pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'mean_ms': 1000.0 * self.wait_time / self.completed if self.completed else 0.0
+            }
+
+
+def hashing_pool():
+    """Return the hashing pool of the current app, or None when hashes are
+    computed on the request thread
+    """
+    if 'hashing_pool' not in current_app.extensions:
+        workers = current_app.config['PASSWORD_HASH_WORKERS']
+        current_app.extensions['hashing_pool'] = HashingPool(
+            workers, current_app.config['PASSWORD_HASH_MAX_PENDING']) if workers else None
+    return current_app.extensions['hashing_pool']
+
+
+def hash_password(password):
+    """Return the hash of a password with the configured method"""
+    method = current_app.config['PASSWORD_HASH_METHOD']
+    pool = hashing_pool()
+    if pool is None:
+        return generate_password_hash(password, method)
+    return pool.run(generate_password_hash, password, method)
+
+
+def check_password(pwhash, password):
+    """Return whether password matches the hash"""
+    pool = hashing_pool()
+    if pool is None:
+        return check_password_hash(pwhash, password)
+    return pool.run(check_password_hash, pwhash, password)
+
+
+def needs_rehash(pwhash):
+    """Return whether a hash was made with another method or cost than the
+    configured one
+    """
+    return pwhash.split('$', 1)[0] != stored_method(
+        current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def stored_method(method):
+    """Return the method prefix werkzeug stores for hashes made with method,
+    pbkdf2 without a cost is stored with werkzeug's default iterations
+    """
+    if not method.startswith('pbkdf2:'):
+        return method
+    args = method[7:].split(':')
+    iterations = len(args) > 1 and int(args[1] or 0) or DEFAULT_PBKDF2_ITERATIONS
+    return 'pbkdf2:{}:{}'.format(args[0], iterations)
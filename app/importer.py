@@ -0,0 +1,177 @@
+import csv
+import json
+from datetime import datetime
+from app import db
+from app.models import Items, ShoppingLists, Users, too_long
+
+DATE_FORMATS = ['%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d']
+# at most this many errors are kept in the report, the rest are counted
+MAX_REPORTED_ERRORS = 100
+
+
+def read_ndjson(lines):
+    """Yield (line, kind, list key, data) for every record of newline
+    delimited JSON as written by the export. Items refer to their list by
+    shopping_list_id or are nested in the list's items
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield number, 'error', None, 'Invalid JSON'
+            continue
+        if not isinstance(record, dict):
+            yield number, 'error', None, 'Record must be an object'
+        elif record.get('type') == 'shopping_list':
+            key = record.get('id', 'line {}'.format(number))
+            yield number, 'shopping_list', key, record
+            for item in record.get('items') or []:
+                yield number, 'item', key, item
+        elif record.get('type') == 'item':
+            yield number, 'item', record.get('shopping_list_id'), record
+        else:
+            yield number, 'error', None, 'Record type must be shopping_list or item'
+
+
+def read_csv(lines):
+    """Yield (line, kind, list key, data) for every row of a csv with the
+    columns shopping_list, due_date, name, quantity, bought_from and status.
+    Each row is an item of the list named in shopping_list, a row without
+    an item name adds an empty list
+    """
+    seen = set()
+    for number, row in enumerate(csv.DictReader(lines), 2):
+        key = (row.get('shopping_list'), row.get('due_date') or None)
+        if key not in seen:
+            seen.add(key)
+            yield number, 'shopping_list', key, {'name': key[0], 'due_date': key[1]}
+        if not row.get('name'):
+            continue
+        quantity = row.get('quantity')
+        if quantity and quantity.strip().lstrip('-').isdigit():
+            quantity = int(quantity)
+        yield number, 'item', key, {'name': row['name'], 'quantity': quantity,
+                                    'bought_from': row.get('bought_from') or None,
+                                    'status': row.get('status') or None}
+
+
+def validate_shopping_list(data):
+    """Return the shopping list fields to save from a record and an error
+    message if the record is not a valid shopping list
+    """
+    name = data.get('name')
+    due_date = data.get('due_date')
+    if not name or not isinstance(name, str):
+        return None, 'Shopping list name is required'
+    if too_long(ShoppingLists, {'name': name}):
+        return None, 'Shopping list name is too long'
+    if due_date is not None:
+        for date_format in DATE_FORMATS:
+            try:
+                due_date = datetime.strptime(str(due_date), date_format)
+                break
+            except ValueError:
+                pass
+        else:
+            return None, 'Shopping list due_date must be an ISO 8601 date'
+    return {'name': name, 'due_date': due_date}, None
+
+
+class Importer(object):
+    """Add the shopping lists and items read from a file to a user's
+    account. Records are inserted in batches of batch_size, each batch in
+    its own transaction, and invalid records are reported without
+    stopping the import
+    """
+
+    def __init__(self, user_id, batch_size=1000, progress=None):
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.progress = progress
+        # ids of the imported lists by their key in the file
+        self.list_ids = {}
+        self.pending_lists = []
+        self.pending_items = []
+        self.shopping_lists = 0
+        self.items = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message):
+        """Record the error of a line of the file"""
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'message': message})
+
+    def run(self, records):
+        """Import records as yielded by read_ndjson or read_csv and return
+        the report
+        """
+        pending_keys = set()
+        for line, kind, key, data in records:
+            if kind == 'shopping_list':
+                row, error = validate_shopping_list(data)
+                if error:
+                    self.error(line, error)
+                elif key in self.list_ids or key in pending_keys:
+                    self.error(line, 'Duplicate shopping list')
+                else:
+                    pending_keys.add(key)
+                    self.pending_lists.append((line, key, dict(row, user_id=self.user_id)))
+            elif kind == 'item':
+                row, error = Items.validate(data)
+                if error:
+                    self.error(line, error)
+                elif key not in self.list_ids and key not in pending_keys:
+                    self.error(line, 'Item of a shopping list that is not imported')
+                else:
+                    self.pending_items.append((line, key, row))
+            else:
+                self.error(line, data)
+            if len(self.pending_lists) + len(self.pending_items) >= self.batch_size:
+                self.flush()
+                pending_keys = set()
+        self.flush()
+        return self.report()
+
+    def flush(self):
+        """Insert the pending lists and items in one transaction"""
+        if not self.pending_lists and not self.pending_items:
+            return
+        lists, items = self.pending_lists, self.pending_items
+        self.pending_lists, self.pending_items = [], []
+        try:
+            ids = ShoppingLists.insert_rows([row for line, key, row in lists])
+            new_ids = dict(zip([key for line, key, row in lists], ids))
+            rows = [dict(row, shopping_list_id=new_ids.get(key) or self.list_ids[key])
+                    for line, key, row in items]
+            Items.insert_rows(rows)
+            if rows:
+                # lists imported by earlier batches may have gained items
+                ShoppingLists.touch(row['shopping_list_id'] for row in rows)
+            Users.touch_lists([self.user_id])
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            # later items of the lost lists are reported when they are read
+            first_line = min(line for line, key, row in lists + items)
+            self.error(first_line, 'Batch not imported: {}'.format(
+                error.__class__.__name__))
+            return
+        self.list_ids.update(new_ids)
+        self.shopping_lists += len(lists)
+        self.items += len(items)
+        if self.progress:
+            self.progress(self.report())
+
+    def report(self):
+        """Return the number of imported lists and items and the errors"""
+        return {
+            'shopping_lists': self.shopping_lists,
+            'items': self.items,
+            'error_count': self.error_count,
+            'errors': self.errors
+        }
@@ -1,19 +1,77 @@
-from werkzeug.security import generate_password_hash
 from datetime import datetime, timedelta
+import io
+import time
+import hashlib
+import threading
 import jwt
-from app import app, db
+from flask import current_app
+from app import db
+from app.bloom import BloomFilter
+from app.cache import LRUCache, response_cache
+from app.hashing import hash_password
+from app.pagination import keyset_page
+
+# maps a verified token to the user id and token version it was issued for
+token_cache = LRUCache()
+# maps a user id to the current token version of the account
+token_version_cache = LRUCache()
+
+
+def init_app(app):
+    """Size the token caches of the process from the configuration of app"""
+    token_cache.maxsize = app.config['TOKEN_CACHE_SIZE']
+    token_cache.ttl = app.config['TOKEN_CACHE_TTL']
+    token_version_cache.maxsize = app.config['TOKEN_CACHE_SIZE']
+    token_version_cache.ttl = app.config['TOKEN_VERSION_CACHE_TTL']
+
+
+def mark_changed(names):
+    """Remember the users and shopping lists whose cached responses
+    become stale once the current transaction commits
+    """
+    db.session.info.setdefault('changed', set()).update(names)
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def invalidate_responses(session):
+    changed = session.info.pop('changed', None)
+    if changed:
+        cache = response_cache()
+        if cache is not None:
+            cache.invalidate(changed)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def forget_changes(session):
+    session.info.pop('changed', None)
+
 
 class Users(db.Model):
     """Class for user attributes and methods"""
+    __table_args__ = (
+        # serves the reaper
+        db.Index('ix_users_deleted_at', 'deleted_at',
+                 postgresql_where=db.text('deleted_at IS NOT NULL'),
+                 sqlite_where=db.text('deleted_at IS NOT NULL')),
+    )
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True)
     email = db.Column(db.String(120), unique=True)
     password = db.Column(db.String(500))
+    # bumped to revoke every token issued to the user at once
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # bumped whenever any of the user's shopping lists or their items change
+    lists_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    lists_updated_at = db.Column(db.DateTime)
+    # set when the account is deleted, the reaper removes it later
+    deleted_at = db.Column(db.DateTime)
 
     def __init__(self, username, email, password):
         self.username = username
         self.email = email
-        self.password = generate_password_hash(password)
+        self.password = hash_password(password)
+        self.token_version = 0
+        self.lists_version = 0
 
     def save(self):
         """Save new users and changes to the database"""
@@ -23,7 +81,54 @@ class Users(db.Model):
     def delete(self):
         """Delete user from the database"""
         db.session.delete(self)
+        mark_changed(['user:{}'.format(self.id)])
+        db.session.commit()
+        token_version_cache.delete(self.id)
+
+    def soft_delete(self):
+        """Mark the user deleted, the account and everything it owns are
+        removed by the reaper. The username and email are freed at once
+        so that they can be registered again
+        """
+        self.deleted_at = datetime.utcnow()
+        self.username = None
+        self.email = None
+        mark_changed(['user:{}'.format(self.id)])
+        db.session.commit()
+        token_version_cache.delete(self.id)
+
+    @staticmethod
+    def active():
+        """Return a query for the users that are not deleted"""
+        return Users.query.filter(Users.deleted_at.is_(None))
+
+    @staticmethod
+    def purge_deleted(batch_size):
+        """Delete up to batch_size deleted users who no longer own any
+        shopping list and return the number deleted
+        """
+        ids = db.session.query(Users.id).filter(
+            Users.deleted_at.isnot(None),
+            ~db.exists().where(ShoppingLists.user_id == Users.id)).limit(batch_size)
+        count = Users.query.filter(Users.id.in_(ids.subquery())).delete(
+            synchronize_session=False)
         db.session.commit()
+        return count
+
+    @staticmethod
+    def touch_lists(user_ids):
+        """Bump the version stamp of the users' shopping list collections"""
+        mark_changed('user:{}'.format(user_id) for user_id in user_ids)
+        Users.query.filter(Users.id.in_(user_ids)).update({
+            Users.lists_version: Users.lists_version + 1,
+            Users.lists_updated_at: datetime.utcnow()
+        }, synchronize_session=False)
+
+    def revoke_tokens(self):
+        """Invalidate all tokens issued to the user so far"""
+        self.token_version = Users.token_version + 1
+        self.save()
+        token_version_cache.delete(self.id)
 
     def generate_token(self, user_id):
         """Generate token for authentication and return string"""
@@ -32,46 +137,105 @@ class Users(db.Model):
             payload = {
                 'exp': datetime.utcnow() + timedelta(minutes=60),
                 'iat': datetime.utcnow(),
-                'sub': user_id
+                'sub': user_id,
+                'ver': self.token_version or 0
             }
             return jwt.encode(
                 payload,
-                app.config.get('SECRET_KEY'),
+                current_app.config.get('SECRET_KEY'),
                 algorithm='HS256'
             )
         except Exception as e:
             return str(e)
 
+    @staticmethod
+    def current_token_version(user_id):
+        """Return the token version of the user or -1 if the account
+        no longer exists or is deleted
+        """
+        version = token_version_cache.get(user_id)
+        if version is None:
+            version = db.session.query(Users.token_version).filter(
+                Users.id == user_id, Users.deleted_at.is_(None)).scalar()
+            if version is None:
+                version = -1
+            token_version_cache.set(user_id, version)
+        return version
+
     @staticmethod
     def decode_token(token):
         """Decodes token from the authorization header"""
-        try:
-            # try to decode the token using the secret variable
-            payload = jwt.decode(token, app.config.get('SECRET_KEY'))
-            is_blacklisted_token = BlacklistTokens.check_blacklist(token)
-            if is_blacklisted_token:
-                return 'You are logged out. Please log in again.'
-            else:
-                return payload['sub']
-        except jwt.ExpiredSignatureError:
-            # token has expired, return n error string
-            return "Expired token. Please login to get new token"
-        except jwt.InvalidTokenError:
-            return "Invalid token. Please register or login"
+        cached = token_cache.get(token)
+        if cached is None:
+            try:
+                # try to decode the token using the secret variable
+                payload = jwt.decode(token, current_app.config.get('SECRET_KEY'))
+            except jwt.ExpiredSignatureError:
+                # token has expired, return n error string
+                return "Expired token. Please login to get new token"
+            except jwt.InvalidTokenError:
+                return "Invalid token. Please register or login"
+            # cache the user id until the token expires at the latest
+            cached = (payload['sub'], payload.get('ver', 0))
+            token_cache.set(token, cached, expires_at=payload['exp'])
+        # checked on cache hits too, other workers revoke tokens cached here
+        # and the in-memory filter rules out most tokens without a query
+        if BlacklistTokens.check_blacklist(token):
+            return 'You are logged out. Please log in again.'
+        user_id, version = cached
+        # tokens issued before the user's last revocation are no longer valid
+        if Users.current_token_version(user_id) != version:
+            return 'You are logged out. Please log in again.'
+        return user_id
 
 
     def __repr__(self):
         return '<User %r>' % self.username
 
 
+# search capability detected per database url
+_search_backends = {}
+# fts5 table kept in sync with shopping list names on sqlite by triggers
+shopping_lists_fts = db.table('shopping_lists_fts',
+                              db.column('rowid'),
+                              db.column('name'),
+                              db.column('rank'))
+
+
+# prefix filters and sorts compare usernames and emails byte by byte, on
+# postgres these indexes serve them, sqlite's unique indexes already do
+for column_name in ('username', 'email'):
+    db.event.listen(Users.__table__, 'after_create', db.DDL(
+        'CREATE INDEX ix_users_{0}_c ON users ({0} COLLATE "C")'.format(
+            column_name)).execute_if(dialect='postgresql'))
+
+
 class ShoppingLists(db.Model):
     """Class with methods for a shopping list"""
+    __table_args__ = (
+        # serves listing a user's shopping lists by due date and lookups by
+        # id, deleted lists are left out of the index
+        db.Index('ix_shopping_lists_user_id_due_date_id', 'user_id', 'due_date', 'id',
+                 postgresql_where=db.text('deleted_at IS NULL'),
+                 sqlite_where=db.text('deleted_at IS NULL')),
+        # serves the reaper
+        db.Index('ix_shopping_lists_deleted_at', 'deleted_at',
+                 postgresql_where=db.text('deleted_at IS NOT NULL'),
+                 sqlite_where=db.text('deleted_at IS NOT NULL')),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80))
     due_date = db.Column(db.DateTime)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+    # bumped whenever the shopping list or its items change
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow,
+                           server_default=db.func.now())
+    # set when the shopping list is deleted, the reaper removes it later
+    deleted_at = db.Column(db.DateTime)
     user = db.relationship('Users',
-                           backref=db.backref('shopping_lists', cascade="all,delete", lazy='dynamic'))
+                           backref=db.backref('shopping_lists', cascade="all,delete", lazy='dynamic',
+                                              passive_deletes=True))
 
     def __init__(self, name, user_id, due_date=None):
         self.name = name
@@ -81,27 +245,182 @@ class ShoppingLists(db.Model):
     def __repr__(self):
         return '<Shopping List: %r>' % self.name
 
+    @staticmethod
+    def search_backend():
+        """Return the search capability of the database, trigram on
+        postgres with pg_trgm, fts5 on sqlite with the search table
+        created by the migrations and like everywhere else
+        """
+        bind = db.session.get_bind()
+        url = str(bind.url)
+        if url not in _search_backends:
+            backend = 'like'
+            if bind.dialect.name == 'postgresql':
+                if db.session.execute(
+                        "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").first():
+                    backend = 'trigram'
+            elif bind.dialect.name == 'sqlite':
+                if db.session.execute(
+                        "SELECT 1 FROM sqlite_master WHERE name = 'shopping_lists_fts'").first():
+                    backend = 'fts5'
+            _search_backends[url] = backend
+        return _search_backends[url]
+
+    @staticmethod
+    def search(query, key):
+        """Restrict query to shopping lists whose name matches key and
+        return it with an expression to rank the matches by, best first
+        """
+        key = key.strip()
+        backend = ShoppingLists.search_backend()
+        pattern = '%' + key.replace('\\', '\\\\').replace(
+            '%', '\\%').replace('_', '\\_') + '%'
+        if backend == 'trigram':
+            # the % operator matches names similar enough to tolerate typos,
+            # both it and ilike are served by the trigram index, the operator
+            # is doubled since psycopg2 uses percent placeholders
+            query = query.filter(db.or_(
+                ShoppingLists.name.ilike(pattern, escape='\\'),
+                ShoppingLists.name.op('%%')(key)))
+            rank = db.func.similarity(ShoppingLists.name, key)
+            return query, rank.desc()
+        if backend == 'fts5' and len(key) >= 3:
+            # the trigram tokenizer needs at least three characters
+            query = query.join(
+                shopping_lists_fts, shopping_lists_fts.c.rowid == ShoppingLists.id).filter(
+                    db.literal_column('shopping_lists_fts').op('MATCH')(
+                        '"' + key.replace('"', '""') + '"'))
+            return query, shopping_lists_fts.c.rank
+        query = query.filter(ShoppingLists.name.ilike(pattern, escape='\\'))
+        return query, None
+
+    @staticmethod
+    def page_after(query, due_date, last_id, limit):
+        """Return up to limit shopping lists of query after (due_date, id)
+        when sorting by due date with lists without one last
+        """
+        return keyset_page(query, ShoppingLists.due_date, ShoppingLists.id,
+                           due_date, last_id, limit)
+
     def save(self):
         """Save new users and changes to the database"""
+        if self.id is not None:
+            self.version = ShoppingLists.version + 1
+            mark_changed(['list:{}'.format(self.id)])
+        self.updated_at = datetime.utcnow()
         db.session.add(self)
+        Users.touch_lists([self.user_id])
         db.session.commit()
 
     def delete(self):
         """Delete shopping list from the database"""
         db.session.delete(self)
+        mark_changed(['list:{}'.format(self.id)])
+        Users.touch_lists([self.user_id])
         db.session.commit()
 
+    def soft_delete(self):
+        """Mark the shopping list deleted, it is removed with its items by
+        the reaper
+        """
+        self.deleted_at = datetime.utcnow()
+        mark_changed(['list:{}'.format(self.id)])
+        Users.touch_lists([self.user_id])
+        db.session.commit()
+
+    @staticmethod
+    def active(user_id):
+        """Return a query for the user's shopping lists that are not deleted"""
+        return ShoppingLists.query.filter(ShoppingLists.user_id == user_id,
+                                          ShoppingLists.deleted_at.is_(None))
+
+    @staticmethod
+    def mark_orphans(batch_size):
+        """Mark up to batch_size shopping lists of deleted users deleted
+        and return the number marked
+        """
+        deleted_users = db.session.query(Users.id).filter(Users.deleted_at.isnot(None))
+        ids = db.session.query(ShoppingLists.id).filter(
+            ShoppingLists.user_id.in_(deleted_users.subquery()),
+            ShoppingLists.deleted_at.is_(None)).limit(batch_size)
+        count = ShoppingLists.query.filter(ShoppingLists.id.in_(ids.subquery())).update(
+            {ShoppingLists.deleted_at: datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        return count
+
+    @staticmethod
+    def purge_deleted(batch_size):
+        """Delete up to batch_size deleted shopping lists that no longer
+        have items and return the number deleted
+        """
+        ids = db.session.query(ShoppingLists.id).filter(
+            ShoppingLists.deleted_at.isnot(None),
+            ~db.exists().where(Items.shopping_list_id == ShoppingLists.id)).limit(batch_size)
+        count = ShoppingLists.query.filter(ShoppingLists.id.in_(ids.subquery())).delete(
+            synchronize_session=False)
+        db.session.commit()
+        return count
+
+    @staticmethod
+    def touch(list_ids):
+        """Bump the version stamps of shopping lists whose items changed and
+        of their owners' collections
+        """
+        list_ids = list(set(int(list_id) for list_id in list_ids))
+        ShoppingLists.query.filter(ShoppingLists.id.in_(list_ids)).update({
+            ShoppingLists.version: ShoppingLists.version + 1,
+            ShoppingLists.updated_at: datetime.utcnow()
+        }, synchronize_session=False)
+        mark_changed('list:{}'.format(list_id) for list_id in list_ids)
+        owners = db.session.query(ShoppingLists.user_id).filter(
+            ShoppingLists.id.in_(list_ids)).distinct()
+        Users.touch_lists([owner.user_id for owner in owners])
+
+    @staticmethod
+    def insert_rows(rows):
+        """Insert shopping list rows in the current transaction and return
+        their ids in the order of rows
+        """
+        if not rows:
+            # an empty multi-row insert is a single row of defaults
+            return []
+        table = ShoppingLists.__table__
+        if db.session.get_bind().dialect.name == 'postgresql':
+            statement = table.insert().values(rows).returning(table.c.id)
+            return [row_id for row_id, in db.session.execute(statement)]
+        # executemany does not return ids, statements are cheap on sqlite
+        return [db.session.execute(table.insert(), row).inserted_primary_key[0]
+                for row in rows]
+
+
+def too_long(model, row):
+    """Return the first string field of row longer than its column allows"""
+    for name, value in row.items():
+        length = getattr(getattr(model, name).type, 'length', None)
+        if isinstance(value, str) and length and len(value) > length:
+            return name
+    return None
+
 
 class Items(db.Model):
     """Class for the Items in a shopping list"""
+    __table_args__ = (
+        # serve loading the items of a shopping list in order, sorted by
+        # name and filtered by status or shop
+        db.Index('ix_items_shopping_list_id_id', 'shopping_list_id', 'id'),
+        db.Index('ix_items_shopping_list_id_name_id', 'shopping_list_id', 'name', 'id'),
+        db.Index('ix_items_shopping_list_id_status_id', 'shopping_list_id', 'status', 'id'),
+        db.Index('ix_items_shopping_list_id_bought_from_id', 'shopping_list_id', 'bought_from', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80))
     quantity = db.Column(db.Integer)
     bought_from = db.Column(db.String(120))
     status = db.Column(db.Boolean)
-    shopping_list_id = db.Column(db.Integer, db.ForeignKey('shopping_lists.id'))
+    shopping_list_id = db.Column(db.Integer, db.ForeignKey('shopping_lists.id', ondelete='CASCADE'))
     shopping_list = db.relationship('ShoppingLists',
-                                    backref=db.backref('items', cascade="all,delete", lazy='dynamic'))
+                                    backref=db.backref('items', cascade="all,delete", lazy='dynamic',
+                                                       passive_deletes=True))
 
     def __init__(self, name, quantity, shopping_list_id, bought_from=None, status=None):
         self.name = name
@@ -113,39 +432,285 @@ class Items(db.Model):
     def __repr__(self):
         return '<Item %r>' % self.name
 
+    @staticmethod
+    def validate(data):
+        """Return the item fields to save from request data and an error
+        message if the data is not a valid item
+        """
+        if not isinstance(data, dict):
+            return None, 'Item must be an object'
+        name = data.get('name')
+        quantity = data.get('quantity')
+        bought_from = data.get('bought_from')
+        status = data.get('status')
+        if not name or not isinstance(name, str):
+            return None, 'Item name is required'
+        if isinstance(quantity, bool) or not isinstance(quantity, int):
+            return None, 'Item quantity must be a number'
+        if bought_from is not None and not isinstance(bought_from, str):
+            return None, 'Item bought_from must be a string'
+        # clients send the status as a boolean or as a string
+        if isinstance(status, str) and status.lower() in ('true', 'false'):
+            status = status.lower() == 'true'
+        if status is not None and not isinstance(status, bool):
+            return None, 'Item status must be true or false'
+        row = {'name': name, 'quantity': quantity,
+               'bought_from': bought_from, 'status': status}
+        if too_long(Items, row):
+            return None, 'Item {} is too long'.format(too_long(Items, row))
+        return row, None
+
     def save(self):
         """Save new users and changes to the database"""
         db.session.add(self)
+        # an item moved to another list changes both lists
+        list_ids = [self.shopping_list_id]
+        list_ids.extend(db.inspect(self).attrs.shopping_list_id.history.deleted)
+        ShoppingLists.touch(list_ids)
         db.session.commit()
 
     def delete(self):
         """Delete item from the database"""
         db.session.delete(self)
+        ShoppingLists.touch([self.shopping_list_id])
+        db.session.commit()
+
+    @staticmethod
+    def find_owned(user_id, shopping_list_id, item_id):
+        """Return the shopping list owned by the user and the item when it
+        belongs to that list, in one query. The item is None if it is not
+        in the list and nothing is returned if the list is not the user's.
+        """
+        return db.session.query(ShoppingLists, Items).outerjoin(
+            Items, db.and_(Items.shopping_list_id == ShoppingLists.id,
+                           Items.id == item_id)).filter(
+                ShoppingLists.user_id == user_id,
+                ShoppingLists.id == shopping_list_id,
+                ShoppingLists.deleted_at.is_(None)).first()
+
+    @staticmethod
+    def purge_deleted(batch_size):
+        """Delete up to batch_size items of deleted shopping lists and
+        return the number deleted
+        """
+        deleted_lists = db.session.query(ShoppingLists.id).filter(
+            ShoppingLists.deleted_at.isnot(None))
+        ids = db.session.query(Items.id).filter(
+            Items.shopping_list_id.in_(deleted_lists.subquery())).limit(batch_size)
+        count = Items.query.filter(Items.id.in_(ids.subquery())).delete(
+            synchronize_session=False)
+        db.session.commit()
+        return count
+
+    @staticmethod
+    def select_in_list(shopping_list_id, ids=None, status=None, bought_from=None):
+        """Return a query for the items of a shopping list with the given
+        ids or matching the given fields
+        """
+        query = Items.query.filter(Items.shopping_list_id == shopping_list_id)
+        if ids is not None:
+            query = query.filter(Items.id.in_(ids))
+        if status is not None:
+            query = query.filter(Items.status == status)
+        if bought_from is not None:
+            query = query.filter(Items.bought_from == bought_from)
+        return query
+
+    @staticmethod
+    def first_in_lists(list_ids, limit, names):
+        """Return a query for the columns of names of the first limit items
+        by id of every shopping list in list_ids, read in one query. On
+        postgres a lateral subquery reads at most limit items of each list
+        from the index, elsewhere a window function numbers all the items
+        of the lists
+        """
+        columns = [getattr(Items, name) for name in names if name != 'id']
+        if db.session.get_bind().dialect.name == 'postgresql':
+            first = db.session.query(Items.shopping_list_id, Items.id, *columns).filter(
+                Items.shopping_list_id == ShoppingLists.id).order_by(
+                    Items.id).limit(limit).subquery().lateral()
+            return db.session.query(first).select_from(ShoppingLists).join(
+                first, db.true()).filter(ShoppingLists.id.in_(list_ids)).order_by(
+                    first.c.shopping_list_id, first.c.id)
+        number = db.func.row_number().over(
+            partition_by=Items.shopping_list_id, order_by=Items.id).label('number')
+        ranked = db.session.query(Items.shopping_list_id, Items.id, number, *columns).filter(
+            Items.shopping_list_id.in_(list_ids)).subquery()
+        return db.session.query(ranked).filter(ranked.c.number <= limit).order_by(
+            ranked.c.shopping_list_id, ranked.c.id)
+
+    @staticmethod
+    def bulk_update(list_ids, query, values):
+        """Apply values to every item of query in one statement and
+        return the number of items updated, list_ids are the shopping
+        lists the change affects
+        """
+        count = query.update(values, synchronize_session=False)
+        ShoppingLists.touch(list_ids)
+        db.session.commit()
+        return count
+
+    @staticmethod
+    def bulk_delete(shopping_list_id, query):
+        """Delete every item of query in one statement and return the
+        number of items deleted
+        """
+        count = query.delete(synchronize_session=False)
+        ShoppingLists.touch([shopping_list_id])
         db.session.commit()
+        return count
+
+    @staticmethod
+    def bulk_create(shopping_list_id, rows):
+        """Insert many items into a shopping list in one transaction and
+        return their ids in the order of rows
+        """
+        rows = [dict(row, shopping_list_id=shopping_list_id) for row in rows]
+        if db.session.get_bind().dialect.name == 'postgresql':
+            # one multi-row insert returning the new ids
+            statement = Items.__table__.insert().values(rows).returning(Items.id)
+            ids = [row_id for row_id, in db.session.execute(statement)]
+        else:
+            items = [Items(**row) for row in rows]
+            db.session.add_all(items)
+            db.session.flush()
+            ids = [item.id for item in items]
+        ShoppingLists.touch([shopping_list_id])
+        db.session.commit()
+        return ids
+
+    @staticmethod
+    def insert_rows(rows):
+        """Insert item rows in the current transaction, postgres loads
+        them with COPY and other databases with executemany
+        """
+        if not rows:
+            return
+        columns = ['shopping_list_id', 'name', 'quantity', 'bought_from', 'status']
+        if db.session.get_bind().dialect.name != 'postgresql':
+            db.session.execute(Items.__table__.insert(), rows)
+            return
+        def copy_value(value):
+            # strings are quoted so that only missing values load as null
+            if value is None:
+                return ''
+            if isinstance(value, str):
+                return '"' + value.replace('"', '""') + '"'
+            return str(value)
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(','.join(copy_value(row[column]) for column in columns) + '\n')
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert('COPY items ({}) FROM STDIN WITH (FORMAT csv)'.format(
+            ', '.join(columns)), buffer)
 
 
 class BlacklistTokens(db.Model):
     """Class for storing blacklisted tokens"""
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    token = db.Column(db.String(500), unique=True, nullable=False)
+    # tokens are stored as fixed width digests to keep the index narrow
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
     blacklisted_on = db.Column(db.DateTime, nullable=False)
 
+    # in-memory filter of revoked token hashes shared by this process
+    _filter = None
+    # refreshes read the rows blacklisted since this time
+    _filter_since = None
+    _filter_refreshed_at = 0
+    _filter_lock = threading.Lock()
+
     def __init__(self, token):
         self.token = token
+        self.token_hash = BlacklistTokens.hash_token(token)
+        # the signature was verified before the token got here
+        payload = jwt.decode(token, verify=False)
+        self.expires_at = datetime.utcfromtimestamp(payload['exp'])
         self.blacklisted_on = datetime.utcnow()
 
     def save(self):
         db.session.add(self)
         db.session.commit()
+        BlacklistTokens._add_to_filter(self.token_hash)
+        # the token must stop working immediately
+        token_cache.delete(self.token)
+
+    @staticmethod
+    def hash_token(token):
+        """Return the hex digest under which a token is blacklisted"""
+        if isinstance(token, str):
+            token = token.encode()
+        return hashlib.sha256(token).hexdigest()
 
     @staticmethod
     def check_blacklist(token):
         # check whether token has been blacklisted
-        res = BlacklistTokens.query.filter_by(token=str(token)).first()
+        token_hash = BlacklistTokens.hash_token(token)
+        if not BlacklistTokens._might_be_blacklisted(token_hash):
+            return False
+        res = db.session.query(BlacklistTokens.id).filter_by(
+            token_hash=token_hash).first()
         if res:
             return True
         else:
             return False
 
+    @staticmethod
+    def prune():
+        """Delete tokens that can no longer validate and return the count"""
+        removed = BlacklistTokens.query.filter(
+            BlacklistTokens.expires_at < datetime.utcnow()).delete(
+                synchronize_session=False)
+        db.session.commit()
+        return removed
+
+    @classmethod
+    def reset_filter(cls):
+        """Drop the in-memory filter so it is rebuilt on next use"""
+        with cls._filter_lock:
+            cls._filter = None
+            cls._filter_since = None
+            cls._filter_refreshed_at = 0
+
+    @classmethod
+    def _add_to_filter(cls, token_hash):
+        with cls._filter_lock:
+            if cls._filter is not None:
+                cls._filter.add(token_hash)
+
+    @classmethod
+    def _might_be_blacklisted(cls, token_hash):
+        if not current_app.config['BLACKLIST_FILTER']:
+            return True
+        with cls._filter_lock:
+            now = time.time()
+            if cls._filter is None or cls._filter.is_full():
+                cls._load_filter()
+            elif now - cls._filter_refreshed_at >= current_app.config['BLACKLIST_FILTER_REFRESH']:
+                # pick up tokens revoked by other processes
+                cls._load_filter(incremental=True)
+            return token_hash in cls._filter
+
+    @classmethod
+    def _load_filter(cls, incremental=False):
+        started = datetime.utcnow()
+        query = db.session.query(BlacklistTokens.token_hash).filter(
+            BlacklistTokens.expires_at >= started)
+        if incremental:
+            query = query.filter(BlacklistTokens.blacklisted_on >= cls._filter_since)
+        else:
+            capacity = max(query.count() * 2,
+                           current_app.config['BLACKLIST_FILTER_CAPACITY'])
+            cls._filter = BloomFilter(capacity)
+        for token_hash, in query:
+            cls._filter.add(token_hash)
+        # rows become visible in commit order, not in the order of their
+        # ids or times, so the next refresh reads back over the overlap
+        # to pick up transactions that were still open
+        cls._filter_since = started - timedelta(
+            seconds=current_app.config['BLACKLIST_FILTER_OVERLAP'])
+        cls._filter_refreshed_at = time.time()
+
     def __repr__(self):
-        return '<id: token: {}'.format(self.token)
\ No newline at end of file
+        return '<id: token: {}'.format(self.token_hash)
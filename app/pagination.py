@@ -0,0 +1,97 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from app import db
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(*values):
+    """Return an opaque cursor for the sort key of the last row on a page"""
+    values = [value.strftime(DATETIME_FORMAT) if isinstance(value, datetime)
+              else value for value in values]
+    return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, *types):
+    """Return the sort key values of a cursor converted to the given types,
+    raises ValueError for cursors that were not made by encode_cursor
+    """
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode()).decode())
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError('Invalid cursor')
+    decoded = []
+    for value, value_type in zip(values, types):
+        if value is None:
+            decoded.append(None)
+        elif value_type is datetime:
+            decoded.append(datetime.strptime(value, DATETIME_FORMAT))
+        elif isinstance(value, value_type):
+            decoded.append(value)
+        else:
+            raise ValueError('Invalid cursor')
+    return decoded
+
+
+def keyset_page(query, column, id_column, value, last_id, limit):
+    """Return up to limit rows of query sorted by column then id with rows
+    where column is null last, after the row (value, last_id) or from the
+    first row when last_id is None. Rows with a value and the null tail
+    are read by two queries so each one is a range on the index of
+    (column, id) that starts at the cursor
+    """
+    rows = []
+    if last_id is None or value is not None:
+        if last_id is None:
+            after = column.isnot(None)
+        else:
+            after = db.tuple_(column, id_column) > db.tuple_(value, last_id)
+        rows = query.filter(after).order_by(column, id_column).limit(limit).all()
+        # the null tail is then read from its first row
+        last_id = None
+    if len(rows) < limit:
+        query = query.filter(column.is_(None))
+        if last_id is not None:
+            query = query.filter(id_column > last_id)
+        rows += query.order_by(id_column).limit(limit - len(rows)).all()
+    return rows
+
+
+def bytewise(column):
+    """Return column compared byte by byte, the order prefix ranges are
+    computed in. Postgres otherwise compares in the database's collation,
+    which may ignore punctuation, sqlite compares bytes already
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return column.collate('C')
+    return column
+
+
+def prefix_filter(column, prefix):
+    """Filters for the rows where column starts with prefix, the range
+    lets the bytewise index on column serve the search and like keeps
+    the match exact
+    """
+    escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    column = bytewise(column)
+    return [column >= prefix, column < upper,
+            column.like(escaped + '%', escape='\\')]
+
+
+def estimate_count(query):
+    """Return the planner's row estimate for a query on postgres,
+    other databases fall back to an exact count
+    """
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return query.order_by(None).count()
+    compiled = query.order_by(None).statement.compile(
+        dialect=db.session.get_bind().dialect)
+    plan = db.session.connection().execute(
+        'EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
@@ -0,0 +1,157 @@
+import os
+import time
+import sqlite3
+import threading
+from flask import current_app, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DisconnectionError
+from sqlalchemy.pool import Pool, QueuePool
+
+try:
+    from psycopg2.extensions import connection as PostgresConnection
+except ImportError:
+    PostgresConnection = ()
+
+# sqlite calls the progress handler every this many virtual machine steps
+SQLITE_PROGRESS_STEPS = 1000
+# postgres error code of a statement cancelled by statement_timeout
+QUERY_CANCELED = '57014'
+
+
+class StatementTimeout(Exception):
+    """Raised when a statement of a request runs longer than
+    DATABASE_STATEMENT_TIMEOUT
+    """
+
+
+class MonitoredPool(QueuePool):
+    """Queue pool counting checkouts and the time spent waiting for one"""
+
+    def __init__(self, *args, **kwargs):
+        QueuePool.__init__(self, *args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return QueuePool._do_get(self)
+        except Exception:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_time += waited
+                self.max_wait_time = max(self.max_wait_time, waited)
+
+    def stats(self):
+        """Return the connections in use and the checkout wait times"""
+        with self._stats_lock:
+            capacity = self.size() + max(self._max_overflow, 0)
+            return {
+                'size': self.size(),
+                'checked_out': self.checkedout(),
+                'overflow': max(self.overflow(), 0),
+                'saturation': float(self.checkedout()) / capacity if capacity else 0.0,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'mean_wait_ms': 1000.0 * self.wait_time / self.checkouts if self.checkouts else 0.0,
+                'max_wait_ms': 1000.0 * self.max_wait_time
+            }
+
+
+def pool_options(config):
+    """Engine options sizing the connection pool of a server database"""
+    return {
+        'poolclass': MonitoredPool,
+        'pool_size': config['DATABASE_POOL_SIZE'],
+        'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+        'pool_timeout': config['DATABASE_POOL_TIMEOUT'],
+        'pool_recycle': config['DATABASE_POOL_RECYCLE']
+    }
+
+
+def statement_timeout():
+    """Return the milliseconds each statement of the current request may
+    run, None outside of requests or when statements are not limited
+    """
+    if not has_request_context():
+        return None
+    return current_app.config['DATABASE_STATEMENT_TIMEOUT'] or None
+
+
+@event.listens_for(Pool, 'connect')
+def remember_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+@event.listens_for(Pool, 'checkout')
+def check_pid(dbapi_connection, connection_record, connection_proxy):
+    pid = os.getpid()
+    if connection_record.info.get('pid', pid) != pid:
+        # opened by the process this one was forked from, which still
+        # uses the socket, so it is dropped without being closed
+        connection_record.connection = connection_proxy.connection = None
+        raise DisconnectionError('Connection of process {} checked out by process {}'.format(
+            connection_record.info['pid'], pid))
+
+
+@event.listens_for(Pool, 'checkout')
+def limit_statements(dbapi_connection, connection_record, connection_proxy):
+    timeout = statement_timeout()
+    if timeout is None:
+        return
+    if isinstance(dbapi_connection, PostgresConnection):
+        # lasts until the transaction ends, at the latest when the
+        # connection goes back to the pool
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SET LOCAL statement_timeout = %s', (int(timeout),))
+        cursor.close()
+    elif isinstance(dbapi_connection, sqlite3.Connection):
+        info = connection_record.info
+        info['statement_timeout'] = timeout / 1000.0
+        info['statement_started'] = time.monotonic()
+
+        def interrupt():
+            # a true value makes sqlite abort the statement
+            return time.monotonic() - info['statement_started'] > info['statement_timeout']
+        dbapi_connection.set_progress_handler(interrupt, SQLITE_PROGRESS_STEPS)
+
+
+@event.listens_for(Pool, 'checkin')
+def unlimit_statements(dbapi_connection, connection_record):
+    if connection_record.info.pop('statement_timeout', None) is not None:
+        connection_record.info.pop('statement_started', None)
+        if dbapi_connection is not None:
+            dbapi_connection.set_progress_handler(None, 0)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    if 'statement_timeout' in conn.info:
+        conn.info['statement_started'] = time.monotonic()
+
+
+@event.listens_for(Engine, 'handle_error')
+def raise_statement_timeout(context):
+    error = context.original_exception
+    if getattr(error, 'pgcode', None) == QUERY_CANCELED or (
+            isinstance(error, sqlite3.OperationalError) and str(error) == 'interrupted'):
+        raise StatementTimeout()
+
+
+def pool_stats(db):
+    """Return the pool metrics of the primary and of every replica"""
+    stats = {}
+    for bind in [None] + sorted(current_app.config.get('SQLALCHEMY_BINDS') or ()):
+        pool = db.get_engine(current_app, bind=bind).pool
+        if isinstance(pool, MonitoredPool):
+            stats[bind or 'primary'] = pool.stats()
+    return stats
@@ -0,0 +1,219 @@
+import time
+import sqlite3
+import itertools
+import threading
+from functools import wraps
+from flask import current_app, g, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import event, orm
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql.dml import UpdateBase
+from app.cache import LRUCache, response_cache
+from app.pool import pool_options
+
+READ_METHODS = ('GET', 'HEAD')
+# clients that wrote carry the time until which they read from the primary
+PIN_COOKIE = 'read_primary_until'
+
+
+class RoutingSession(SignallingSession):
+    """Session sending the queries of read only handlers to the replica
+    they picked, flushes and writes always go to the primary
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+        if replica is not None and not self._flushing and not isinstance(clause, UpdateBase):
+            return replica
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with sessions that can read from replicas and
+    connection pools sized by the DATABASE_POOL settings
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = SQLAlchemy.create_engine(self, sa_url, engine_opts)
+        # only the app's engines, migrations copy sqlite tables with rows
+        # that the copy would violate while both exist
+        event.listen(engine, 'connect', enable_sqlite_foreign_keys)
+        return engine
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = SQLAlchemy.apply_driver_hacks(self, app, sa_url, options)
+        # sqlite files are opened per checkout without a queue
+        if not sa_url.drivername.startswith('sqlite'):
+            options.update(pool_options(app.config))
+        options['pool_pre_ping'] = app.config['DATABASE_POOL_PRE_PING']
+        return sa_url, options
+
+
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # sqlite only enforces foreign keys and their cascades when asked to
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
+def replica_lag(connection):
+    """Return the seconds a replica is behind its primary, 0 for databases
+    that are not postgres standbys
+    """
+    if connection.dialect.name != 'postgresql':
+        connection.execute('SELECT 1')
+        return 0.0
+    # a standby that replayed everything it received is up to date even
+    # when the primary has not written for a while
+    return connection.execute(
+        'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+        'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) '
+        'END').scalar()
+
+
+class ReplicaSet(object):
+    """Picks the replica each read only request uses, in turn. Replicas are
+    checked at most every check_interval seconds, a replica lagging more
+    than max_lag seconds is skipped until the next check and a replica
+    that failed is skipped for retry seconds
+    """
+
+    def __init__(self, keys, pins, pin, max_lag, check_interval, retry):
+        self.keys = keys
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry = retry
+        # users that wrote read from the primary for pin seconds, pins is
+        # a cache backend, shared by the workers unless it is an LRUCache
+        self.pins = pins
+        self.pin_ttl = pin
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.failures = 0
+        self._turn = itertools.count()
+        self._checked_at = {}
+        self._skip_until = {}
+        self._lock = threading.Lock()
+
+    def choose(self, db):
+        """Return the key of the replica to read from, None when every
+        replica lags or is down
+        """
+        now = time.time()
+        start = next(self._turn)
+        for offset in range(len(self.keys)):
+            key = self.keys[(start + offset) % len(self.keys)]
+            if self._skip_until.get(key, 0) > now:
+                continue
+            if self._checked_at.get(key, 0) + self.check_interval <= now:
+                self._checked_at[key] = now
+                try:
+                    with db.get_engine(current_app, bind=key).connect() as connection:
+                        lag = replica_lag(connection)
+                except OperationalError:
+                    self.mark_down(key)
+                    continue
+                if lag > self.max_lag:
+                    self._skip_until[key] = now + self.check_interval
+                    continue
+            with self._lock:
+                self.replica_reads += 1
+            return key
+        with self._lock:
+            self.primary_reads += 1
+        return None
+
+    def mark_down(self, key):
+        """Skip a replica that failed for the next retry seconds"""
+        with self._lock:
+            self.failures += 1
+        self._skip_until[key] = time.time() + self.retry
+
+    def pinned(self):
+        """Return whether the client of the current request wrote recently"""
+        try:
+            if float(request.cookies.get(PIN_COOKIE, 0)) > time.time():
+                return True
+        except ValueError:
+            pass
+        user_id = g.get('user_id')
+        return user_id is not None and self.pins.get('pin:{}'.format(user_id)) is not None
+
+    def pin(self, response):
+        """Read from the primary in the next requests of the current client"""
+        until = time.time() + self.pin_ttl
+        user_id = g.get('user_id')
+        if user_id is not None:
+            self.pins.set('pin:{}'.format(user_id), True, ttl=self.pin_ttl)
+        response.set_cookie(PIN_COOKIE, '{:.3f}'.format(until),
+                            max_age=int(self.pin_ttl) + 1, httponly=True)
+
+    def stats(self):
+        """Return the reads sent to replicas and to the primary"""
+        now = time.time()
+        with self._lock:
+            return {
+                'replicas': len(self.keys),
+                'down': sorted(key for key in self.keys if self._skip_until.get(key, 0) > now),
+                'replica_reads': self.replica_reads,
+                'primary_reads': self.primary_reads,
+                'failures': self.failures
+            }
+
+
+def replicas():
+    """Return the replica set of the current app, None when the database
+    has no replicas
+    """
+    if 'replicas' not in current_app.extensions:
+        config = current_app.config
+        keys = sorted(key for key in config.get('SQLALCHEMY_BINDS') or ()
+                      if key.startswith('replica_'))
+        # pins are kept with the cached responses so every worker sees
+        # them, clients without the cookie may otherwise read stale rows
+        cache = response_cache()
+        pins = cache.backend if cache is not None else LRUCache(
+            maxsize=10000, ttl=config['REPLICA_PIN'])
+        current_app.extensions['replicas'] = ReplicaSet(
+            keys, pins, config['REPLICA_PIN'], config['REPLICA_MAX_LAG'],
+            config['REPLICA_CHECK_INTERVAL'], config['REPLICA_RETRY']) if keys else None
+    return current_app.extensions['replicas']
+
+
+def read_only(f):
+    """Decorator sending the queries of GET requests to a replica unless the
+    client wrote in the last REPLICA_PIN seconds. When the replica fails
+    the view runs again on the primary
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        replica_set = replicas()
+        if replica_set is None or request.method not in READ_METHODS or replica_set.pinned():
+            return f(*args, **kwargs)
+        db = get_state(current_app).db
+        key = replica_set.choose(db)
+        if key is None:
+            return f(*args, **kwargs)
+        session = db.session()
+        session.info['replica'] = db.get_engine(current_app, bind=key)
+        try:
+            return f(*args, **kwargs)
+        except OperationalError:
+            session.rollback()
+            session.info.pop('replica', None)
+            replica_set.mark_down(key)
+            return f(*args, **kwargs)
+    return decorated
+
+
+def pin_writers(response):
+    """After request hook pinning clients that wrote to the primary"""
+    if request.method not in READ_METHODS:
+        replica_set = replicas()
+        if replica_set is not None:
+            replica_set.pin(response)
+    return response
@@ -0,0 +1,63 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def start_periodic(app, interval, func, name):
+    """Run func inside an application context every interval seconds
+    on a daemon thread and return the thread
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    func()
+                except Exception:
+                    logger.exception('Periodic task %s failed', name)
+    thread = threading.Thread(target=run, name=name)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def prune_blacklist():
+    """Delete blacklisted tokens that have expired and return the count"""
+    from app.models import BlacklistTokens
+    removed = BlacklistTokens.prune()
+    if removed:
+        logger.info('Pruned %d expired blacklisted tokens', removed)
+    return removed
+
+
+def reap_deleted(max_batches=None):
+    """Remove deleted accounts, shopping lists and items in small batches
+    so that no statement holds its locks for long, and return the number
+    of rows removed of each kind. The lists of deleted accounts are marked
+    deleted first, then items, lists and accounts are removed children
+    first. At most max_batches batches are run, all of them by default
+    """
+    from flask import current_app
+    from app.models import Items, ShoppingLists, Users
+    batch_size = current_app.config['REAPER_BATCH_SIZE']
+    pause = current_app.config['REAPER_PAUSE']
+    steps = [('orphaned_shopping_lists', ShoppingLists.mark_orphans),
+             ('items', Items.purge_deleted),
+             ('shopping_lists', ShoppingLists.purge_deleted),
+             ('users', Users.purge_deleted)]
+    counts = dict((name, 0) for name, step in steps)
+    batches = 0
+    for name, step in steps:
+        while max_batches is None or batches < max_batches:
+            count = step(batch_size)
+            batches += 1
+            counts[name] += count
+            if count < batch_size:
+                break
+            time.sleep(pause)
+    if any(counts.values()):
+        logger.info('Reaped %s', ', '.join(
+            '{} {}'.format(counts[name], name.replace('_', ' ')) for name, step in steps))
+    return counts
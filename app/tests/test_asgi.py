@@ -0,0 +1,63 @@
+import json
+import asyncio
+import unittest
+import threading
+from app import create_app, db, url_prefix
+from app.asgi import AsgiAdapter
+
+app = create_app('test')
+
+
+def request(asgi_app, method, path, body=b''):
+    """Send one request to asgi_app and return the messages it sent"""
+    scope = {'type': 'http', 'http_version': '1.1', 'method': method,
+             'scheme': 'http', 'path': path, 'query_string': b'',
+             'headers': [(b'content-type', b'application/json')],
+             'server': ('testserver', 80), 'client': ('127.0.0.1', 5000)}
+    received = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    messages = []
+
+    async def receive():
+        return received.pop(0)
+
+    async def send(message):
+        messages.append(message)
+    asyncio.run(asgi_app(scope, receive, send))
+    return messages
+
+
+class AsgiTestCase(unittest.TestCase):
+    """Testcases for the ASGI entry point"""
+
+    def test_streamed_response_stays_on_one_thread(self):
+        """Test a streamed response is produced by the worker thread that
+        started it and sent chunk by chunk
+        """
+        threads = []
+
+        def wsgi_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            for chunk in [b'a', b'', b'b']:
+                threads.append(threading.current_thread().name)
+                yield chunk
+        messages = request(AsgiAdapter(wsgi_app, 2), 'GET', '/')
+        self.assertEqual(messages[0], {'type': 'http.response.start', 'status': 200,
+                                       'headers': [(b'content-type', b'text/plain')]})
+        self.assertEqual([(message['body'], message['more_body']) for message in messages[1:]],
+                         [(b'a', True), (b'b', True), (b'', False)])
+        self.assertEqual(len(set(threads)), 1)
+        self.assertTrue(threads[0].startswith('asgi-worker'))
+
+    def test_api_through_asgi(self):
+        """Test the api answers the same through the ASGI entry point"""
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        asgi_app = AsgiAdapter(app, 4)
+        user = {"username": "flacode", "password": "flavia", "email": "fnshem@gmail.com"}
+        messages = request(asgi_app, 'POST', url_prefix+'/auth/register',
+                           json.dumps(user).encode())
+        self.assertEqual(messages[0]['status'], 201)
+        messages = request(asgi_app, 'GET', url_prefix+'/auth/users')
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        self.assertEqual(json.loads(body.decode())['Users'][0]['username'], 'flacode')
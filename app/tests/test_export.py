@@ -0,0 +1,72 @@
+import os
+import json
+import unittest
+import tempfile
+from app import create_app, db, url_prefix
+from app.models import token_cache, token_version_cache
+
+app = create_app('test')
+
+
+class ExportTestCase(unittest.TestCase):
+    """Testcases for exporting shopping lists and items"""
+    def setUp(self):
+        self.db_fd, app.config['DATABASE'] = tempfile.mkstemp()
+        app.testing = True
+        self.app = app.test_client()
+        self.user = {
+            "username": "flacode",
+            "password": "flavia",
+            "email": "fnshem@gmail.com"
+            }
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        # ids are reused once the tables are recreated
+        token_cache.clear()
+        token_version_cache.clear()
+
+    def tearDown(self):
+        os.close(self.db_fd)
+        os.unlink(app.config['DATABASE'])
+
+    def login_user(self, user):
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({"username": user['username'],
+                                             "password": user['password']}),
+                            headers={'Content-Type': 'application/json'})
+        return {'Content-Type': 'application/json',
+                'Authorization': json.loads(res.data.decode())['access_token']}
+
+    def test_export_shopping_lists_and_items(self):
+        """Test the export streams the user's lists each followed by its items"""
+        result = self.app.get(url_prefix+'/export')
+        self.assertEqual(result.status_code, 401)
+        headers = self.login_user(self.user)
+        for name in ['bakery', 'hardware']:
+            self.app.post(url_prefix+'/shoppinglists/',
+                          data=json.dumps({"name": name, "due_date": "2017-08-17"}),
+                          headers=headers)
+        self.app.post(url_prefix+'/shoppinglists/1/items/',
+                      data=json.dumps([{"name": "bread", "quantity": 1},
+                                       {"name": "cake", "quantity": 2,
+                                        "status": True}]),
+                      headers=headers)
+        other = self.login_user({"username": "other", "password": "other",
+                                 "email": "other@gmail.com"})
+        self.app.post(url_prefix+'/shoppinglists/',
+                      data=json.dumps({"name": "secret", "due_date": None}),
+                      headers=other)
+        result = self.app.get(url_prefix+'/export', headers=headers)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.mimetype, 'application/x-ndjson')
+        records = [json.loads(line) for line in result.data.decode().splitlines()]
+        self.assertEqual([(record['type'], record['name']) for record in records],
+                         [('shopping_list', 'bakery'), ('item', 'bread'),
+                          ('item', 'cake'), ('shopping_list', 'hardware')])
+        self.assertEqual(records[0]['due_date'], '2017-08-17T00:00:00')
+        self.assertEqual(records[2], {'type': 'item', 'id': 2, 'shopping_list_id': 1,
+                                      'name': 'cake', 'quantity': 2,
+                                      'bought_from': None, 'status': True})
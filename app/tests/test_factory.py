@@ -0,0 +1,47 @@
+import unittest
+from flask_sqlalchemy import get_state
+from app import create_app, db, url_prefix
+from app.pool import MonitoredPool
+
+
+class FactoryTestCase(unittest.TestCase):
+    """Testcases for building the application from its configurations"""
+
+    def test_named_configurations(self):
+        """Test every configuration name builds an app and others are refused"""
+        self.assertFalse(create_app('production').debug)
+        self.assertTrue(create_app('development').debug)
+        self.assertTrue(create_app('test').testing)
+        self.assertFalse(create_app('benchmark').testing)
+        with self.assertRaises(ValueError):
+            create_app('staging')
+
+    def test_engine_is_created_on_first_use(self):
+        """Test building the app opens no database connections, so the
+        app can be loaded before the server forks its workers
+        """
+        app = create_app('test')
+        self.assertEqual(get_state(app).connectors, {})
+        app.test_client().get(url_prefix+'/auth/users')
+        self.assertIn(None, get_state(app).connectors)
+
+    def test_connections_of_another_process_are_not_reused(self):
+        """Test a pooled connection opened before a fork is replaced, and
+        left open for the process that opened it
+        """
+        app = create_app('test')
+        with app.app_context():
+            engine = db.engine
+        if not isinstance(engine.pool, MonitoredPool):
+            self.skipTest('sqlite connections are not pooled')
+        connection = engine.raw_connection()
+        inherited = connection.connection
+        # as seen from a forked worker
+        connection.info['pid'] = 0
+        connection.close()
+        connection = engine.raw_connection()
+        self.assertIsNot(connection.connection, inherited)
+        self.assertFalse(inherited.closed)
+        connection.close()
+        inherited.close()
+        engine.dispose()
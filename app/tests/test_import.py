@@ -0,0 +1,123 @@
+import os
+import json
+import unittest
+import tempfile
+from app import create_app, db, url_prefix
+from app.models import ShoppingLists, token_cache, token_version_cache
+
+app = create_app('test')
+
+
+class ImportTestCase(unittest.TestCase):
+    """Testcases for importing shopping lists and items"""
+    def setUp(self):
+        self.db_fd, app.config['DATABASE'] = tempfile.mkstemp()
+        app.testing = True
+        self.app = app.test_client()
+        self.user = {
+            "username": "flacode",
+            "password": "flavia",
+            "email": "fnshem@gmail.com"
+            }
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        # ids are reused once the tables are recreated
+        token_cache.clear()
+        token_version_cache.clear()
+        self.batch_size = app.config['IMPORT_BATCH_SIZE']
+        # small batches so that lists and their items land in different ones
+        app.config['IMPORT_BATCH_SIZE'] = 2
+
+    def tearDown(self):
+        app.config['IMPORT_BATCH_SIZE'] = self.batch_size
+        os.close(self.db_fd)
+        os.unlink(app.config['DATABASE'])
+
+    def login_user(self, user):
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({"username": user['username'],
+                                             "password": user['password']}),
+                            headers={'Content-Type': 'application/json'})
+        return {'Authorization': json.loads(res.data.decode())['access_token']}
+
+    def import_data(self, data, content_type, headers):
+        return self.app.post(url_prefix+'/import', data=data,
+                             headers=dict(headers, **{'Content-Type': content_type}))
+
+    def test_import_export_round_trip(self):
+        """Test an export imported into another account gives the same data"""
+        headers = self.login_user(self.user)
+        records = [
+            {"type": "shopping_list", "id": 7, "name": "bakery", "due_date": "2017-08-17"},
+            {"type": "shopping_list", "id": 9, "name": "hardware", "due_date": None,
+             "items": [{"name": "nails", "quantity": 100, "status": False}]},
+            {"type": "item", "shopping_list_id": 7, "name": "bread", "quantity": 1,
+             "bought_from": "kalerwe \"market\""},
+            {"type": "item", "shopping_list_id": 7, "name": "cake", "quantity": 2,
+             "status": True}
+        ]
+        data = '\n'.join(json.dumps(record) for record in records)
+        result = self.import_data(data, 'application/x-ndjson', headers)
+        self.assertEqual(result.status_code, 200)
+        report = json.loads(result.data.decode())
+        self.assertEqual((report['shopping_lists'], report['items'],
+                          report['error_count']), (2, 3, 0))
+        exported = self.app.get(url_prefix+'/export', headers=headers).data
+        other = self.login_user({"username": "other", "password": "other",
+                                 "email": "other@gmail.com"})
+        self.import_data(exported, 'application/x-ndjson', other)
+        copy = self.app.get(url_prefix+'/export', headers=other).data
+
+        def without_ids(data):
+            records = [json.loads(line) for line in data.decode().splitlines()]
+            for record in records:
+                record.pop('id')
+                record.pop('shopping_list_id', None)
+            return records
+        self.assertEqual(without_ids(copy), without_ids(exported))
+        self.assertIn('"bought_from": "kalerwe \\"market\\""', copy.decode())
+        self.assertIn('"bought_from": null', copy.decode())
+
+    def test_batches_of_items_only_add_no_lists(self):
+        """Test batches holding only items of lists imported by an earlier
+        batch insert no shopping lists
+        """
+        headers = self.login_user(self.user)
+        records = [{"type": "shopping_list", "id": 7, "name": "bakery"}]
+        records += [{"type": "item", "shopping_list_id": 7, "name": name, "quantity": 1}
+                    for name in ['bread', 'cake', 'buns', 'rolls', 'pies']]
+        data = '\n'.join(json.dumps(record) for record in records)
+        report = json.loads(self.import_data(data, 'application/x-ndjson', headers).data.decode())
+        self.assertEqual((report['shopping_lists'], report['items'],
+                          report['error_count']), (1, 5, 0))
+        with app.app_context():
+            self.assertEqual(ShoppingLists.query.count(), 1)
+
+    def test_import_csv_reports_invalid_rows(self):
+        """Test valid csv rows are imported and invalid rows reported"""
+        headers = self.login_user(self.user)
+        data = '\n'.join([
+            'shopping_list,due_date,name,quantity,bought_from,status',
+            'bakery,2017-08-17,bread,1,,false',
+            'bakery,2017-08-17,cake,many,,',
+            'party,2017-08-20,,,,',
+            'bakery,2017-08-17,buns,3,kalerwe,true',
+            ',2017-08-21,cups,3,,',
+            'camping,someday,tent,1,,'
+        ])
+        result = self.import_data(data, 'text/csv', headers)
+        report = json.loads(result.data.decode())
+        self.assertEqual((report['shopping_lists'], report['items']), (2, 2))
+        self.assertEqual([error['line'] for error in report['errors']],
+                         [3, 6, 6, 7, 7])
+        result = self.app.get(url_prefix+'/shoppinglists/?include=items',
+                              headers=headers)
+        shopping_lists = json.loads(result.data.decode())['shopping_lists']
+        self.assertEqual([(shopping_list['name'], len(shopping_list['items']))
+                          for shopping_list in shopping_lists],
+                         [('bakery', 2), ('party', 0)])
+        result = self.import_data('name', 'text/plain', headers)
+        self.assertEqual(result.status_code, 415)
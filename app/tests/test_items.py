@@ -3,8 +3,10 @@ import json
 import unittest
 import tempfile
 from base64 import b64encode
-from app import app, url_prefix
-from app.models import db
+from app import create_app, url_prefix
+from app.models import db, token_cache, token_version_cache
+
+app = create_app('test')
 
 
 class ItemsTestCase(unittest.TestCase):
@@ -31,6 +33,9 @@ class ItemsTestCase(unittest.TestCase):
         with app.app_context():
             db.drop_all()
             db.create_all()
+        # ids are reused once the tables are recreated
+        token_cache.clear()
+        token_version_cache.clear()
 
     def tearDown(self):
         os.close(self.db_fd)
@@ -90,6 +95,180 @@ class ItemsTestCase(unittest.TestCase):
         self.assertEqual(item.status_code, 201)
         self.assertIn('Item added to shopping list', str(item.data))
 
+    def test_add_many_items_to_shopping_list(self):
+        """Test to add a list of items to a shopping list at once"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.login_user()
+        # obtain access token
+        access_token = json.loads(res.data.decode())['access_token']
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': access_token}
+        self.app.post(url_prefix+'/shoppinglists/',
+                      data=json.dumps(self.shopping_list), headers=headers)
+        items = [self.item, {"name": "beans", "quantity": 2}]
+        result = self.app.post(url_prefix+'/shoppinglists/1/items/',
+                               data=json.dumps(items + [{"quantity": 1}]),
+                               headers=headers)
+        self.assertEqual(result.status_code, 400)
+        errors = json.loads(result.data.decode())['errors']
+        self.assertEqual(errors, [{"index": 2,
+                                   "message": "Item name is required"}])
+        # lengths are checked with the rest of the batch, before inserting
+        result = self.app.post(url_prefix+'/shoppinglists/1/items/',
+                               data=json.dumps(items + [{"name": "x" * 81, "quantity": 1}]),
+                               headers=headers)
+        self.assertEqual(result.status_code, 400)
+        errors = json.loads(result.data.decode())['errors']
+        self.assertEqual(errors, [{"index": 2,
+                                   "message": "Item name is too long"}])
+        result = self.app.post(url_prefix+'/shoppinglists/1/items/',
+                               data=json.dumps(items), headers=headers)
+        self.assertEqual(result.status_code, 201)
+        self.assertEqual(json.loads(result.data.decode())['ids'], [1, 2])
+        result = self.app.get(url_prefix+'/shoppinglists/1/items/',
+                              headers=headers)
+        self.assertIn('beans', str(result.data))
+
+    def test_bulk_update_and_delete_items(self):
+        """Test to mark, move and clear many items at once"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.login_user()
+        # obtain access token
+        access_token = json.loads(res.data.decode())['access_token']
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': access_token}
+        for _ in range(2):
+            self.app.post(url_prefix+'/shoppinglists/',
+                          data=json.dumps(self.shopping_list), headers=headers)
+        self.app.post(url_prefix+'/shoppinglists/1/items/',
+                      data=json.dumps([{"name": name, "quantity": 1}
+                                       for name in ['milk', 'eggs', 'beans']]),
+                      headers=headers)
+        result = self.app.patch(url_prefix+'/shoppinglists/1/items/',
+                                data=json.dumps({"ids": [1, 2],
+                                                 "set": {"status": True}}),
+                                headers=headers)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(json.loads(result.data.decode())['count'], 2)
+        result = self.app.patch(url_prefix+'/shoppinglists/1/items/',
+                                data=json.dumps({"ids": [3],
+                                                 "set": {"shopping_list_id": 7}}),
+                                headers=headers)
+        self.assertEqual(result.status_code, 404)
+        result = self.app.patch(url_prefix+'/shoppinglists/1/items/',
+                                data=json.dumps({"ids": [3],
+                                                 "set": {"shopping_list_id": 2}}),
+                                headers=headers)
+        self.assertEqual(json.loads(result.data.decode())['count'], 1)
+        result = self.app.delete(url_prefix+'/shoppinglists/1/items/',
+                                 data=json.dumps({"filter": {"status": True}}),
+                                 headers=headers)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(json.loads(result.data.decode())['count'], 2)
+        result = self.app.get(url_prefix+'/shoppinglists/1/items/',
+                              headers=headers)
+        self.assertIn('Shopping list is empty', str(result.data))
+        result = self.app.get(url_prefix+'/shoppinglists/2/items/',
+                              headers=headers)
+        self.assertIn('beans', str(result.data))
+        result = self.app.delete(url_prefix+'/shoppinglists/2/items/',
+                                 data=json.dumps({}), headers=headers)
+        self.assertEqual(result.status_code, 400)
+
+    def test_bulk_requests_with_invalid_bodies(self):
+        """Test bulk item requests with badly typed bodies are refused"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.login_user()
+        # obtain access token
+        access_token = json.loads(res.data.decode())['access_token']
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': access_token}
+        self.app.post(url_prefix+'/shoppinglists/',
+                      data=json.dumps(self.shopping_list), headers=headers)
+        self.app.post(url_prefix+'/shoppinglists/1/items/',
+                      data=json.dumps(self.item), headers=headers)
+        for body in [{"ids": [1], "set": {"bought_from": {"a": 1}}},
+                     {"ids": [1], "set": {"bought_from": 5}},
+                     {"filter": {"bought_from": ["kalerwe"]}, "set": {"status": True}},
+                     [1]]:
+            result = self.app.patch(url_prefix+'/shoppinglists/1/items/',
+                                    data=json.dumps(body), headers=headers)
+            self.assertEqual(result.status_code, 400, body)
+        for body in [{"filter": {"bought_from": 5}}, [1]]:
+            result = self.app.delete(url_prefix+'/shoppinglists/1/items/',
+                                     data=json.dumps(body), headers=headers)
+            self.assertEqual(result.status_code, 400, body)
+        for method in [self.app.patch, self.app.delete]:
+            result = method(url_prefix+'/shoppinglists/abc/items/',
+                            data=json.dumps({"ids": [1], "set": {"status": True}}),
+                            headers=headers)
+            # only numeric list ids are routed to the bulk handlers
+            self.assertEqual(result.status_code, 405)
+        result = self.app.patch(url_prefix+'/shoppinglists/1/items/',
+                                data=json.dumps({"ids": [1], "set": {"bought_from": None}}),
+                                headers=headers)
+        self.assertEqual(result.status_code, 200)
+
+    def test_view_items_with_fields(self):
+        """Test to view only some fields of the items"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.login_user()
+        # obtain access token
+        access_token = json.loads(res.data.decode())['access_token']
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': access_token}
+        self.app.post(url_prefix+'/shoppinglists/',
+                      data=json.dumps(self.shopping_list), headers=headers)
+        self.app.post(url_prefix+'/shoppinglists/1/items/',
+                      data=json.dumps([self.item, {"name": "beans", "quantity": 2}]),
+                      headers=headers)
+        for query in ['', '&sort=name&cursor=', '&stream=true']:
+            result = self.app.get(
+                url_prefix+'/shoppinglists/1/items/?fields=name,quantity'+query,
+                headers=headers)
+            items = json.loads(result.data.decode())['Items']
+            self.assertIn({'name': 'beans', 'quantity': 2}, items)
+        result = self.app.get(url_prefix+'/shoppinglists/1/items/?fields=price',
+                              headers=headers)
+        self.assertEqual(result.status_code, 400)
+
+    def test_conditional_get_of_items(self):
+        """Test item listings are revalidated with their etag"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.login_user()
+        # obtain access token
+        access_token = json.loads(res.data.decode())['access_token']
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': access_token}
+        self.app.post(url_prefix+'/shoppinglists/',
+                      data=json.dumps(self.shopping_list), headers=headers)
+        self.app.post(url_prefix+'/shoppinglists/1/items/',
+                      data=json.dumps(self.item), headers=headers)
+        result = self.app.get(url_prefix+'/shoppinglists/1/items/',
+                              headers=headers)
+        etag = result.headers['ETag']
+        self.assertIn('Last-Modified', result.headers)
+        result = self.app.get(url_prefix+'/shoppinglists/1/items/',
+                              headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(result.status_code, 304)
+        self.assertEqual(result.data, b'')
+        # another query of the same list has its own etag
+        result = self.app.get(url_prefix+'/shoppinglists/1/items/?sort=name',
+                              headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(result.status_code, 200)
+        self.app.put(url_prefix+'/shoppinglists/1/items/1',
+                     data=json.dumps({"name": "yams"}), headers=headers)
+        result = self.app.get(url_prefix+'/shoppinglists/1/items/',
+                              headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(result.status_code, 200)
+        self.assertIn('yams', str(result.data))
+        self.assertNotEqual(result.headers['ETag'], etag)
+
     def test_update_item_in_shopping_list(self):
         """Test update item in shopping list"""
         no_token = self.app.put(url_prefix+'/shoppinglists/1/items/1',
@@ -147,6 +326,33 @@ class ItemsTestCase(unittest.TestCase):
         self.assertEqual(update_item.status_code, 200)
         self.assertIn('Item updated', str(update_item.data))
 
+    def test_item_of_another_shopping_list_can_not_be_changed(self):
+        """Test items are only found through the list they belong to"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.login_user()
+        # obtain access token
+        access_token = json.loads(res.data.decode())['access_token']
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': access_token}
+        for _ in range(2):
+            self.app.post(url_prefix+'/shoppinglists/',
+                          data=json.dumps(self.shopping_list), headers=headers)
+        self.app.post(url_prefix+'/shoppinglists/1/items/',
+                      data=json.dumps(self.item), headers=headers)
+        result = self.app.put(url_prefix+'/shoppinglists/2/items/1',
+                              data=json.dumps({"name": "new_name"}),
+                              headers=headers)
+        self.assertEqual(result.status_code, 404)
+        self.assertIn('Item can not be found in shopping list',
+                      str(result.data))
+        result = self.app.delete(url_prefix+'/shoppinglists/2/items/1',
+                                 headers=headers)
+        self.assertEqual(result.status_code, 404)
+        result = self.app.delete(url_prefix+'/shoppinglists/1/items/1',
+                                 headers=headers)
+        self.assertEqual(result.status_code, 200)
+
     def test_view_items_in_shopping_list(self):
         """View items in a shopping list"""
         no_token = self.app.get(url_prefix+'/shoppinglists/1/items/')
@@ -188,6 +394,52 @@ class ItemsTestCase(unittest.TestCase):
         self.assertEqual(shopping_list.status_code, 200)
         self.assertIn('Items', str(shopping_list.data))
 
+    def test_view_items_with_filters_and_cursor(self):
+        """View items a page at a time, filtered and sorted"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.login_user()
+        # obtain access token
+        access_token = json.loads(res.data.decode())['access_token']
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': access_token}
+        self.app.post(url_prefix+'/shoppinglists/',
+                      data=json.dumps(self.shopping_list), headers=headers)
+        for name, bought_from, status in [('milk', 'kalerwe', True),
+                                          ('bread', 'nakasero', False),
+                                          ('eggs', 'kalerwe', False)]:
+            self.app.post(url_prefix+'/shoppinglists/1/items/',
+                          data=json.dumps({"name": name, "quantity": 1,
+                                           "bought_from": bought_from,
+                                           "status": status}),
+                          headers=headers)
+        result = self.app.get(
+            url_prefix+'/shoppinglists/1/items/?sort=name&cursor=&limit=2',
+            headers=headers)
+        data = json.loads(result.data.decode())
+        self.assertEqual([item['name'] for item in data['Items']],
+                         ['bread', 'eggs'])
+        result = self.app.get(
+            url_prefix+'/shoppinglists/1/items/?sort=name&limit=2&cursor=' +
+            data['next_cursor'], headers=headers)
+        data = json.loads(result.data.decode())
+        self.assertEqual([item['name'] for item in data['Items']], ['milk'])
+        self.assertIsNone(data['next_cursor'])
+        result = self.app.get(
+            url_prefix+'/shoppinglists/1/items/?status=false&bought_from=kalerwe',
+            headers=headers)
+        data = json.loads(result.data.decode())
+        self.assertEqual([item['name'] for item in data['Items']], ['eggs'])
+        result = self.app.get(
+            url_prefix+'/shoppinglists/1/items/?stream=true&sort=name',
+            headers=headers)
+        data = json.loads(result.data.decode())
+        self.assertEqual([item['name'] for item in data['Items']],
+                         ['bread', 'eggs', 'milk'])
+        result = self.app.get(url_prefix+'/shoppinglists/1/items/?status=maybe',
+                              headers=headers)
+        self.assertEqual(result.status_code, 400)
+
     def test_delete_item_from_shopping_list(self):
         """Test delete item from shopping list given its id"""
         no_token = self.app.delete(url_prefix+'/shoppinglists/1/items/1')
@@ -0,0 +1,64 @@
+import os
+import unittest
+import tempfile
+from flask_migrate import Migrate, downgrade, upgrade
+from app import create_app, db
+from app.config import TestConfig
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))), 'migrations')
+
+
+class MigrationsTestCase(unittest.TestCase):
+    """Testcases running the migrations on a sqlite database with data"""
+    def setUp(self):
+        self.db_fd, self.path = tempfile.mkstemp(suffix='.db')
+
+        class SqliteConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + self.path
+            SQLALCHEMY_BINDS = None
+        self.app = create_app(SqliteConfig)
+        Migrate(self.app, db, directory=MIGRATIONS)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.get_engine(self.app).dispose()
+        os.close(self.db_fd)
+        os.unlink(self.path)
+
+    def seed(self):
+        """Add a user with a shopping list and an item"""
+        db.engine.execute("INSERT INTO users (id, username, email, password) "
+                          "VALUES (1, 'flacode', 'fnshem@gmail.com', 'x')")
+        db.engine.execute("INSERT INTO shopping_lists (id, name, user_id) "
+                          "VALUES (1, 'bakery', 1)")
+        db.engine.execute("INSERT INTO items (id, name, shopping_list_id) "
+                          "VALUES (1, 'bread', 1)")
+
+    def count_rows(self):
+        return [db.engine.execute('SELECT COUNT(*) FROM ' + table).scalar()
+                for table in ('users', 'shopping_lists', 'items')]
+
+    def search_triggers(self):
+        return db.engine.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' "
+                                 "AND name LIKE 'shopping_lists_fts_%'").scalar()
+
+    def test_migrations_keep_data(self):
+        """Test the migrations that copy tables, adding version stamps and
+        replacing the foreign keys, run on tables with rows in both
+        directions
+        """
+        with self.app.app_context():
+            upgrade(revision='8a3e96a0c446')
+            self.seed()
+            triggers = self.search_triggers()
+            upgrade()
+            self.assertEqual(self.count_rows(), [1, 1, 1])
+            self.assertIsNotNone(db.engine.execute(
+                'SELECT updated_at FROM shopping_lists').scalar())
+            self.assertEqual(self.search_triggers(), triggers)
+            # the app's own connections still enforce the foreign keys
+            self.assertEqual(db.engine.execute('PRAGMA foreign_keys').scalar(), 1)
+            downgrade(revision='8a3e96a0c446')
+            self.assertEqual(self.count_rows(), [1, 1, 1])
+            self.assertEqual(self.search_triggers(), triggers)
@@ -0,0 +1,99 @@
+import os
+import json
+import unittest
+import tempfile
+from sqlalchemy import create_engine, event
+from app import create_app, db, url_prefix
+from app.models import token_cache, token_version_cache
+from app.pool import StatementTimeout
+
+app = create_app('test')
+
+
+class PoolTestCase(unittest.TestCase):
+    """Testcases for the connection pool metrics and statement timeouts"""
+    def setUp(self):
+        self.db_fd, app.config['DATABASE'] = tempfile.mkstemp()
+        app.testing = True
+        self.app = app.test_client()
+        self.user = {
+            "username": "flacode",
+            "password": "flavia",
+            "email": "fnshem@gmail.com"
+            }
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            self.dialect = db.engine.dialect.name
+        # ids are reused once the tables are recreated
+        token_cache.clear()
+        token_version_cache.clear()
+        self.statement_timeout = app.config['DATABASE_STATEMENT_TIMEOUT']
+
+    def tearDown(self):
+        app.config['DATABASE_STATEMENT_TIMEOUT'] = self.statement_timeout
+        os.close(self.db_fd)
+        os.unlink(app.config['DATABASE'])
+
+    def login_user(self):
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({"username": "flacode",
+                                             "password": "flavia"}),
+                            headers={'Content-Type': 'application/json'})
+        return {'Content-Type': 'application/json',
+                'Authorization': json.loads(res.data.decode())['access_token']}
+
+    def test_slow_statement_answers_503(self):
+        """Test a statement running past the timeout is cancelled by postgres"""
+        if self.dialect != 'postgresql':
+            self.skipTest('statement_timeout is a postgres setting')
+        headers = self.login_user()
+        app.config['DATABASE_STATEMENT_TIMEOUT'] = 100
+        with app.app_context():
+            engine = db.engine
+
+        def slow_down(conn, cursor, statement, parameters, context, executemany):
+            if 'FROM shopping_lists' in statement:
+                statement = 'SELECT pg_sleep(1); ' + statement
+            return statement, parameters
+        event.listen(engine, 'before_cursor_execute', slow_down, retval=True)
+        try:
+            result = self.app.get(url_prefix+'/shoppinglists/', headers=headers)
+        finally:
+            event.remove(engine, 'before_cursor_execute', slow_down)
+        self.assertEqual(result.status_code, 503)
+        self.assertEqual(result.headers['Retry-After'], '1')
+        # the connection is usable again once back in the pool
+        result = self.app.get(url_prefix+'/shoppinglists/', headers=headers)
+        self.assertEqual(result.status_code, 200)
+
+    def test_slow_sqlite_statement_is_interrupted(self):
+        """Test sqlite statements of a request are interrupted by the
+        progress handler, statements outside of requests are not limited
+        """
+        engine = create_engine('sqlite://')
+        slow = ('WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n '
+                'WHERE i < 100000000) SELECT count(*) FROM n')
+        app.config['DATABASE_STATEMENT_TIMEOUT'] = 50
+        with app.test_request_context():
+            self.assertEqual(engine.execute('SELECT 1').scalar(), 1)
+            with self.assertRaises(StatementTimeout):
+                engine.execute(slow)
+        quick = 'WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000) '
+        self.assertEqual(engine.execute(quick + 'SELECT count(*) FROM n').scalar(), 1000)
+
+    def test_pool_metrics(self):
+        """Test the metrics report the checkouts of the primary's pool"""
+        if self.dialect == 'sqlite':
+            self.skipTest('sqlite connections are not pooled')
+        headers = self.login_user()
+        self.app.get(url_prefix+'/shoppinglists/', headers=headers)
+        result = self.app.get(url_prefix+'/metrics',
+                              headers={'Authorization': app.config['METRICS_TOKEN']})
+        stats = json.loads(result.data.decode())['database_pools']['primary']
+        self.assertEqual(stats['size'], app.config['DATABASE_POOL_SIZE'])
+        self.assertGreater(stats['checkouts'], 0)
+        self.assertTrue(0 <= stats['saturation'] <= 1)
+        self.assertEqual(stats['timeouts'], 0)
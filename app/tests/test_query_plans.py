@@ -0,0 +1,262 @@
+import os
+import re
+import json
+import unittest
+import tempfile
+from sqlalchemy import event
+from app import create_app, url_prefix
+from app.models import db, token_cache, token_version_cache
+
+app = create_app('test')
+
+
+class QueryPlansTestCase(unittest.TestCase):
+    """Testcases checking the endpoints' queries are served by indexes"""
+    def setUp(self):
+        self.db_fd, app.config['DATABASE'] = tempfile.mkstemp()
+        app.testing = True
+        self.app = app.test_client()
+        self.user = {
+            "username": "flacode",
+            "password": "flavia",
+            "email": "fnshem@gmail.com"
+            }
+        self.shopping_list = {
+            "name": "bakery",
+            "due_date": "2017-08-17"
+            }
+        self.item = {
+            "name": "sweetpotatoes",
+            "quantity": 6,
+            "bought_from": "kalerwe",
+            "status": False
+            }
+        with app.app_context():
+            if db.engine.dialect.name != 'postgresql':
+                self.skipTest('query plans are checked on postgres')
+            db.drop_all()
+            db.create_all()
+        # ids are reused once the tables are recreated
+        token_cache.clear()
+        token_version_cache.clear()
+        self.statements = []
+
+    def tearDown(self):
+        os.close(self.db_fd)
+        os.unlink(app.config['DATABASE'])
+
+    def record_statement(self, conn, cursor, statement, parameters,
+                         context, executemany):
+        if statement.startswith('SELECT') and (
+                'FROM shopping_lists' in statement or 'FROM items' in statement):
+            self.statements.append((statement, parameters))
+
+    def explain(self, statement, parameters):
+        """Return the plan postgres picks when sequential scans are
+        discouraged, tables in the tests are too small to need an index
+        """
+        with app.app_context():
+            connection = db.engine.raw_connection()
+            try:
+                cursor = connection.cursor()
+                cursor.execute('SET enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + statement, parameters)
+                return '\n'.join(row[0] for row in cursor.fetchall())
+            finally:
+                connection.rollback()
+                connection.close()
+
+    def test_endpoints_use_index_scans(self):
+        """Test every query of the list and item endpoints uses an index"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({"username": "flacode",
+                                             "password": "flavia"}),
+                            headers={'Content-Type': 'application/json'})
+        access_token = json.loads(res.data.decode())['access_token']
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': access_token}
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', self.record_statement)
+        try:
+            self.app.post(url_prefix+'/shoppinglists/',
+                          data=json.dumps(self.shopping_list), headers=headers)
+            self.app.post(url_prefix+'/shoppinglists/1/items/',
+                          data=json.dumps(self.item), headers=headers)
+            self.app.get(url_prefix+'/shoppinglists/', headers=headers)
+            self.app.get(url_prefix+'/shoppinglists/?cursor=', headers=headers)
+            self.app.get(url_prefix+'/shoppinglists/1', headers=headers)
+            self.app.get(url_prefix+'/shoppinglists/?include=items',
+                         headers=headers)
+            self.app.get(url_prefix+'/export', headers=headers)
+            self.app.get(url_prefix+'/shoppinglists/1/items/', headers=headers)
+            for query in ['sort=name&cursor=', 'status=true&cursor=',
+                          'bought_from=kalerwe', 'stream=true']:
+                self.app.get(url_prefix+'/shoppinglists/1/items/?'+query,
+                             headers=headers)
+            self.app.put(url_prefix+'/shoppinglists/1/items/1',
+                         data=json.dumps({"name": "yams"}), headers=headers)
+            self.app.put(url_prefix+'/shoppinglists/1',
+                         data=json.dumps({"name": "cakes"}), headers=headers)
+            self.app.delete(url_prefix+'/shoppinglists/1/items/1',
+                            headers=headers)
+            self.app.delete(url_prefix+'/shoppinglists/1', headers=headers)
+        finally:
+            event.remove(engine, 'before_cursor_execute', self.record_statement)
+        self.assertTrue(self.statements)
+        for statement, parameters in self.statements:
+            plan = self.explain(statement, parameters)
+            self.assertNotIn('Seq Scan', plan, statement + '\n' + plan)
+
+    def test_users_listing_uses_index_scans(self):
+        """Test the paged and prefix filtered users listing uses an index"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        with app.app_context():
+            engine = db.engine
+
+        def record_statement(conn, cursor, statement, parameters,
+                             context, executemany):
+            if statement.startswith('SELECT') and 'FROM users' in statement:
+                self.statements.append((statement, parameters))
+        event.listen(engine, 'before_cursor_execute', record_statement)
+        try:
+            for query in ['limit=1', 'cursor=WzFd', 'username=fla', 'email=fn']:
+                self.app.get(url_prefix+'/auth/users?'+query)
+        finally:
+            event.remove(engine, 'before_cursor_execute', record_statement)
+        self.assertEqual(len(self.statements), 4)
+        for statement, parameters in self.statements:
+            plan = self.explain(statement, parameters)
+            self.assertNotIn('Seq Scan', plan, statement + '\n' + plan)
+        # prefixes are byte ranges of an index in the same order
+        for (statement, parameters), name in zip(self.statements[2:], ['username', 'email']):
+            plan = self.explain(statement, parameters)
+            self.assertIn('using ix_users_{}_c'.format(name), plan)
+            self.assertRegex(plan, r'Index Cond: .*{}.*>='.format(name), plan)
+
+    def test_cursor_pages_seek_in_the_index(self):
+        """Test a cursor is an index condition of the shopping lists page,
+        not a filter applied to every list before it
+        """
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({"username": "flacode",
+                                             "password": "flavia"}),
+                            headers={'Content-Type': 'application/json'})
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': json.loads(res.data.decode())['access_token']}
+        for due_date in ['2017-08-17', '2017-08-18', None, None]:
+            self.app.post(url_prefix+'/shoppinglists/', headers=headers,
+                          data=json.dumps({"name": "bakery", "due_date": due_date}))
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', self.record_statement)
+        try:
+            cursor = ''
+            names = []
+            while cursor is not None:
+                res = self.app.get(url_prefix+'/shoppinglists/?limit=1&cursor='+cursor,
+                                   headers=headers)
+                data = json.loads(res.data.decode())
+                names.extend(data['shopping_lists'])
+                cursor = data['next_cursor']
+        finally:
+            event.remove(engine, 'before_cursor_execute', self.record_statement)
+        self.assertEqual([shopping_list['id'] for shopping_list in names], [1, 2, 3, 4])
+        plans = [self.explain(statement, parameters)
+                 for statement, parameters in self.statements]
+        seeks = [plan for plan in plans if 'ROW(due_date, id) >' in plan]
+        self.assertTrue(seeks)
+        for plan in plans:
+            self.assertNotIn('Seq Scan', plan)
+            for line in plan.splitlines():
+                # neither the cursor nor the null tail is filtered row by row
+                if 'Filter:' in line:
+                    self.assertNotIn('due_date', line, plan)
+                    self.assertNotIn('(id >', line, plan)
+        for plan in seeks:
+            self.assertRegex(plan, r'Index Cond: .*ROW\(due_date, id\) >', plan)
+
+    def test_item_cursor_pages_seek_in_the_index(self):
+        """Test a cursor is an index condition of the items page sorted
+        by name
+        """
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({"username": "flacode",
+                                             "password": "flavia"}),
+                            headers={'Content-Type': 'application/json'})
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': json.loads(res.data.decode())['access_token']}
+        self.app.post(url_prefix+'/shoppinglists/', headers=headers,
+                      data=json.dumps(self.shopping_list))
+        for name in ['yams', 'beans', 'rice']:
+            self.item['name'] = name
+            self.app.post(url_prefix+'/shoppinglists/1/items/', headers=headers,
+                          data=json.dumps(self.item))
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', self.record_statement)
+        try:
+            cursor = ''
+            items = []
+            while cursor is not None:
+                res = self.app.get(url_prefix+'/shoppinglists/1/items/?sort=name'
+                                   '&limit=1&cursor='+cursor, headers=headers)
+                data = json.loads(res.data.decode())
+                items.extend(data['Items'])
+                cursor = data['next_cursor']
+        finally:
+            event.remove(engine, 'before_cursor_execute', self.record_statement)
+        self.assertEqual([item['name'] for item in items], ['beans', 'rice', 'yams'])
+        plans = [self.explain(statement, parameters)
+                 for statement, parameters in self.statements
+                 if 'FROM items' in statement]
+        # name is compared as text
+        seek = re.compile(r'ROW\(\(name\)::text, id\) >')
+        seeks = [plan for plan in plans if seek.search(plan)]
+        self.assertTrue(seeks)
+        for plan in seeks:
+            self.assertRegex(plan, r'Index Cond: .*' + seek.pattern, plan)
+            self.assertNotRegex(plan, r'Filter: .*' + seek.pattern, plan)
+
+    def test_embedded_items_are_read_per_list(self):
+        """Test the items embedded in shopping lists are read with a limit
+        per list from the index, not numbered over every item of the lists
+        """
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({"username": "flacode",
+                                             "password": "flavia"}),
+                            headers={'Content-Type': 'application/json'})
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': json.loads(res.data.decode())['access_token']}
+        for _ in range(2):
+            self.app.post(url_prefix+'/shoppinglists/', headers=headers,
+                          data=json.dumps(self.shopping_list))
+            self.app.post(url_prefix+'/shoppinglists/1/items/', headers=headers,
+                          data=json.dumps([self.item] * 3))
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', self.record_statement)
+        try:
+            res = self.app.get(url_prefix+'/shoppinglists/?include=items&items_limit=2',
+                               headers=headers)
+        finally:
+            event.remove(engine, 'before_cursor_execute', self.record_statement)
+        data = json.loads(res.data.decode())
+        self.assertEqual([len(shopping_list['items']) for shopping_list
+                          in data['shopping_lists']], [2, 0])
+        statements = [(statement, parameters) for statement, parameters in self.statements
+                      if 'FROM items' in statement]
+        self.assertEqual(len(statements), 1)
+        self.assertIn('LATERAL', statements[0][0])
+        plan = self.explain(*statements[0])
+        self.assertNotIn('WindowAgg', plan)
+        self.assertRegex(plan, r'Index Cond: \(shopping_list_id = shopping_lists\.id\)', plan)
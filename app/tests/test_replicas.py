@@ -0,0 +1,143 @@
+import os
+import json
+import unittest
+import tempfile
+from app import create_app, db, url_prefix
+from app.cache import LRUCache, ResponseCache, SQLiteCache
+from app.models import Users, token_cache, token_version_cache
+from app.routing import replicas
+
+app = create_app('test')
+
+
+class ReplicasTestCase(unittest.TestCase):
+    """Testcases for sending reads to a replica of the database, a sqlite
+    database that only gets the rows the tests copy to it
+    """
+    def setUp(self):
+        self.db_fd, app.config['DATABASE'] = tempfile.mkstemp()
+        self.replica_fd, self.replica_path = tempfile.mkstemp()
+        app.testing = True
+        self.binds = app.config['SQLALCHEMY_BINDS']
+        app.config['SQLALCHEMY_BINDS'] = {'replica_0': 'sqlite:///' + self.replica_path}
+        app.extensions.pop('replicas', None)
+        self.app = app.test_client()
+        self.user = {
+            "username": "flacode",
+            "password": "flavia",
+            "email": "fnshem@gmail.com"
+            }
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            self.replica = db.get_engine(app, bind='replica_0')
+            db.Model.metadata.create_all(bind=self.replica)
+        # ids are reused once the tables are recreated
+        token_cache.clear()
+        token_version_cache.clear()
+
+    def tearDown(self):
+        self.replica.dispose()
+        app.extensions['sqlalchemy'].connectors.pop('replica_0', None)
+        app.extensions.pop('replicas', None)
+        app.extensions.pop('response_cache', None)
+        app.config['SQLALCHEMY_BINDS'] = self.binds
+        for fd, path in [(self.db_fd, app.config['DATABASE']),
+                         (self.replica_fd, self.replica_path)]:
+            os.close(fd)
+            os.unlink(path)
+
+    def create_shopping_list(self):
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({"username": "flacode",
+                                             "password": "flavia"}),
+                            headers={'Content-Type': 'application/json'})
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': json.loads(res.data.decode())['access_token']}
+        # the replica has the account but lags behind on its shopping lists
+        with app.app_context():
+            users = Users.__table__
+            self.replica.execute(users.insert(), [
+                dict(row) for row in db.engine.execute(users.select())])
+        self.app.post(url_prefix+'/shoppinglists/',
+                      data=json.dumps({"name": "bakery", "due_date": "2017-08-17"}),
+                      headers=headers)
+        return headers
+
+    def view_shopping_lists(self, client, headers):
+        result = client.get(url_prefix+'/shoppinglists/', headers=headers)
+        self.assertEqual(result.status_code, 200)
+        return json.loads(result.data.decode()).get('shopping_lists', [])
+
+    def test_writers_read_their_writes(self):
+        """Test reads go to the replica unless the client wrote recently"""
+        headers = self.create_shopping_list()
+        # the writer is pinned by its cookie and by its user id
+        self.assertEqual(len(self.view_shopping_lists(self.app, headers)), 1)
+        self.assertEqual(len(self.view_shopping_lists(app.test_client(), headers)), 1)
+        with app.app_context():
+            replicas().pins.clear()
+            self.assertEqual(self.view_shopping_lists(app.test_client(), headers), [])
+            self.assertEqual(replicas().stats()['replica_reads'], 1)
+            # a pin expires after REPLICA_PIN seconds
+            replicas().pin_ttl = 0
+        self.app.put(url_prefix+'/shoppinglists/1', data=json.dumps({"name": "cakes"}),
+                     headers=headers)
+        self.assertEqual(self.view_shopping_lists(self.app, headers), [])
+        result = self.app.get(url_prefix+'/metrics',
+                              headers={'Authorization': app.config['METRICS_TOKEN']})
+        self.assertEqual(json.loads(result.data.decode())['replicas']['replica_reads'], 2)
+
+    def test_failing_replica_falls_back_to_primary(self):
+        """Test a replica that fails is skipped and the read is retried on
+        the primary
+        """
+        headers = self.create_shopping_list()
+        db.Model.metadata.drop_all(bind=self.replica)
+        with app.app_context():
+            replicas().pins.clear()
+        client = app.test_client()
+        self.assertEqual(len(self.view_shopping_lists(client, headers)), 1)
+        with app.app_context():
+            stats = replicas().stats()
+        self.assertEqual((stats['down'], stats['failures']), (['replica_0'], 1))
+        # the replica is not tried again until REPLICA_RETRY seconds passed
+        self.assertEqual(len(self.view_shopping_lists(client, headers)), 1)
+        with app.app_context():
+            stats = replicas().stats()
+        self.assertEqual((stats['replica_reads'], stats['primary_reads']), (1, 1))
+
+    def test_pins_are_shared_by_workers(self):
+        """Test a client without the cookie reads its writes in another
+        worker when responses are cached in a shared backend
+        """
+        cache_fd, cache_path = tempfile.mkstemp()
+        try:
+            app.extensions['response_cache'] = ResponseCache(
+                SQLiteCache(cache_path, maxsize=100, ttl=60))
+            headers = self.create_shopping_list()
+            # the next worker has its own replica set on the same file
+            app.extensions.pop('replicas')
+            app.extensions['response_cache'] = ResponseCache(
+                SQLiteCache(cache_path, maxsize=100, ttl=60))
+            self.assertEqual(len(self.view_shopping_lists(app.test_client(), headers)), 1)
+        finally:
+            os.close(cache_fd)
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(cache_path + suffix):
+                    os.unlink(cache_path + suffix)
+
+    def test_replica_responses_are_not_cached(self):
+        """Test a response read from a lagging replica is not served from
+        the cache once the primary is read again
+        """
+        app.extensions['response_cache'] = ResponseCache(LRUCache(maxsize=100, ttl=60))
+        headers = self.create_shopping_list()
+        with app.app_context():
+            replicas().pins.clear()
+        self.assertEqual(self.view_shopping_lists(app.test_client(), headers), [])
+        # reads use the primary again, as when the replica is down
+        app.extensions['replicas'] = None
+        self.assertEqual(len(self.view_shopping_lists(app.test_client(), headers)), 1)
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import fnmatch
+import unittest
+import tempfile
+from app import create_app, url_prefix
+from app.cache import LRUCache, RedisCache, ResponseCache, SQLiteCache
+from app.models import db, token_cache, token_version_cache
+
+app = create_app('test')
+
+
+class FakeRedis(object):
+    """In-memory stand in for the redis client commands the cache uses"""
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            del self.data[key]
+            return None
+        return value
+
+    def set(self, key, value, px=None):
+        expires_at = time.time() + px / 1000.0 if px else None
+        self.data[key] = (value.encode(), expires_at)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def scan_iter(self, match='*'):
+        return [key for key in list(self.data) if fnmatch.fnmatch(key, match)]
+
+
+class LocalResponseCacheTestCase(unittest.TestCase):
+    """Testcases for cached shopping list and item responses"""
+    def setUp(self):
+        self.db_fd, app.config['DATABASE'] = tempfile.mkstemp()
+        app.testing = True
+        self.app = app.test_client()
+        self.user = {
+            "username": "flacode",
+            "password": "flavia",
+            "email": "fnshem@gmail.com"
+            }
+        self.shopping_list = {
+            "name": "bakery",
+            "due_date": "2017-08-17"
+            }
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        # ids are reused once the tables are recreated
+        token_cache.clear()
+        token_version_cache.clear()
+        app.extensions['response_cache'] = ResponseCache(self.make_backend())
+
+    def tearDown(self):
+        app.extensions.pop('response_cache')
+        os.close(self.db_fd)
+        os.unlink(app.config['DATABASE'])
+
+    def make_backend(self):
+        return LRUCache(maxsize=100, ttl=60)
+
+    def login_user(self):
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({"username": "flacode",
+                                             "password": "flavia"}),
+                            headers={'Content-Type': 'application/json'})
+        return {'Content-Type': 'application/json',
+                'Authorization': json.loads(res.data.decode())['access_token']}
+
+    def response_cache_stats(self):
+        result = self.app.get(url_prefix+'/metrics',
+                              headers={'Authorization': app.config['METRICS_TOKEN']})
+        return json.loads(result.data.decode())['response_cache']
+
+    def test_reads_are_cached_until_a_write(self):
+        """Test responses are served from the cache and invalidated by writes"""
+        headers = self.login_user()
+        for _ in range(2):
+            self.app.post(url_prefix+'/shoppinglists/',
+                          data=json.dumps(self.shopping_list), headers=headers)
+        self.app.post(url_prefix+'/shoppinglists/1/items/',
+                      data=json.dumps({"name": "milk", "quantity": 1}),
+                      headers=headers)
+        first = self.app.get(url_prefix+'/shoppinglists/1/items/', headers=headers)
+        second = self.app.get(url_prefix+'/shoppinglists/1/items/', headers=headers)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+        self.assertEqual(self.response_cache_stats()['hits'], 1)
+        not_modified = self.app.get(
+            url_prefix+'/shoppinglists/1/items/',
+            headers=dict(headers, **{'If-None-Match': second.headers['ETag']}))
+        self.assertEqual(not_modified.status_code, 304)
+        lists = self.app.get(url_prefix+'/shoppinglists/', headers=headers)
+        # moving an item changes both lists and the collection
+        self.app.patch(url_prefix+'/shoppinglists/1/items/',
+                       data=json.dumps({"ids": [1], "set": {"shopping_list_id": 2}}),
+                       headers=headers)
+        result = self.app.get(url_prefix+'/shoppinglists/1/items/', headers=headers)
+        self.assertIn('Shopping list is empty', str(result.data))
+        result = self.app.get(url_prefix+'/shoppinglists/2/items/', headers=headers)
+        self.assertIn('milk', str(result.data))
+        result = self.app.get(url_prefix+'/shoppinglists/', headers=headers)
+        self.assertNotEqual(result.headers['ETag'], lists.headers['ETag'])
+        self.app.put(url_prefix+'/shoppinglists/2',
+                     data=json.dumps({"name": "cakes"}), headers=headers)
+        result = self.app.get(url_prefix+'/shoppinglists/2', headers=headers)
+        self.assertIn('cakes', str(result.data))
+
+    def test_responses_are_not_shared_between_users(self):
+        """Test a cached response is only served to the user it was made for"""
+        headers = self.login_user()
+        self.app.post(url_prefix+'/shoppinglists/',
+                      data=json.dumps(self.shopping_list), headers=headers)
+        self.app.get(url_prefix+'/shoppinglists/1', headers=headers)
+        self.user = {"username": "other", "password": "other",
+                     "email": "other@gmail.com"}
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({"username": "other",
+                                             "password": "other"}),
+                            headers={'Content-Type': 'application/json'})
+        access_token = json.loads(res.data.decode())['access_token']
+        result = self.app.get(url_prefix+'/shoppinglists/1',
+                              headers={'Authorization': access_token})
+        self.assertEqual(result.status_code, 404)
+
+
+class SharedResponseCacheTestCase(LocalResponseCacheTestCase):
+    """Testcases for responses cached in a file shared by workers"""
+    def make_backend(self):
+        self.cache_fd, self.cache_path = tempfile.mkstemp()
+        return SQLiteCache(self.cache_path, maxsize=100, ttl=60)
+
+    def tearDown(self):
+        super(SharedResponseCacheTestCase, self).tearDown()
+        os.close(self.cache_fd)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.cache_path + suffix):
+                os.unlink(self.cache_path + suffix)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        """Test the shared cache stays within its size"""
+        cache = SQLiteCache(self.cache_path, maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        time.sleep(0.01)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['size'], 2)
+        cache.set('d', 4, ttl=-1)
+        self.assertIsNone(cache.get('d'))
+
+
+class RedisResponseCacheTestCase(LocalResponseCacheTestCase):
+    """Testcases for responses cached in redis"""
+    def make_backend(self):
+        return RedisCache(FakeRedis(), ttl=60)
@@ -1,9 +1,21 @@
 import os
 import json
+import sqlite3
 import unittest
 import tempfile
 from base64 import b64encode
-from app import app, db, url_prefix
+from flask_migrate import Migrate, upgrade
+from sqlalchemy import event
+from app import create_app, db, url_prefix
+from app.config import TestConfig
+from app.models import (Items, ShoppingLists, _search_backends, token_cache,
+                        token_version_cache)
+from app.tasks import reap_deleted
+
+app = create_app('test')
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))), 'migrations')
 
 
 class ShoppingListTestCase(unittest.TestCase):
@@ -33,6 +45,9 @@ class ShoppingListTestCase(unittest.TestCase):
         with app.app_context():
             db.drop_all()
             db.create_all()
+        # ids are reused once the tables are recreated
+        token_cache.clear()
+        token_version_cache.clear()
 
     def tearDown(self):
         os.close(self.db_fd)
@@ -127,6 +142,67 @@ class ShoppingListTestCase(unittest.TestCase):
         self.assertIn('Shopping list to match the search key not found.',
                       str(result.data))
 
+    def test_search_shopping_lists(self):
+        """Test search is case insensitive and treats wildcards literally"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.login_user()
+        # obtain access token
+        access_token = json.loads(res.data.decode())['access_token']
+        for shopping_list in [self.shopping_list, self.shopping_list1,
+                              {"name": "Bakery extras",
+                               "due_date": "2017-08-20"}]:
+            self.app.post(url_prefix+'/shoppinglists/',
+                          data=json.dumps(shopping_list),
+                          headers={'Content-Type': 'application/json',
+                                   'Authorization': access_token})
+        result = self.app.get(url_prefix+'/shoppinglists/?q=BAKERY',
+                              headers={'Authorization': access_token})
+        names = [shopping_list['name'] for shopping_list
+                 in json.loads(result.data.decode())['shopping_lists']]
+        self.assertEqual(sorted(names), ['Bakery extras', 'bakery'])
+        result = self.app.get(url_prefix+'/shoppinglists/?q=%25',
+                              headers={'Authorization': access_token})
+        self.assertIn('Shopping list to match the search key not found.',
+                      str(result.data))
+
+    def test_trigram_search_ranks_and_tolerates_typos(self):
+        """Test the trigram search finds names with a typo in the key and
+        returns the closest name first
+        """
+        with app.app_context():
+            if db.engine.dialect.name != 'postgresql' or not db.engine.execute(
+                    "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'").first():
+                self.skipTest('trigram search needs pg_trgm')
+            installed = db.engine.execute(
+                "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").first()
+            db.engine.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            db.engine.execute('CREATE INDEX ix_shopping_lists_name_trgm ON shopping_lists '
+                              'USING gin (name gin_trgm_ops)')
+        _search_backends.clear()
+        try:
+            self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                          headers={'Content-Type': 'application/json'})
+            access_token = json.loads(self.login_user().data.decode())['access_token']
+            for shopping_list in [{"name": "Bakery extras", "due_date": "2017-08-20"},
+                                  self.shopping_list, self.shopping_list1]:
+                self.app.post(url_prefix+'/shoppinglists/',
+                              data=json.dumps(shopping_list),
+                              headers={'Content-Type': 'application/json',
+                                       'Authorization': access_token})
+            result = self.app.get(url_prefix+'/shoppinglists/?q=bakeri',
+                                  headers={'Authorization': access_token})
+            names = [shopping_list['name'] for shopping_list
+                     in json.loads(result.data.decode())['shopping_lists']]
+            self.assertEqual(names[0], 'bakery')
+            self.assertNotIn('food', names)
+        finally:
+            with app.app_context():
+                db.engine.execute('DROP INDEX ix_shopping_lists_name_trgm')
+                if not installed:
+                    db.engine.execute('DROP EXTENSION pg_trgm')
+            _search_backends.clear()
+
     def test_view_all_shopping_lists_with_limit(self):
         """Test to view all shopping lists with a limit on
            the number of posts per page
@@ -160,6 +236,119 @@ class ShoppingListTestCase(unittest.TestCase):
         self.assertIn('food', str(shopping_list.data))
         self.assertNotIn('hardware', str(shopping_list.data))
 
+    def test_view_all_shopping_lists_with_cursor(self):
+        """Test to page through shopping lists with a cursor"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.login_user()
+        # obtain access token
+        access_token = json.loads(res.data.decode())['access_token']
+        for shopping_list in [self.shopping_list2, self.shopping_list,
+                              self.shopping_list1, {"name": "someday",
+                                                    "due_date": None}]:
+            self.app.post(url_prefix+'/shoppinglists/',
+                          data=json.dumps(shopping_list),
+                          headers={'Content-Type': 'application/json',
+                                   'Authorization': access_token})
+        result = self.app.get(
+            url_prefix+'/shoppinglists/?cursor=&limit=3&count=exact',
+            headers={'Authorization': access_token})
+        self.assertEqual(result.status_code, 200)
+        data = json.loads(result.data.decode())
+        self.assertEqual(data['total'], 4)
+        self.assertEqual([shopping_list['name'] for shopping_list
+                          in data['shopping_lists']],
+                         ['bakery', 'food', 'hardware'])
+        result = self.app.get(
+            url_prefix+'/shoppinglists/?limit=3&count=estimate&cursor=' +
+            data['next_cursor'],
+            headers={'Authorization': access_token})
+        data = json.loads(result.data.decode())
+        self.assertIn('total', data)
+        self.assertEqual([shopping_list['name'] for shopping_list
+                          in data['shopping_lists']], ['someday'])
+        self.assertIsNone(data['next_cursor'])
+        result = self.app.get(url_prefix+'/shoppinglists/?cursor=abc',
+                              headers={'Authorization': access_token})
+        self.assertEqual(result.status_code, 400)
+        self.assertIn('Invalid cursor', str(result.data))
+
+    def test_view_shopping_lists_with_fields(self):
+        """Test to view only some fields of the shopping lists"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.login_user()
+        # obtain access token
+        access_token = json.loads(res.data.decode())['access_token']
+        for shopping_list in [self.shopping_list, self.shopping_list1]:
+            self.app.post(url_prefix+'/shoppinglists/',
+                          data=json.dumps(shopping_list),
+                          headers={'Content-Type': 'application/json',
+                                   'Authorization': access_token})
+        for query in ['fields=name', 'fields=name&cursor=&limit=1']:
+            result = self.app.get(url_prefix+'/shoppinglists/?'+query,
+                                  headers={'Authorization': access_token})
+            shopping_lists = json.loads(result.data.decode())['shopping_lists']
+            self.assertEqual(shopping_lists[0], {'name': 'bakery'})
+        result = self.app.get(url_prefix+'/shoppinglists/?fields=name,user_id',
+                              headers={'Authorization': access_token})
+        self.assertEqual(result.status_code, 400)
+        self.assertIn('Unknown field', str(result.data))
+
+    def test_view_shopping_lists_with_items(self):
+        """Test to view shopping lists with their items in one request"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.login_user()
+        # obtain access token
+        access_token = json.loads(res.data.decode())['access_token']
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': access_token}
+        for shopping_list in [self.shopping_list, self.shopping_list1,
+                              self.shopping_list2]:
+            self.app.post(url_prefix+'/shoppinglists/',
+                          data=json.dumps(shopping_list), headers=headers)
+        self.app.post(url_prefix+'/shoppinglists/1/items/',
+                      data=json.dumps([{"name": "bread", "quantity": 1},
+                                       {"name": "cake", "quantity": 1}]),
+                      headers=headers)
+        self.app.post(url_prefix+'/shoppinglists/2/items/',
+                      data=json.dumps({"name": "rice", "quantity": 1}),
+                      headers=headers)
+        statements = []
+
+        def record_statement(conn, cursor, statement, *args):
+            if 'FROM items' in statement:
+                statements.append(statement)
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', record_statement)
+        try:
+            result = self.app.get(
+                url_prefix+'/shoppinglists/?include=items&items_limit=1',
+                headers=headers)
+        finally:
+            event.remove(engine, 'before_cursor_execute', record_statement)
+        self.assertEqual(len(statements), 1)
+        shopping_lists = json.loads(result.data.decode())['shopping_lists']
+        self.assertEqual([(len(shopping_list['items']), shopping_list['more_items'])
+                          for shopping_list in shopping_lists],
+                         [(1, True), (1, False), (0, False)])
+        self.assertEqual(shopping_lists[0]['items'][0]['name'], 'bread')
+        result = self.app.get(
+            url_prefix+'/shoppinglists/?include=items&fields=name&cursor=',
+            headers=headers)
+        shopping_list = json.loads(result.data.decode())['shopping_lists'][0]
+        self.assertEqual(set(shopping_list), {'name', 'items', 'more_items'})
+        self.assertEqual(len(shopping_list['items']), 2)
+        result = self.app.get(url_prefix+'/shoppinglists/2?include=items',
+                              headers=headers)
+        shopping_list = json.loads(result.data.decode())['shopping list']
+        self.assertEqual(shopping_list['items'][0]['name'], 'rice')
+        result = self.app.get(url_prefix+'/shoppinglists/2?include=users',
+                              headers=headers)
+        self.assertEqual(result.status_code, 400)
+
     def test_view_all_shopping_lists_unauthenticated_user(self):
         result = self.app.get(url_prefix+'/shoppinglists/')
         self.assertEqual(result.status_code, 401)
@@ -196,6 +385,35 @@ class ShoppingListTestCase(unittest.TestCase):
         self.assertEqual(shopping_list.status_code, 200)
         self.assertIn('shopping list', str(shopping_list.data))
 
+    def test_conditional_get_of_shopping_lists(self):
+        """Test shopping lists are revalidated with their etag"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.login_user()
+        # obtain access token
+        access_token = json.loads(res.data.decode())['access_token']
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': access_token}
+        self.app.post(url_prefix+'/shoppinglists/',
+                      data=json.dumps(self.shopping_list), headers=headers)
+        for url in ['/shoppinglists/', '/shoppinglists/1']:
+            result = self.app.get(url_prefix+url, headers=headers)
+            etag = result.headers['ETag']
+            result = self.app.get(url_prefix+url,
+                                  headers=dict(headers, **{'If-None-Match': etag}))
+            self.assertEqual(result.status_code, 304)
+        collection = self.app.get(url_prefix+'/shoppinglists/',
+                                  headers=headers).headers['ETag']
+        # adding an item changes the list and the collection
+        self.app.post(url_prefix+'/shoppinglists/1/items/',
+                      data=json.dumps({"name": "bread", "quantity": 1}),
+                      headers=headers)
+        for url, etag in [('/shoppinglists/', collection),
+                          ('/shoppinglists/1', etag)]:
+            result = self.app.get(url_prefix+url,
+                                  headers=dict(headers, **{'If-None-Match': etag}))
+            self.assertEqual(result.status_code, 200)
+
     def test_update_shopping_list(self):
         """Test if user can update shopping list details"""
         no_token = self.app.put(url_prefix+'/shoppinglists/1',
@@ -280,3 +498,107 @@ class ShoppingListTestCase(unittest.TestCase):
                                   headers={'Authorization': access_token})
         self.assertEqual(deleted.status_code, 200)
         self.assertIn('Shopping list successfully deleted', str(deleted.data))
+
+    def test_soft_delete_shopping_list(self):
+        """Test a deleted shopping list disappears at once and is removed
+        with its items by the reaper
+        """
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.login_user()
+        # obtain access token
+        access_token = json.loads(res.data.decode())['access_token']
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': access_token}
+        for shopping_list in [self.shopping_list, self.shopping_list1]:
+            self.app.post(url_prefix+'/shoppinglists/',
+                          data=json.dumps(shopping_list), headers=headers)
+        self.app.post(url_prefix+'/shoppinglists/1/items/',
+                      data=json.dumps([{"name": "bread", "quantity": 1},
+                                       {"name": "cake", "quantity": 1}]),
+                      headers=headers)
+        app.config['SOFT_DELETE'] = True
+        try:
+            result = self.app.delete(url_prefix+'/shoppinglists/1', headers=headers)
+        finally:
+            app.config['SOFT_DELETE'] = False
+        self.assertEqual(result.status_code, 200)
+        for url in ['/shoppinglists/1', '/shoppinglists/1/items/']:
+            result = self.app.get(url_prefix+url, headers=headers)
+            self.assertEqual(result.status_code, 404)
+        result = self.app.get(url_prefix+'/shoppinglists/', headers=headers)
+        self.assertNotIn('bakery', str(result.data))
+        result = self.app.get(url_prefix+'/export', headers=headers)
+        self.assertNotIn('bread', str(result.data))
+        with app.app_context():
+            self.assertEqual(ShoppingLists.query.count(), 2)
+            batch_size = app.config['REAPER_BATCH_SIZE']
+            app.config['REAPER_BATCH_SIZE'] = 1
+            try:
+                counts = reap_deleted()
+            finally:
+                app.config['REAPER_BATCH_SIZE'] = batch_size
+            self.assertEqual((counts['items'], counts['shopping_lists']), (2, 1))
+            self.assertEqual(ShoppingLists.query.count(), 1)
+            self.assertEqual(Items.query.count(), 0)
+
+
+class Fts5SearchTestCase(unittest.TestCase):
+    """Testcases for the fts5 search on a sqlite database made by the
+    migrations
+    """
+    def setUp(self):
+        try:
+            sqlite3.connect(':memory:').execute(
+                "CREATE VIRTUAL TABLE t USING fts5(name, tokenize='trigram')")
+        except sqlite3.OperationalError:
+            self.skipTest('fts5 search needs sqlite 3.34 with fts5')
+        self.db_fd, self.path = tempfile.mkstemp(suffix='.db')
+
+        class SqliteConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + self.path
+            SQLALCHEMY_BINDS = None
+        self.sqlite_app = create_app(SqliteConfig)
+        Migrate(self.sqlite_app, db, directory=MIGRATIONS)
+        with self.sqlite_app.app_context():
+            upgrade()
+        self.app = self.sqlite_app.test_client()
+        token_cache.clear()
+        token_version_cache.clear()
+
+    def tearDown(self):
+        with self.sqlite_app.app_context():
+            db.get_engine(self.sqlite_app).dispose()
+        os.close(self.db_fd)
+        os.unlink(self.path)
+        token_cache.clear()
+        token_version_cache.clear()
+
+    def test_fts5_search_ranks_matches(self):
+        """Test the fts5 search matches inside names, ignores case and
+        returns the closest name first
+        """
+        self.app.post(url_prefix+'/auth/register',
+                      data=json.dumps({"username": "flacode", "password": "flavia",
+                                       "email": "fnshem@gmail.com"}),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({"username": "flacode", "password": "flavia"}),
+                            headers={'Content-Type': 'application/json'})
+        access_token = json.loads(res.data.decode())['access_token']
+        with self.sqlite_app.app_context():
+            # added through the session, sqlite takes no date strings
+            db.session.add_all([ShoppingLists(name, 1) for name
+                                in ['Bakery extras', 'bakery', 'food']])
+            db.session.commit()
+            self.assertEqual(ShoppingLists.search_backend(), 'fts5')
+        result = self.app.get(url_prefix+'/shoppinglists/?q=BAKERY',
+                              headers={'Authorization': access_token})
+        names = [shopping_list['name'] for shopping_list
+                 in json.loads(result.data.decode())['shopping_lists']]
+        self.assertEqual(names, ['bakery', 'Bakery extras'])
+        result = self.app.get(url_prefix+'/shoppinglists/?q=xtra',
+                              headers={'Authorization': access_token})
+        names = [shopping_list['name'] for shopping_list
+                 in json.loads(result.data.decode())['shopping_lists']]
+        self.assertEqual(names, ['Bakery extras'])
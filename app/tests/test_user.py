@@ -2,8 +2,15 @@ import os
 import json
 import unittest
 import tempfile
-from app import app, url_prefix
-from app.models import db
+from app import create_app, url_prefix
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+from app.models import (db, token_cache, token_version_cache, BlacklistTokens,
+                        Items, ShoppingLists, Users)
+from app.tasks import reap_deleted
+
+app = create_app('test')
 
 
 class UsersTestCase(unittest.TestCase):
@@ -20,6 +27,9 @@ class UsersTestCase(unittest.TestCase):
         with app.app_context():
             db.drop_all()
             db.create_all()
+        # ids are reused once the tables are recreated
+        token_cache.clear()
+        token_version_cache.clear()
 
     def tearDown(self):
         os.close(self.db_fd)
@@ -260,6 +270,159 @@ class UsersTestCase(unittest.TestCase):
         self.assertIn('You are logged out. Please log in again.',
                       str(logout.data))
 
+    def test_token_cache(self):
+        """Test verified tokens are cached until logout"""
+        token_cache.clear()
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({
+                                "username": "flacode",
+                                "password": "flavia"}),
+                            headers={'Content-Type': 'application/json'})
+        access_token = json.loads(res.data.decode())['access_token']
+        for _ in range(2):
+            result = self.app.get(url_prefix+'/shoppinglists/',
+                                  headers={'Authorization': access_token})
+            self.assertEqual(result.status_code, 200)
+        self.assertEqual(token_cache.stats()['misses'], 1)
+        self.assertEqual(token_cache.stats()['hits'], 1)
+        self.app.post(url_prefix+'/auth/logout',
+                      headers={'Authorization': access_token})
+        self.assertIsNone(token_cache.get(access_token))
+        result = self.app.get(url_prefix+'/shoppinglists/',
+                              headers={'Authorization': access_token})
+        self.assertEqual(result.status_code, 401)
+        self.assertIn('You are logged out. Please log in again.',
+                      str(result.data))
+
+    def test_token_cached_before_logout_elsewhere(self):
+        """Test a cached token stops working once another worker logged it
+        out and this worker's filter picked up the revocation
+        """
+        token_cache.clear()
+        BlacklistTokens.reset_filter()
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({
+                                "username": "flacode",
+                                "password": "flavia"}),
+                            headers={'Content-Type': 'application/json'})
+        access_token = json.loads(res.data.decode())['access_token']
+        result = self.app.get(url_prefix+'/shoppinglists/',
+                              headers={'Authorization': access_token})
+        self.assertEqual(result.status_code, 200)
+        # revoked by another worker, the token stays in this one's cache
+        with app.app_context():
+            db.session.add(BlacklistTokens(access_token))
+            db.session.commit()
+            BlacklistTokens._filter_refreshed_at = 0
+        self.assertIsNotNone(token_cache.get(access_token))
+        result = self.app.get(url_prefix+'/shoppinglists/',
+                              headers={'Authorization': access_token})
+        self.assertEqual(result.status_code, 401)
+        BlacklistTokens.reset_filter()
+
+    def test_prune_blacklist(self):
+        """Test expired blacklisted tokens are pruned and unknown
+        tokens are ruled out by the filter"""
+        BlacklistTokens.reset_filter()
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({
+                                "username": "flacode",
+                                "password": "flavia"}),
+                            headers={'Content-Type': 'application/json'})
+        access_token = json.loads(res.data.decode())['access_token']
+        self.app.post(url_prefix+'/auth/logout',
+                      headers={'Authorization': access_token})
+        with app.app_context():
+            self.assertTrue(BlacklistTokens.check_blacklist(access_token))
+            self.assertFalse(BlacklistTokens._might_be_blacklisted(
+                BlacklistTokens.hash_token('not-revoked')))
+            # live tokens are kept
+            self.assertEqual(BlacklistTokens.prune(), 0)
+            revoked = BlacklistTokens.query.first()
+            revoked.expires_at = datetime.utcnow() - timedelta(minutes=1)
+            db.session.commit()
+            self.assertEqual(BlacklistTokens.prune(), 1)
+            self.assertEqual(BlacklistTokens.query.count(), 0)
+
+    def test_filter_picks_up_late_commits(self):
+        """Test a token revoked in a transaction that commits after a
+        refresh, with a lower id than the rows it read, is picked up by
+        the next refresh
+        """
+        BlacklistTokens.reset_filter()
+        blacklist = BlacklistTokens.__table__
+        now = datetime.utcnow()
+        with app.app_context():
+            db.session.execute(blacklist.insert().values(
+                id=10, token_hash='a' * 64, expires_at=now + timedelta(minutes=60),
+                blacklisted_on=now))
+            db.session.commit()
+            self.assertTrue(BlacklistTokens._might_be_blacklisted('a' * 64))
+            # revoked before the refresh, visible only after it
+            db.session.execute(blacklist.insert().values(
+                id=3, token_hash='b' * 64, expires_at=now + timedelta(minutes=60),
+                blacklisted_on=now - timedelta(seconds=1)))
+            db.session.commit()
+            BlacklistTokens._filter_refreshed_at = 0
+            self.assertTrue(BlacklistTokens._might_be_blacklisted('b' * 64))
+        BlacklistTokens.reset_filter()
+
+    def test_logout_all_sessions(self):
+        """Test logging out of all sessions revokes every token"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        tokens = []
+        for credentials in [{"username": "flacode", "password": "flavia"},
+                            {"email": "fnshem@gmail.com", "password": "flavia"}]:
+            res = self.app.post(url_prefix+'/auth/login',
+                                data=json.dumps(credentials),
+                                headers={'Content-Type': 'application/json'})
+            tokens.append(json.loads(res.data.decode())['access_token'])
+        result = self.app.post(url_prefix+'/auth/logout-all',
+                               headers={'Authorization': tokens[0]})
+        self.assertEqual(result.status_code, 200)
+        self.assertIn('Successfully logged out of all sessions',
+                      str(result.data))
+        for token in tokens:
+            result = self.app.get(url_prefix+'/shoppinglists/',
+                                  headers={'Authorization': token})
+            self.assertEqual(result.status_code, 401)
+            self.assertIn('You are logged out. Please log in again.',
+                          str(result.data))
+
+    def test_reset_password_revokes_tokens(self):
+        """Test tokens issued before a password reset stop working"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({
+                                "username": "flacode",
+                                "password": "flavia"}),
+                            headers={'Content-Type': 'application/json'})
+        access_token = json.loads(res.data.decode())['access_token']
+        self.app.post(url_prefix+'/auth/reset-password',
+                      data=json.dumps({"username": "flacode",
+                                       "password": "new_password"}),
+                      headers={'Content-Type': 'application/json'})
+        result = self.app.get(url_prefix+'/shoppinglists/',
+                              headers={'Authorization': access_token})
+        self.assertEqual(result.status_code, 401)
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({
+                                "username": "flacode",
+                                "password": "new_password"}),
+                            headers={'Content-Type': 'application/json'})
+        access_token = json.loads(res.data.decode())['access_token']
+        result = self.app.get(url_prefix+'/shoppinglists/',
+                              headers={'Authorization': access_token})
+        self.assertEqual(result.status_code, 200)
+
     def test_user_with_invalid_token(self):
         """test user logout with invalid token"""
         result = self.app.post(url_prefix+'/auth/logout',
@@ -285,6 +448,69 @@ class UsersTestCase(unittest.TestCase):
         self.assertEqual(result.status_code, 200)
         self.assertIn('Users', str(result.data))
 
+    def test_page_filter_and_stream_users(self):
+        """Test users are paged with a cursor, filtered by prefix and streamed"""
+        for name in ['ann', 'anna', 'an_x', 'bob', 'annie']:
+            self.app.post(url_prefix+'/auth/register',
+                          data=json.dumps({"username": name, "password": "secret",
+                                           "email": name + "@gmail.com"}),
+                          headers={'Content-Type': 'application/json'})
+        result = self.app.get(url_prefix+'/auth/users?limit=2&fields=username')
+        page = json.loads(result.data.decode())
+        self.assertEqual(page['Users'], [{'username': 'ann'}, {'username': 'anna'}])
+        names = []
+        while page['next_cursor']:
+            names += [user['username'] for user in page['Users']]
+            page = json.loads(self.app.get(
+                url_prefix+'/auth/users?limit=2&fields=username&cursor=' +
+                page['next_cursor']).data.decode())
+        names += [user['username'] for user in page['Users']]
+        self.assertEqual(names, ['ann', 'anna', 'an_x', 'bob', 'annie'])
+        # the underscore is matched literally and results follow the username
+        result = self.app.get(url_prefix+'/auth/users?username=ann&limit=2&fields=username')
+        page = json.loads(result.data.decode())
+        self.assertEqual([user['username'] for user in page['Users']], ['ann', 'anna'])
+        page = json.loads(self.app.get(
+            url_prefix+'/auth/users?username=ann&limit=2&fields=username&cursor=' +
+            page['next_cursor']).data.decode())
+        self.assertEqual(page, {'Users': [{'username': 'annie'}], 'next_cursor': None})
+        result = self.app.get(url_prefix+'/auth/users?username=an_&fields=username')
+        self.assertEqual(json.loads(result.data.decode())['Users'], [{'username': 'an_x'}])
+        result = self.app.get(url_prefix+'/auth/users?email=bo&fields=email')
+        self.assertEqual(json.loads(result.data.decode())['Users'],
+                         [{'email': 'bob@gmail.com'}])
+        result = self.app.get(url_prefix+'/auth/users?stream=true&username=ann&fields=id')
+        self.assertEqual(result.mimetype, 'application/json')
+        self.assertEqual(json.loads(result.data.decode()),
+                         {'Users': [{'id': 1}, {'id': 2}, {'id': 5}]})
+        result = self.app.get(url_prefix+'/auth/users?cursor=garbage')
+        self.assertEqual(result.status_code, 400)
+        # punctuation counts in the prefix whatever the database collation
+        for name in ['a-z', 'a.b']:
+            self.app.post(url_prefix+'/auth/register',
+                          data=json.dumps({"username": name, "password": "secret",
+                                           "email": name + "@gmail.com"}),
+                          headers={'Content-Type': 'application/json'})
+        result = self.app.get(url_prefix+'/auth/users?username=a-&fields=username')
+        self.assertEqual(json.loads(result.data.decode())['Users'], [{'username': 'a-z'}])
+
+    def test_metrics_need_the_metrics_token(self):
+        """Test the metrics are only served with METRICS_TOKEN"""
+        result = self.app.get(url_prefix+'/metrics')
+        self.assertEqual(result.status_code, 401)
+        result = self.app.get(url_prefix+'/metrics', headers={'Authorization': 'guess'})
+        self.assertEqual(result.status_code, 401)
+        result = self.app.get(url_prefix+'/metrics',
+                              headers={'Authorization': app.config['METRICS_TOKEN']})
+        self.assertEqual(result.status_code, 200)
+        token = app.config['METRICS_TOKEN']
+        app.config['METRICS_TOKEN'] = ''
+        try:
+            result = self.app.get(url_prefix+'/metrics', headers={'Authorization': token})
+            self.assertEqual(result.status_code, 404)
+        finally:
+            app.config['METRICS_TOKEN'] = token
+
     def test_get_one_user(self):
         """Test get one user account"""
         self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
@@ -307,3 +533,162 @@ class UsersTestCase(unittest.TestCase):
         del_user = self.app.delete(url_prefix+'/auth/user/1')
         self.assertEqual(del_user.status_code, 200)
         self.assertIn('User account successfully deleted', str(del_user.data))
+
+    def test_delete_user_cascades_in_the_database(self):
+        """Test deleting a user is one statement that removes its lists and items"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({"username": "flacode",
+                                             "password": "flavia"}),
+                            headers={'Content-Type': 'application/json'})
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': json.loads(res.data.decode())['access_token']}
+        self.app.post(url_prefix+'/shoppinglists/',
+                      data=json.dumps({"name": "bakery", "due_date": "2017-08-17"}),
+                      headers=headers)
+        self.app.post(url_prefix+'/shoppinglists/1/items/',
+                      data=json.dumps([{"name": "bread", "quantity": 1},
+                                       {"name": "cake", "quantity": 1}]),
+                      headers=headers)
+        statements = []
+
+        def record_statement(conn, cursor, statement, *args):
+            if 'shopping_lists' in statement or 'items' in statement:
+                statements.append(statement)
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', record_statement)
+        try:
+            result = self.app.delete(url_prefix+'/auth/user/1')
+        finally:
+            event.remove(engine, 'before_cursor_execute', record_statement)
+        self.assertEqual(result.status_code, 200)
+        # the lists and items are neither loaded nor deleted one by one
+        self.assertEqual(statements, [])
+        with app.app_context():
+            self.assertEqual(ShoppingLists.query.count(), 0)
+            self.assertEqual(Items.query.count(), 0)
+
+    def test_soft_delete_user(self):
+        """Test a deleted account stops working at once, can be registered
+        again and is removed by the reaper
+        """
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({"username": "flacode",
+                                             "password": "flavia"}),
+                            headers={'Content-Type': 'application/json'})
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': json.loads(res.data.decode())['access_token']}
+        self.app.post(url_prefix+'/shoppinglists/',
+                      data=json.dumps({"name": "bakery", "due_date": "2017-08-17"}),
+                      headers=headers)
+        self.app.post(url_prefix+'/shoppinglists/1/items/',
+                      data=json.dumps({"name": "bread", "quantity": 1}),
+                      headers=headers)
+        app.config['SOFT_DELETE'] = True
+        try:
+            result = self.app.delete(url_prefix+'/auth/user/1')
+        finally:
+            app.config['SOFT_DELETE'] = False
+        self.assertEqual(result.status_code, 200)
+        result = self.app.get(url_prefix+'/shoppinglists/', headers=headers)
+        self.assertEqual(result.status_code, 401)
+        result = self.app.get(url_prefix+'/auth/user/1')
+        self.assertEqual(result.status_code, 404)
+        with app.app_context():
+            counts = reap_deleted()
+            self.assertEqual(counts, {'orphaned_shopping_lists': 1, 'items': 1,
+                                      'shopping_lists': 1, 'users': 1})
+            self.assertEqual(Users.query.count(), 0)
+        # the username of an account waiting for the reaper can be taken again
+        # while its shopping lists are left to the reaper
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        res = self.app.post(url_prefix+'/auth/login',
+                            data=json.dumps({"username": "flacode",
+                                             "password": "flavia"}),
+                            headers={'Content-Type': 'application/json'})
+        headers['Authorization'] = json.loads(res.data.decode())['access_token']
+        self.app.post(url_prefix+'/shoppinglists/',
+                      data=json.dumps({"name": "bakery", "due_date": "2017-08-17"}),
+                      headers=headers)
+        app.config['SOFT_DELETE'] = True
+        try:
+            self.app.delete(url_prefix+'/auth/user/2')
+        finally:
+            app.config['SOFT_DELETE'] = False
+        result = self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                               headers={'Content-Type': 'application/json'})
+        self.assertEqual(result.status_code, 201)
+        with app.app_context():
+            self.assertEqual(Users.query.count(), 2)
+            self.assertEqual(ShoppingLists.query.count(), 1)
+
+    def test_outdated_password_hash_is_upgraded_on_login(self):
+        """Test a hash made with a lower cost is replaced when the user logs in"""
+        self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                      headers={'Content-Type': 'application/json'})
+        with app.app_context():
+            user = Users.query.filter_by(username='flacode').first()
+            user.password = generate_password_hash('flavia', 'pbkdf2:sha256:1000')
+            user.save()
+        result = self.app.post(url_prefix+'/auth/login',
+                               data=json.dumps({"username": "flacode",
+                                                "password": "flavia"}),
+                               headers={'Content-Type': 'application/json'})
+        self.assertEqual(result.status_code, 200)
+        with app.app_context():
+            user = Users.query.filter_by(username='flacode').first()
+            self.assertTrue(user.password.startswith(
+                app.config['PASSWORD_HASH_METHOD'] + '$'))
+
+    def test_current_password_hash_is_kept_on_login(self):
+        """Test a hash made with the configured method is not replaced when
+        the method leaves the cost to werkzeug's default
+        """
+        method = app.config['PASSWORD_HASH_METHOD']
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256'
+        try:
+            self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                          headers={'Content-Type': 'application/json'})
+            with app.app_context():
+                registered = Users.query.filter_by(username='flacode').first().password
+            for _ in range(2):
+                result = self.app.post(url_prefix+'/auth/login',
+                                       data=json.dumps({"username": "flacode",
+                                                        "password": "flavia"}),
+                                       headers={'Content-Type': 'application/json'})
+                self.assertEqual(result.status_code, 200)
+            with app.app_context():
+                user = Users.query.filter_by(username='flacode').first()
+                self.assertEqual(user.password, registered)
+        finally:
+            app.config['PASSWORD_HASH_METHOD'] = method
+
+    def test_password_hashing_in_worker_processes(self):
+        """Test passwords are hashed by the pool and requests beyond its
+        queue are turned away
+        """
+        app.config['PASSWORD_HASH_WORKERS'] = 1
+        app.extensions.pop('hashing_pool', None)
+        try:
+            self.app.post(url_prefix+'/auth/register', data=json.dumps(self.user),
+                          headers={'Content-Type': 'application/json'})
+            login = json.dumps({"username": "flacode", "password": "flavia"})
+            result = self.app.post(url_prefix+'/auth/login', data=login,
+                                   headers={'Content-Type': 'application/json'})
+            self.assertEqual(result.status_code, 200)
+            stats = json.loads(self.app.get(
+                url_prefix+'/metrics',
+                headers={'Authorization': app.config['METRICS_TOKEN']}).data.decode())
+            self.assertEqual(stats['password_hashing']['completed'], 2)
+            app.extensions['hashing_pool'].max_pending = 0
+            result = self.app.post(url_prefix+'/auth/login', data=login,
+                                   headers={'Content-Type': 'application/json'})
+            self.assertEqual(result.status_code, 503)
+        finally:
+            app.config['PASSWORD_HASH_WORKERS'] = 0
+            app.extensions.pop('hashing_pool').shutdown()
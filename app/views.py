@@ -1,10 +1,193 @@
+import io
 import json
+import hashlib
+from datetime import datetime
+from functools import wraps
 from validate_email import validate_email
-from flask import Blueprint, jsonify, make_response, request
-from werkzeug.security import check_password_hash, generate_password_hash
-from app.models import Items, ShoppingLists, Users, BlacklistTokens
+from flask import (Blueprint, Response, after_this_request, current_app, g,
+                   jsonify, make_response, request, stream_with_context)
+from app import db
+from app.auth import clear_identity, current_user, require_auth, require_metrics_token
+from app.cache import response_cache
+from app.hashing import (HashingBusy, check_password, hash_password,
+                         hashing_pool, needs_rehash)
+from app.importer import Importer, read_csv, read_ndjson
+from app.models import (Items, ShoppingLists, Users, BlacklistTokens,
+                        token_cache, token_version_cache)
+from app.pagination import (bytewise, decode_cursor, encode_cursor, estimate_count,
+                            keyset_page, prefix_filter)
+from app.pool import StatementTimeout, pool_stats
+from app.routing import pin_writers, read_only, replicas
 
 api = Blueprint('api', __name__, url_prefix='/api')
+api.before_request(clear_identity)
+api.after_request(pin_writers)
+
+# fields of each resource that clients can ask for with ?fields=
+USER_FIELDS = ['id', 'username', 'email']
+SHOPPING_LIST_FIELDS = ['id', 'name', 'due_date']
+ITEM_FIELDS = ['id', 'name', 'quantity', 'bought_from', 'status']
+
+
+def etag_for(*parts):
+    """Return a strong etag for the version stamps of a response"""
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def not_modified(etag, last_modified):
+    """Return a 304 response when the client already has the current
+    representation, otherwise send the validators with the response
+    """
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response
+
+    @after_this_request
+    def add_validators(response):
+        if response.status_code == 200:
+            response.set_etag(etag)
+            response.last_modified = last_modified
+        return response
+    return None
+
+
+def requested_fields(available):
+    """Return the fields named in ?fields= or all available fields, and
+    an error message if an unknown field is asked for
+    """
+    fields = request.args.get('fields', None)
+    if not fields:
+        return available, None
+    names = []
+    for name in fields.split(','):
+        name = name.strip()
+        if name not in available:
+            return None, 'Unknown field {!r}, fields are {}'.format(
+                name, ', '.join(available))
+        if name not in names:
+            names.append(name)
+    return names, None
+
+
+def project(query, model, names, *keys):
+    """Select only the columns of names and of the sort keys, the rows
+    are named tuples rather than model instances
+    """
+    names = names + [key for key in keys if key not in names]
+    return query.with_entities(*[getattr(model, name) for name in names])
+
+
+def row_data(row, names):
+    """Return the dictionary representation of the fields of a row"""
+    return {name: getattr(row, name) for name in names}
+
+
+def include_items():
+    """Return whether ?include=items asks for the items of shopping lists
+    and an error message if something else is asked for
+    """
+    include = request.args.get('include', None)
+    if not include:
+        return False, None
+    if include != 'items':
+        return False, 'Only items can be included'
+    return True, None
+
+
+def embed_items(output, list_ids):
+    """Nest the first items of every shopping list in the output, lists
+    with more items than returned are marked with more_items
+    """
+    limit = request.args.get('items_limit', current_app.config['EMBEDDED_ITEMS_LIMIT'], type=int)
+    limit = max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+    items = {list_id: [] for list_id in list_ids}
+    if list_ids:
+        # one extra item per list tells whether there are more
+        for row in Items.first_in_lists(list_ids, limit + 1, ITEM_FIELDS):
+            items[row.shopping_list_id].append(row)
+    for shopping_list_data, list_id in zip(output, list_ids):
+        shopping_list_data['items'] = [row_data(row, ITEM_FIELDS)
+                                       for row in items[list_id][:limit]]
+        shopping_list_data['more_items'] = len(items[list_id]) > limit
+
+
+def cached_response(f):
+    """Decorator serving GET requests of an authenticated user from the
+    response cache. Responses of views with an id argument depend on
+    that shopping list, other responses on all of the user's lists
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        cache = response_cache()
+        if cache is None or request.method != 'GET':
+            return f(*args, **kwargs)
+        if 'id' in kwargs:
+            try:
+                names = ['list:{}'.format(int(kwargs['id']))]
+            except ValueError:
+                return f(*args, **kwargs)
+        else:
+            names = ['user:{}'.format(g.user_id)]
+        key = cache.key([request.endpoint, g.user_id, kwargs,
+                         sorted(request.args.items(multi=True))], names)
+        entry = cache.get(key)
+        if entry is not None:
+            response = Response(entry['body'], status=entry['status'],
+                                headers=entry['headers'])
+            return response.make_conditional(request)
+        response = make_response(f(*args, **kwargs))
+
+        # a replica may not have the write that made the current
+        # generations yet, its responses are served but not stored
+        if db.session.info.get('replica') is not None:
+            return response
+
+        @after_this_request
+        def store(response):
+            # runs after the validators were added to the response
+            if response.status_code == 200 and not response.is_streamed:
+                cache.set(key, response.status_code, list(response.headers),
+                          response.get_data(as_text=True))
+            return response
+        return response
+    return decorated
+
+
+@api.errorhandler(HashingBusy)
+def hashing_busy(error):
+    response = make_response(jsonify({'message': 'Server is busy, please try again'}), 503)
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+@api.errorhandler(StatementTimeout)
+def statement_timeout(error):
+    response = make_response(jsonify({'message': 'Request took too long, please try again'}), 503)
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+@api.route('/metrics', methods=['GET'])
+@require_metrics_token
+def view_metrics():
+    """Hit and miss counters of the caches, the password hashing queue,
+    the connection pools and the reads sent to replicas by this process
+    """
+    cache = response_cache()
+    pool = hashing_pool()
+    replica_set = replicas()
+    response = {
+        'response_cache': cache.stats() if cache is not None else None,
+        'token_cache': token_cache.stats(),
+        'token_version_cache': token_version_cache.stats(),
+        'password_hashing': pool.stats() if pool is not None else None,
+        'database_pools': pool_stats(db),
+        'replicas': replica_set.stats() if replica_set is not None else None
+    }
+    return make_response(jsonify(response)), 200
+
 
 @api.route('/auth/register', methods=['POST'])
 def create_account():
@@ -17,7 +200,7 @@ def create_account():
         response = {'message': 'Missing required fields for user'}
         return make_response(jsonify(response)), 400
     # check if the username is unique
-    user = Users.query.filter_by(username=data_username).first()
+    user = Users.active().filter_by(username=data_username).first()
     if not validate_email(data_email):
         response = {'message': 'Invalid user email'}
         return make_response(jsonify(response)), 400
@@ -49,16 +232,20 @@ def login_user():
         }
         return make_response(jsonify(response)), 401
     if data_email:
-        user = Users.query.filter_by(email=data_email).first()
+        user = Users.active().filter_by(email=data_email).first()
     else:
-        user = Users.query.filter_by(username=data_username).first()
+        user = Users.active().filter_by(username=data_username).first()
     if not user:
         response = {
             'message': 'User account does not exist'
         }
         return make_response(jsonify(response)), 401
     # compare the hashed password and password provided
-    if check_password_hash(user.password, data_password):
+    if check_password(user.password, data_password):
+        # upgrade hashes made with an outdated method or cost
+        if needs_rehash(user.password):
+            user.password = hash_password(data_password)
+            user.save()
         # generate access token for authenticated user
         access_token = user.generate_token(user.id)
         if access_token:
@@ -89,63 +276,92 @@ def reset_password():
         }
         return make_response(jsonify(response)), 401
     if username:
-        user = Users.query.filter_by(username=username).first()
+        user = Users.active().filter_by(username=username).first()
     else:
-        user = Users.query.filter_by(email=email).first()
+        user = Users.active().filter_by(email=email).first()
     if not user:
         response = {'message': 'No user information found'}
         return make_response(jsonify(response)), 404
     # hash the password before saving it
-    user.password = generate_password_hash(password)
-    user.save()
+    user.password = hash_password(password)
+    # tokens issued with the old password stop working
+    user.revoke_tokens()
     response = {'message': 'You have successfully changed your password.'}
     # notifying the user that they reset their password successfully
     return make_response(jsonify(response)), 200
 
 
 @api.route('/auth/logout', methods=['POST'])
+@require_auth
 def logout_user():
     """API endpoint to logout user"""
-    access_token = request.headers.get('Authorization')
-    if access_token:
-        # attempt to decode the token and get the User ID
-        user_id = Users.decode_token(access_token)
-        if not isinstance(user_id, str):
-            blacklist_token = BlacklistTokens(token=access_token)
-            blacklist_token.save()
-            response = {
-                'message': 'Successfully logged out'
-            }
-            return make_response(jsonify(response)), 200
-        else:
-            # user is not legit, so the payload is an error message
-            message = user_id
-            response = {'message': message}
-            return make_response(jsonify(response)), 401
-    rep = {'message': 'Please register or login.'}
-    return make_response(jsonify(rep)), 401
+    blacklist_token = BlacklistTokens(token=g.access_token)
+    blacklist_token.save()
+    response = {
+        'message': 'Successfully logged out'
+    }
+    return make_response(jsonify(response)), 200
+
+
+@api.route('/auth/logout-all', methods=['POST'])
+@require_auth
+def logout_all_sessions():
+    """API endpoint to logout user from all devices"""
+    current_user().revoke_tokens()
+    response = {
+        'message': 'Successfully logged out of all sessions'
+    }
+    return make_response(jsonify(response)), 200
 
 
 @api.route('/auth/users', methods=['GET'])
+@read_only
 def view_users():
-    users = Users.query.all()
-    output = []
-    for user in users:
-        user_data = {}
-        user_data['id'] = user.id
-        user_data['username'] = user.username
-        user_data['email'] = user.email
-        output.append(user_data)
-    if output == []:
+    """List user accounts a page at a time, ordered by id or by the
+    username or email a prefix filter is given for
+    """
+    fields, error = requested_fields(USER_FIELDS)
+    if error:
+        return make_response(jsonify({'message': error})), 400
+    query = Users.active()
+    sort = 'id'
+    for name in ('email', 'username'):
+        prefix = request.args.get(name, None)
+        if prefix:
+            query = query.filter(*prefix_filter(getattr(Users, name), prefix))
+            sort = name
+    column = getattr(Users, sort)
+    if sort != 'id':
+        # in the order of the prefix range so one index serves both
+        column = bytewise(column)
+    if request.args.get('stream', '').lower() == 'true':
+        return stream_rows(project(query.order_by(column), Users, fields), fields, 'Users')
+    limit = request.args.get('limit', current_app.config['MAX_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+    cursor = request.args.get('cursor', None)
+    if cursor:
+        try:
+            last, = decode_cursor(cursor, int if sort == 'id' else str)
+        except ValueError:
+            return make_response(jsonify({'message': 'Invalid cursor'})), 400
+        query = query.filter(column > last)
+    users = project(query.order_by(column), Users, fields, sort).limit(limit + 1).all()
+    output = [row_data(user, fields) for user in users[:limit]]
+    if output == [] and not cursor and sort == 'id':
         response = {'message': 'No users registered yet'}
         return make_response(jsonify(response)), 200
-    return make_response(jsonify({"Users": output})), 200
+    response = {'Users': output, 'next_cursor': None}
+    # an extra row means there is at least one more page
+    if len(users) > limit:
+        response['next_cursor'] = encode_cursor(getattr(users[limit - 1], sort))
+    return make_response(jsonify(response)), 200
 
 
 @api.route('/auth/user/<user_id>', methods=['GET'])
+@read_only
 def view_one_user(user_id):
     """View user account details given user id"""
-    user = Users.query.filter_by(id=user_id).first()
+    user = Users.active().filter_by(id=user_id).first()
     if not user:
         response = {'message': 'User account not found'}
         return make_response(jsonify(response)), 404
@@ -159,297 +375,522 @@ def view_one_user(user_id):
 @api.route('/auth/user/<user_id>', methods=['DELETE'])
 def delete_user(user_id):
     """Delete user account given user id"""
-    user = Users.query.filter_by(id=user_id).first()
+    user = Users.active().filter_by(id=user_id).first()
     if not user:
         response = {'message': 'User account not found'}
         return make_response(jsonify(response)), 404
-    user.delete()
+    if current_app.config['SOFT_DELETE']:
+        user.soft_delete()
+    else:
+        user.delete()
     rep = {'message': 'User account successfully deleted'}
     return make_response(jsonify(rep)), 200
 
 
 @api.route('/shoppinglists/', methods=['POST', 'GET'])
+@require_auth
+@read_only
+@cached_response
 def create_view_shopping_list():
     """Method to create or view shopping lists"""
-    # get the access token from header
-    access_token = request.headers.get('Authorization')
-    if access_token:
-        # attempt to decode the token and get the User ID
-        user_id = Users.decode_token(access_token)
-        if not isinstance(user_id, str):
-            # handle the request
-            if request.method == 'POST':
-                data = request.get_json()
-                if 'name' in data and 'due_date' in data:
-                    new_shopping_list = ShoppingLists(
-                        name=data['name'],
-                        user_id=user_id,
-                        due_date=data['due_date']
-                        )
-                    new_shopping_list.save()
-                    response = {'message': 'Shopping list created.'}
-                    return make_response(jsonify(response)), 201
-                else:
-                    response = {
-                        'message': 'Missing attributes, shopping list not created.'
-                        }
-                    return make_response(jsonify(response)), 400
-            else:
-                # block for request.method == 'GET'
-                key = request.args.get('q', None)
-                limit = request.args.get('limit', 10, type=int)
-                page = request.args.get('page', 1, type=int)
-                # check for a search key
-                if key:
-                    shopping_lists = ShoppingLists.query.filter(
-                        ShoppingLists.name.like("%"+key.strip()+"%")).filter_by(
-                            user_id=user_id).order_by(
-                                ShoppingLists.due_date).paginate(
-                                    page, limit, False).items
-                else:
-                    shopping_lists = ShoppingLists.query.filter_by(
-                        user_id=user_id).order_by(
-                            ShoppingLists.due_date).paginate(
-                                page, limit, False).items
-                # create a list of dictionary shopping lists
-                output = []
-                for shopping_list in shopping_lists:
-                    shopping_list_data = {}
-                    shopping_list_data['id'] = shopping_list.id
-                    shopping_list_data['name'] = shopping_list.name
-                    shopping_list_data['due_date'] = shopping_list.due_date
-                    output.append(shopping_list_data)
-                # check if there are any shopping lists in the database
-                if output == []:
-                    if key:
-                        message = "Shopping list to match the search key not found."
-                    else:
-                        message = "No shopping lists created yet."
-                    return make_response(jsonify({'message': message})), 200
-                return make_response(jsonify({"shopping_lists": output})), 200
+    user_id = g.user_id
+    # handle the request
+    if request.method == 'POST':
+        data = request.get_json()
+        if 'name' in data and 'due_date' in data:
+            new_shopping_list = ShoppingLists(
+                name=data['name'],
+                user_id=user_id,
+                due_date=data['due_date']
+                )
+            new_shopping_list.save()
+            response = {'message': 'Shopping list created.'}
+            return make_response(jsonify(response)), 201
         else:
-            # user is not legit, so the payload is an error message
-            message = user_id
-            response = {'message': message}
-            return make_response(jsonify(response)), 401
-    return make_response(jsonify({'message': 'Please register or login.'})), 401
+            response = {
+                'message': 'Missing attributes, shopping list not created.'
+                }
+            return make_response(jsonify(response)), 400
+    else:
+        # block for request.method == 'GET'
+        stamp = db.session.query(Users.lists_version, Users.lists_updated_at).filter_by(
+            id=user_id).first()
+        response = not_modified(
+            etag_for('lists', user_id, stamp.lists_version, sorted(request.args.items(multi=True))),
+            stamp.lists_updated_at)
+        if response:
+            return response
+        key = request.args.get('q', None)
+        limit = request.args.get('limit', 10, type=int)
+        page = request.args.get('page', 1, type=int)
+        cursor = request.args.get('cursor', None)
+        fields, error = requested_fields(SHOPPING_LIST_FIELDS)
+        if not error:
+            include, error = include_items()
+        if error:
+            return make_response(jsonify({'message': error})), 400
+        query = ShoppingLists.active(user_id)
+        rank = None
+        # check for a search key
+        if key:
+            query, rank = ShoppingLists.search(query, key)
+        if cursor is not None:
+            return view_shopping_lists_page(query, cursor, limit, fields, include)
+        if rank is not None:
+            # best matches first for searches
+            query = query.order_by(rank, ShoppingLists.id)
+        else:
+            query = query.order_by(ShoppingLists.due_date)
+        shopping_lists = project(query, ShoppingLists, fields, 'id').paginate(
+            page, limit, False).items
+        # create a list of dictionary shopping lists
+        output = [row_data(shopping_list, fields) for shopping_list in shopping_lists]
+        if include:
+            embed_items(output, [shopping_list.id for shopping_list in shopping_lists])
+        # check if there are any shopping lists in the database
+        if output == []:
+            if key:
+                message = "Shopping list to match the search key not found."
+            else:
+                message = "No shopping lists created yet."
+            return make_response(jsonify({'message': message})), 200
+        return make_response(jsonify({"shopping_lists": output})), 200
+
+
+def view_shopping_lists_page(query, cursor, limit, fields, include):
+    """Return one page of shopping lists after the given cursor, an
+    empty cursor starts from the first shopping list
+    """
+    limit = max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+    count = request.args.get('count', None)
+    response = {}
+    # totals are only computed when asked for
+    if count == 'exact':
+        response['total'] = query.count()
+    elif count == 'estimate':
+        response['total'] = estimate_count(query)
+    due_date = last_id = None
+    if cursor:
+        try:
+            due_date, last_id = decode_cursor(cursor, datetime, int)
+        except ValueError:
+            return make_response(jsonify({'message': 'Invalid cursor'})), 400
+    query = project(query, ShoppingLists, fields, 'due_date', 'id')
+    shopping_lists = ShoppingLists.page_after(query, due_date, last_id, limit + 1)
+    output = [row_data(shopping_list, fields) for shopping_list in shopping_lists[:limit]]
+    if include:
+        embed_items(output, [shopping_list.id for shopping_list in shopping_lists[:limit]])
+    # an extra row means there is at least one more page
+    response['next_cursor'] = None
+    if len(shopping_lists) > limit:
+        last = shopping_lists[limit - 1]
+        response['next_cursor'] = encode_cursor(last.due_date, last.id)
+    response['shopping_lists'] = output
+    return make_response(jsonify(response)), 200
+
 
 @api.route('/shoppinglists/<id>', methods=['GET'])
+@require_auth
+@read_only
+@cached_response
 def view_one_shopping_list(id):
     """Get shopping list details by id"""
-    # get the access token from header
-    access_token = request.headers.get('Authorization')
-    if access_token:
-        # attempt to decode the token and get the User ID
-        user_id = Users.decode_token(access_token)
-        if not isinstance(user_id, str):
-            # handle the request
-            shopping_list = ShoppingLists.query.filter_by(
-                user_id=user_id, id=id).first()
-            # check if the shopping list exists in the database
-            if shopping_list:
-                shopping_list_data = {}
-                shopping_list_data['id'] = shopping_list.id
-                shopping_list_data['name'] = shopping_list.name
-                shopping_list_data['due_date'] = shopping_list.due_date
-                return make_response(jsonify({
+    user_id = g.user_id
+    # handle the request
+    shopping_list = ShoppingLists.active(user_id).filter_by(id=id).first()
+    # check if the shopping list exists in the database
+    if shopping_list:
+        include, error = include_items()
+        if error:
+            return make_response(jsonify({'message': error})), 400
+        response = not_modified(
+            etag_for('list', shopping_list.id, shopping_list.version,
+                     sorted(request.args.items(multi=True))),
+            shopping_list.updated_at)
+        if response:
+            return response
+        shopping_list_data = {}
+        shopping_list_data['id'] = shopping_list.id
+        shopping_list_data['name'] = shopping_list.name
+        shopping_list_data['due_date'] = shopping_list.due_date
+        if include:
+            embed_items([shopping_list_data], [shopping_list.id])
+        return make_response(jsonify({
             "shopping list": shopping_list_data
             })), 200
-            return make_response(jsonify({
+    return make_response(jsonify({
         "message": "Shopping list can not be found"}
         )), 404
-        else:
-            # user is not legit, so the payload is an error message
-            message = user_id
-            response = {'message': message}
-            return make_response(jsonify(response)), 401
-    return make_response(jsonify({'message': 'Please register or login.'})), 401
+
 
 @api.route('/shoppinglists/<id>', methods=['PUT'])
+@require_auth
 def update_shopping_list(id):
     """Method for user to update shopping_list"""
-    # get the access token from header
-    access_token = request.headers.get('Authorization')
-    if access_token:
-        # attempt to decode the token and get the User ID
-        user_id = Users.decode_token(access_token)
-        if not isinstance(user_id, str):
-            # check if shopping list to update exists
-            shopping_list = ShoppingLists.query.filter_by(user_id=user_id, id=id).first()
-            if not shopping_list:
-                return make_response(jsonify({"message": "Shopping list can not be found"})), 404
-            data = request.get_json()
-            # check if data contains name update
-            if 'name' in json.dumps(data):
-                shopping_list.name = data['name']
-            # check if data contains due_date update
-            if 'due_date' in json.dumps(data):
-                shopping_list.due_date = data['due_date']
-            shopping_list.save()
-            return make_response(jsonify({"message": "Shopping list has been updated"})), 200
-        else:
-            # user is not legit, so the payload is an error message
-            message = user_id
-            response = {'message': message}
-            return make_response(jsonify(response)), 401
-    return make_response(jsonify({'message': 'Please register or login.'})), 401
+    user_id = g.user_id
+    # check if shopping list to update exists
+    shopping_list = ShoppingLists.active(user_id).filter_by(id=id).first()
+    if not shopping_list:
+        return make_response(jsonify({"message": "Shopping list can not be found"})), 404
+    data = request.get_json()
+    # check if data contains name update
+    if 'name' in json.dumps(data):
+        shopping_list.name = data['name']
+    # check if data contains due_date update
+    if 'due_date' in json.dumps(data):
+        shopping_list.due_date = data['due_date']
+    shopping_list.save()
+    return make_response(jsonify({"message": "Shopping list has been updated"})), 200
 
 @api.route('/shoppinglists/<id>', methods=['DELETE'])
+@require_auth
 def delete_shopping_list(id):
     """Method to delete a shopping list"""
-    # get the access token from header
-    access_token = request.headers.get('Authorization')
-    if access_token:
-        # attempt to decode the token and get the User ID
-        user_id = Users.decode_token(access_token)
-        if not isinstance(user_id, str):
-            # check if shopping list to be deleted exists in the database
-            shopping_list = ShoppingLists.query.filter_by(user_id=user_id, id=id).first()
-            if not shopping_list:
-                return make_response(jsonify({"message": "Shopping list can not be found"})), 404
-            shopping_list.delete()
-            return make_response(jsonify({"message": "Shopping list successfully deleted"})), 200
-        else:
-            # user is not legit, so the payload is an error message
-            message = user_id
-            response = {'message': message}
-            return make_response(jsonify(response)), 401
-    return make_response(jsonify({'message': 'Please register or login.'})), 401
+    user_id = g.user_id
+    # check if shopping list to be deleted exists in the database
+    shopping_list = ShoppingLists.active(user_id).filter_by(id=id).first()
+    if not shopping_list:
+        return make_response(jsonify({"message": "Shopping list can not be found"})), 404
+    if current_app.config['SOFT_DELETE']:
+        shopping_list.soft_delete()
+    else:
+        shopping_list.delete()
+    return make_response(jsonify({"message": "Shopping list successfully deleted"})), 200
 
 
 @api.route('/shoppinglists/<id>/items/', methods=['POST'])
+@require_auth
 def add_item_to_shopping_list(id):
-    # get the access token from header
-    access_token = request.headers.get('Authorization')
-    if access_token:
-        # attempt to decode the token and get the User ID
-        user_id = Users.decode_token(access_token)
-        if not isinstance(user_id, str):
-            # check if shopping list exists in the database
-            shopping_list = ShoppingLists.query.filter_by(user_id=user_id, id=id).first()
-            if not shopping_list:
-                return make_response(jsonify({"message": "Shopping list can not be found to add items"})), 404
-            data = request.get_json()
-            item = Items(name=data['name'], quantity=data['quantity'],
-                         shopping_list_id=id, bought_from=data['bought_from'],
-                         status=data['status'])
-            item.save()
-            return make_response(jsonify({"message": "Item added to shopping list"})), 201
-        else:
-            # user is not legit, so the payload is an error message
-            message = user_id
-            response = {'message': message}
-            return make_response(jsonify(response)), 401
-    return make_response(jsonify({'message': 'Please register or login.'})), 401
+    user_id = g.user_id
+    # check if shopping list exists in the database
+    shopping_list = ShoppingLists.active(user_id).filter_by(id=id).first()
+    if not shopping_list:
+        return make_response(jsonify({"message": "Shopping list can not be found to add items"})), 404
+    data = request.get_json()
+    if isinstance(data, list):
+        return add_items_to_shopping_list(id, data)
+    row, error = Items.validate(data)
+    if error:
+        return make_response(jsonify({"message": error})), 400
+    item = Items(shopping_list_id=id, **row)
+    item.save()
+    return make_response(jsonify({"message": "Item added to shopping list"})), 201
+
+
+def add_items_to_shopping_list(id, data):
+    """Validate a list of items and add all of them or none"""
+    if not data:
+        return make_response(jsonify({"message": "No items to add"})), 400
+    if len(data) > current_app.config['MAX_BULK_ITEMS']:
+        message = 'At most {} items can be added at once'.format(
+            current_app.config['MAX_BULK_ITEMS'])
+        return make_response(jsonify({"message": message})), 400
+    rows = []
+    errors = []
+    for index, item in enumerate(data):
+        row, error = Items.validate(item)
+        if error:
+            errors.append({'index': index, 'message': error})
+        rows.append(row)
+    if errors:
+        response = {"message": "Items not added to shopping list",
+                    "errors": errors}
+        return make_response(jsonify(response)), 400
+    ids = Items.bulk_create(int(id), rows)
+    response = {"message": "Items added to shopping list", "ids": ids}
+    return make_response(jsonify(response)), 201
+
+
+def select_items(id, data):
+    """Return the query for the items a bulk request applies to, given
+    as a list of ids or as a filter, and an error message if the
+    selection is invalid
+    """
+    if 'ids' in data:
+        ids = data['ids']
+        if not isinstance(ids, list) or not ids or not all(
+                isinstance(item_id, int) and not isinstance(item_id, bool)
+                for item_id in ids):
+            return None, 'Item ids must be a list of numbers'
+        return Items.select_in_list(id, ids=ids), None
+    if 'filter' in data:
+        item_filter = data['filter']
+        if not isinstance(item_filter, dict) or not set(item_filter) <= {'status', 'bought_from'}:
+            return None, 'Items can only be filtered by status and bought_from'
+        if 'status' in item_filter and not isinstance(item_filter['status'], bool):
+            return None, 'Item status must be true or false'
+        if not isinstance(item_filter.get('bought_from', ''), str):
+            return None, 'Item bought_from must be a string'
+        return Items.select_in_list(id, status=item_filter.get('status'),
+                                    bought_from=item_filter.get('bought_from')), None
+    return None, 'Item ids or a filter are required'
+
+
+@api.route('/shoppinglists/<int:id>/items/', methods=['PATCH'])
+@require_auth
+def update_items_in_shopping_list(id):
+    """Update or move many items of a shopping list at once"""
+    user_id = g.user_id
+    data = request.get_json() or {}
+    if not isinstance(data, dict):
+        return make_response(jsonify({"message": "Request body must be an object"})), 400
+    values = data.get('set')
+    if not isinstance(values, dict) or not values or not set(values) <= {
+            'status', 'bought_from', 'shopping_list_id'}:
+        return make_response(jsonify({
+            "message": "Only status, bought_from and shopping_list_id of items can be set"})), 400
+    if 'status' in values and not isinstance(values['status'], bool):
+        return make_response(jsonify({"message": "Item status must be true or false"})), 400
+    if values.get('bought_from') is not None and not isinstance(values['bought_from'], str):
+        return make_response(jsonify({"message": "Item bought_from must be a string"})), 400
+    destination = values.get('shopping_list_id', id)
+    if isinstance(destination, bool) or not isinstance(destination, int):
+        return make_response(jsonify({"message": "Shopping list id must be a number"})), 400
+    # check ownership of the shopping list and any destination at once
+    list_ids = {id, destination}
+    owned = ShoppingLists.active(user_id).filter(
+        ShoppingLists.id.in_(list_ids)).count()
+    if owned != len(list_ids):
+        return make_response(jsonify({"message": "Shopping list can not be found to update items"})), 404
+    query, error = select_items(id, data)
+    if error:
+        return make_response(jsonify({"message": error})), 400
+    count = Items.bulk_update(list_ids, query, values)
+    return make_response(jsonify({"message": "Items updated", "count": count})), 200
+
+
+@api.route('/shoppinglists/<int:id>/items/', methods=['DELETE'])
+@require_auth
+def delete_items_from_shopping_list(id):
+    """Delete many items of a shopping list at once"""
+    user_id = g.user_id
+    shopping_list = ShoppingLists.active(user_id).filter_by(id=id).first()
+    if not shopping_list:
+        return make_response(jsonify({"message": "Shopping list can not be found to update items"})), 404
+    data = request.get_json() or {}
+    if not isinstance(data, dict):
+        return make_response(jsonify({"message": "Request body must be an object"})), 400
+    query, error = select_items(id, data)
+    if error:
+        return make_response(jsonify({"message": error})), 400
+    count = Items.bulk_delete(id, query)
+    return make_response(jsonify({"message": "Items deleted", "count": count})), 200
 
 
 @api.route('/shoppinglists/<id>/items/<item_id>', methods=['PUT'])
+@require_auth
 def update_item_in_shopping_list(id, item_id):
-    # get the access token from header
-    access_token = request.headers.get('Authorization')
-    if access_token:
-        # attempt to decode the token and get the User ID
-        user_id = Users.decode_token(access_token)
-        if not isinstance(user_id, str):
-            # check if shopping list and item exist in the database
-            shopping_list = ShoppingLists.query.filter_by(user_id=user_id, id=id).first()
-            item = Items.query.filter_by(id=item_id).first()
-            if not shopping_list:
-                return make_response(jsonify({"message": "Shopping list can not be found to update items"})), 404
-            if not item:
-                return make_response(jsonify({"message": "Item can not be found in shopping list"})), 404
-            # check which parameters have been updated in the request
-            data = request.get_json()
-            if 'name' in json.dumps(data):
-                item.name = data['name']
-            if 'quantity' in json.dumps(data):
-                item.quantity = data['quantity']
-            if 'shopping_list_id' in json.dumps(data):
-                new_shopping_list = ShoppingLists.query.filter_by(id=data['shopping_list_id']).first()
-                if not new_shopping_list:
-                    return make_response(jsonify({"message": "Can not move item to not existent shopping list"})), 404
-                item.shopping_list_id = data['shopping_list_id']
-            if 'bought_from' in data:
-                item.bought_from = data['bought_from']
-            if 'status' in data:
-                item.status = data['status']
-            item.save()
-            return make_response(jsonify({"message": "Item updated"})), 200
-        else:
-            # user is not legit, so the payload is an error message
-            message = user_id
-            response = {'message': message}
-            return make_response(jsonify(response)), 401
-    return make_response(jsonify({'message': 'Please register or login.'})), 401
+    user_id = g.user_id
+    # check if shopping list and item exist in the database
+    found = Items.find_owned(user_id, id, item_id)
+    if not found:
+        return make_response(jsonify({"message": "Shopping list can not be found to update items"})), 404
+    shopping_list, item = found
+    if not item:
+        return make_response(jsonify({"message": "Item can not be found in shopping list"})), 404
+    # check which parameters have been updated in the request
+    data = request.get_json()
+    if 'name' in json.dumps(data):
+        item.name = data['name']
+    if 'quantity' in json.dumps(data):
+        item.quantity = data['quantity']
+    if 'shopping_list_id' in json.dumps(data):
+        new_shopping_list = ShoppingLists.active(user_id).filter_by(
+            id=data['shopping_list_id']).first()
+        if not new_shopping_list:
+            return make_response(jsonify({"message": "Can not move item to not existent shopping list"})), 404
+        item.shopping_list_id = data['shopping_list_id']
+    if 'bought_from' in data:
+        item.bought_from = data['bought_from']
+    if 'status' in data:
+        item.status = data['status']
+    item.save()
+    return make_response(jsonify({"message": "Item updated"})), 200
 
 
 @api.route('/shoppinglists/<id>/items/', methods=['GET'])
+@require_auth
+@read_only
+@cached_response
 def view_items_in_shopping_list(id):
     """Method to view items in shopping list"""
-    # get the access token from header
-    access_token = request.headers.get('Authorization')
-    if access_token:
-        # attempt to decode the token and get the User ID
-        user_id = Users.decode_token(access_token)
-        if not isinstance(user_id, str):
-            shopping_list = ShoppingLists.query.filter_by(user_id=user_id, id=id).first()
-            # check if shopping list exists
-            if not shopping_list:
-                return make_response(jsonify({"message": "Shopping list can not be found"})), 404
-            items = Items.query.filter_by(shopping_list_id=id).all()
-            # add items to a list of dictionary items
-            output = []
-            for item in items:
-                item_data = {}
-                item_data['id'] = item.id
-                item_data['name'] = item.name
-                item_data['quantity'] = item.quantity
-                item_data['bought_from'] = item.bought_from
-                item_data['status'] = item.status
-                output.append(item_data)
-            if output == []:
-                return make_response(jsonify({'message': 'Shopping list is empty'})), 200
-            return make_response(jsonify({"Items": output})), 200
+    user_id = g.user_id
+    shopping_list = ShoppingLists.active(user_id).filter_by(id=id).first()
+    # check if shopping list exists
+    if not shopping_list:
+        return make_response(jsonify({"message": "Shopping list can not be found"})), 404
+    # the list's version changes with every change to its items
+    response = not_modified(
+        etag_for('items', shopping_list.id, shopping_list.version,
+                 sorted(request.args.items(multi=True))),
+        shopping_list.updated_at)
+    if response:
+        return response
+    query = Items.query.filter_by(shopping_list_id=id)
+    status = request.args.get('status', None)
+    if status is not None:
+        if status.lower() not in ('true', 'false'):
+            return make_response(jsonify({'message': 'Invalid status filter'})), 400
+        query = query.filter(Items.status == (status.lower() == 'true'))
+    bought_from = request.args.get('bought_from', None)
+    if bought_from is not None:
+        query = query.filter(Items.bought_from == bought_from)
+    sort = request.args.get('sort', 'id')
+    if sort not in ('id', 'name'):
+        return make_response(jsonify({'message': 'Items can only be sorted by id or name'})), 400
+    fields, error = requested_fields(ITEM_FIELDS)
+    if error:
+        return make_response(jsonify({'message': error})), 400
+    if request.args.get('cursor', None) is not None:
+        return view_items_page(query, sort, fields)
+    if sort == 'name':
+        query = query.order_by(Items.name.nullslast(), Items.id)
+    else:
+        query = query.order_by(Items.id)
+    query = project(query, Items, fields)
+    if request.args.get('stream', '').lower() == 'true':
+        return stream_rows(query, fields, 'Items')
+    items = query.all()
+    # add items to a list of dictionary items
+    output = [row_data(item, fields) for item in items]
+    if output == []:
+        return make_response(jsonify({'message': 'Shopping list is empty'})), 200
+    return make_response(jsonify({"Items": output})), 200
+
+
+def view_items_page(query, sort, fields):
+    """Return one page of items after the cursor in the request, an
+    empty cursor starts from the first item
+    """
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', 10, type=int)
+    limit = max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+    name = last_id = None
+    try:
+        if sort == 'name' and cursor:
+            name, last_id = decode_cursor(cursor, str, int)
+        elif cursor:
+            last_id, = decode_cursor(cursor, int)
+            query = query.filter(Items.id > last_id)
+    except ValueError:
+        return make_response(jsonify({'message': 'Invalid cursor'})), 400
+    if sort == 'name':
+        items = keyset_page(project(query, Items, fields, 'name', 'id'),
+                            Items.name, Items.id, name, last_id, limit + 1)
+    else:
+        items = project(query.order_by(Items.id), Items, fields, 'id').limit(limit + 1).all()
+    response = {'Items': [row_data(item, fields) for item in items[:limit]],
+                'next_cursor': None}
+    # an extra row means there is at least one more page
+    if len(items) > limit:
+        last = items[limit - 1]
+        if sort == 'name':
+            response['next_cursor'] = encode_cursor(last.name, last.id)
         else:
-            # user is not legit, so the payload is an error message
-            message = user_id
-            response = {'message': message}
-            return make_response(jsonify(response)), 401
-    return make_response(jsonify({'message': 'Please register or login.'})), 401
+            response['next_cursor'] = encode_cursor(last.id)
+    return make_response(jsonify(response)), 200
+
+
+def stream_rows(query, fields, key):
+    """Stream the rows of a query as they are fetched from the database,
+    as a JSON object with the list of rows under key
+    """
+    batch_size = current_app.config['STREAM_BATCH_SIZE']
+
+    def generate():
+        yield '{' + json.dumps(key) + ': ['
+        separator = ''
+        for row in query.execution_options(stream_results=True).yield_per(batch_size):
+            yield separator + json.dumps(row_data(row, fields))
+            separator = ','
+        yield ']}'
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+@api.route('/export', methods=['GET'])
+@require_auth
+@read_only
+def export_shopping_lists():
+    """Stream every shopping list and item of the user as newline
+    delimited JSON, each shopping list is followed by its items
+    """
+    user_id = g.user_id
+    query = db.session.query(
+        ShoppingLists.id, ShoppingLists.name, ShoppingLists.due_date,
+        Items.id.label('item_id'), Items.name.label('item_name'),
+        Items.quantity, Items.bought_from, Items.status
+    ).outerjoin(Items, Items.shopping_list_id == ShoppingLists.id).filter(
+        ShoppingLists.user_id == user_id, ShoppingLists.deleted_at.is_(None)).order_by(
+            ShoppingLists.id, Items.id)
+    batch_size = current_app.config['STREAM_BATCH_SIZE']
+
+    def generate():
+        last_list_id = None
+        # rows are fetched in batches through a server side cursor
+        for row in query.execution_options(stream_results=True).yield_per(batch_size):
+            if row.id != last_list_id:
+                last_list_id = row.id
+                yield json.dumps({
+                    'type': 'shopping_list',
+                    'id': row.id,
+                    'name': row.name,
+                    'due_date': row.due_date.isoformat() if row.due_date else None
+                }) + '\n'
+            if row.item_id is not None:
+                yield json.dumps({
+                    'type': 'item',
+                    'id': row.item_id,
+                    'shopping_list_id': row.id,
+                    'name': row.item_name,
+                    'quantity': row.quantity,
+                    'bought_from': row.bought_from,
+                    'status': row.status
+                }) + '\n'
+    response = Response(stream_with_context(generate()),
+                        mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename=shoppinglists.ndjson'
+    return response
+
+
+@api.route('/import', methods=['POST'])
+@require_auth
+def import_shopping_lists():
+    """Add shopping lists and items to the user's account from newline
+    delimited JSON, as written by the export, or from csv
+    """
+    readers = {'application/x-ndjson': read_ndjson, 'text/csv': read_csv}
+    reader = readers.get(request.mimetype)
+    if reader is None:
+        response = {'message': 'Import data must be application/x-ndjson or text/csv'}
+        return make_response(jsonify(response)), 415
+    # the body is parsed while it is read
+    lines = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    importer = Importer(g.user_id, batch_size=current_app.config['IMPORT_BATCH_SIZE'])
+    response = importer.run(reader(lines))
+    response['message'] = 'Import finished'
+    return make_response(jsonify(response)), 200
 
 
 @api.route('/shoppinglists/<id>/items/<item_id>', methods=['DELETE'])
+@require_auth
 def delete_item_from_shopping_list(id, item_id):
     """Method to delete items from shopping list"""
-    # get the access token from header
-    access_token = request.headers.get('Authorization')
-    if access_token:
-        # attempt to decode the token and get the User ID
-        user_id = Users.decode_token(access_token)
-        if not isinstance(user_id, str):
-            shopping_list = ShoppingLists.query.filter_by(user_id=user_id, id=id).first()
-            item = Items.query.filter_by(id=item_id).first()
-            # validate if shopping list and item exist
-            if not shopping_list:
-                return make_response(
-                                     jsonify({"message": "Shopping list can not be found to update items"})
-                                     ), 404
-            if not item:
-                return make_response(
-                                     jsonify({"message": "Item can not be found in shopping list"})
-                                     ), 404
-            item.delete()
-            return make_response(
-                                 jsonify(
-                                     {
-                                     "message": "Item successfully deleted from shopping list"
-                                     })
-                                ), 200
-        else:
-            # user is not legit, so the payload is an error message
-            message = user_id
-            response = {'message': message}
-            return make_response(jsonify(response)), 401
+    user_id = g.user_id
+    found = Items.find_owned(user_id, id, item_id)
+    # validate if shopping list and item exist
+    if not found:
+        return make_response(
+                             jsonify({"message": "Shopping list can not be found to update items"})
+                             ), 404
+    shopping_list, item = found
+    if not item:
+        return make_response(
+                             jsonify({"message": "Item can not be found in shopping list"})
+                             ), 404
+    item.delete()
     return make_response(
-                         jsonify({'message': 'Please register or login.'})
-                         ), 401
+                         jsonify(
+                             {
+                             "message": "Item successfully deleted from shopping list"
+                             })
+                        ), 200
@@ -0,0 +1,8 @@
+from app import create_app
+from app.asgi import AsgiAdapter, asgi_workers
+
+# the configuration is named in APP_CONFIG, production by default. Serve
+# with an ASGI server, for example uvicorn, pinned in requirements.txt:
+#     uvicorn asgi:app
+flask_app = create_app()
+app = AsgiAdapter(flask_app, asgi_workers(flask_app.config))
@@ -0,0 +1,62 @@
+"""Benchmark deleting large accounts and shopping lists.
+
+Usage: python -m benchmarks.bench_delete [--lists 1000] [--items 20] [--repeat 3]
+"""
+import time
+import random
+import argparse
+from app import url_prefix
+from app.models import ShoppingLists
+from benchmarks.common import (WORDS, app, create_items, create_shopping_lists,
+                               create_user, format_summary)
+
+
+def delete_account(client, lists, items):
+    """Return the time taken by DELETE /auth/user/<id> for an account"""
+    with app.app_context():
+        user_id = create_user('bench_delete').id
+        create_shopping_lists(user_id, lists)
+        create_items(user_id, items)
+    started = time.perf_counter()
+    response = client.delete(url_prefix + '/auth/user/{}'.format(user_id))
+    elapsed = time.perf_counter() - started
+    assert response.status_code == 200
+    return elapsed
+
+
+def delete_shopping_list(client, items):
+    """Return the time taken by DELETE /shoppinglists/<id> for a list"""
+    with app.app_context():
+        user = create_user('bench_delete')
+        token = user.generate_token(user.id).decode()
+        create_shopping_lists(user.id, 1)
+        create_items(user.id, items)
+        list_id = ShoppingLists.query.filter_by(user_id=user.id).first().id
+    started = time.perf_counter()
+    response = client.delete(url_prefix + '/shoppinglists/{}'.format(list_id),
+                             headers={'Authorization': token})
+    elapsed = time.perf_counter() - started
+    assert response.status_code == 200
+    client.delete(url_prefix + '/auth/user/{}'.format(user.id))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lists', type=int, default=1000)
+    parser.add_argument('--items', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    random.seed(len(WORDS))
+    client = app.test_client()
+    samples = [delete_account(client, args.lists, args.items)
+               for _ in range(args.repeat)]
+    print(format_summary('account, {} lists x {} items'.format(args.lists, args.items),
+                         samples))
+    samples = [delete_shopping_list(client, args.lists * args.items // 10)
+               for _ in range(args.repeat)]
+    print(format_summary('list, {} items'.format(args.lists * args.items // 10), samples))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Benchmark login throughput with password hashing on the request threads
+or in a pool of worker processes.
+
+Usage: python -m benchmarks.bench_login [--workers 0 2 4] [--concurrency 8] [--requests 200]
+"""
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from app import url_prefix
+from benchmarks.common import app, create_user, delete_user, format_summary
+
+
+def run(workers, concurrency, requests):
+    app.config['PASSWORD_HASH_WORKERS'] = workers
+    app.extensions.pop('hashing_pool', None)
+    with app.app_context():
+        user_id = create_user('bench_login').id
+    body = json.dumps({'username': 'bench_login', 'password': 'benchmark'})
+
+    def login(_):
+        client = app.test_client()
+        started = time.perf_counter()
+        response = client.post(url_prefix + '/auth/login', data=body,
+                               headers={'Content-Type': 'application/json'})
+        assert response.status_code == 200, response.data
+        return time.perf_counter() - started
+    try:
+        # the first login starts the pool's processes
+        login(None)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(login, range(requests)))
+        elapsed = time.perf_counter() - started
+        label = '{} workers, {} threads'.format(workers or 'no', concurrency)
+        print(format_summary(label, samples) +
+              '  {:8.1f} logins/s'.format(requests / elapsed))
+    finally:
+        pool = app.extensions.pop('hashing_pool', None)
+        if pool is not None:
+            pool.shutdown()
+        with app.app_context():
+            delete_user(user_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2, 4])
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+    for workers in args.workers:
+        run(workers, args.concurrency, args.requests)
+
+
+if __name__ == '__main__':
+    main()
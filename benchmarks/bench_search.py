@@ -0,0 +1,48 @@
+"""Benchmark shopping list search latency for large accounts.
+
+Usage: python -m benchmarks.bench_search [--sizes 10000 100000] [--repeat 50]
+"""
+import argparse
+import random
+from app import url_prefix
+from app.models import ShoppingLists
+from benchmarks.common import (WORDS, app, create_shopping_lists, create_user,
+                               delete_user, format_summary, timed)
+
+# exact words, substrings and typos
+QUERIES = ['bakery', 'hard', 'kitchn', 'pharmacy 12', 'BIRTH']
+
+
+def run(size, repeat):
+    client = app.test_client()
+    with app.app_context():
+        user = create_user('bench_search_{}'.format(size))
+        user_id = user.id
+        token = user.generate_token(user.id).decode()
+        create_shopping_lists(user_id, size)
+        backend = ShoppingLists.search_backend()
+    try:
+        print('{} shopping lists, {} search'.format(size, backend))
+        for key in QUERIES:
+            def search():
+                response = client.get(url_prefix + '/shoppinglists/?q=' + key,
+                                      headers={'Authorization': token})
+                assert response.status_code == 200
+            print(format_summary('  q=' + key, timed(search, repeat)))
+    finally:
+        with app.app_context():
+            delete_user(user_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    random.seed(len(WORDS))
+    for size in args.sizes:
+        run(size, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
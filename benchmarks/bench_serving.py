@@ -0,0 +1,113 @@
+"""Benchmark the sync (gunicorn, run:app) and async (ASGI, asgi:app) serving
+modes under growing numbers of concurrent client connections.
+
+Start the servers first, with the same number of processes, for example
+    gunicorn -c gunicorn.conf.py -w 4 -b :8000 run:app
+    uvicorn --workers 4 --port 8001 asgi:app
+then
+Usage: python -m benchmarks.bench_serving --url sync=http://localhost:8000 \
+           --url async=http://localhost:8001 [--concurrency 10 100 400] [--duration 10]
+"""
+import time
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+from app import url_prefix
+from benchmarks.common import (app, create_shopping_lists, create_user,
+                               delete_user, format_summary)
+
+
+async def fetch(reader, writer, host, path, token):
+    """Send a GET on a keep-alive connection and return the status and
+    whether the server keeps the connection open
+    """
+    writer.write('GET {} HTTP/1.1\r\nHost: {}\r\nAuthorization: {}\r\n\r\n'.format(
+        path, host, token).encode('latin-1'))
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    keep_alive = True
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+        elif name.lower() == 'connection':
+            keep_alive = value.strip().lower() != 'close'
+    await reader.readexactly(length)
+    return status, keep_alive
+
+
+async def client(url, path, token, deadline, samples, errors):
+    """Request path over one connection until deadline"""
+    parts = urlsplit(url)
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+            status, keep_alive = await fetch(reader, writer, parts.netloc, path, token)
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+            errors.append(None)
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            await asyncio.sleep(0.01)
+            continue
+        if status == 200:
+            samples.append(time.perf_counter() - started)
+        else:
+            errors.append(status)
+        if not keep_alive:
+            # sync workers close the connection after every response
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def load(url, path, token, concurrency, duration):
+    samples, errors = [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*[client(url, path, token, deadline, samples, errors)
+                           for _ in range(concurrency)])
+    return samples, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', action='append', required=True,
+                        help='label=url of a running server, repeat for every mode')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 100, 400])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--lists', type=int, default=20)
+    args = parser.parse_args()
+    servers = [url.split('=', 1) for url in args.url]
+    with app.app_context():
+        user = create_user('bench_serving')
+        user_id = user.id
+        token = user.generate_token(user.id).decode()
+        create_shopping_lists(user_id, args.lists)
+    path = url_prefix + '/shoppinglists/'
+    try:
+        for concurrency in args.concurrency:
+            for label, url in servers:
+                samples, errors = asyncio.run(load(url, path, token, concurrency, args.duration))
+                if not samples:
+                    print('{:<32} no successful requests, {} errors'.format(
+                        '{} x{}'.format(label, concurrency), len(errors)))
+                    continue
+                print(format_summary('{} x{}'.format(label, concurrency), samples) +
+                      '  {:8.1f} req/s  {} errors'.format(len(samples) / args.duration,
+                                                          len(errors)))
+    finally:
+        with app.app_context():
+            delete_user(user_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Helpers shared by the benchmark scripts.
+
+The benchmarks run with the benchmark configuration against the database
+at BENCHMARK_DATABASE_URL, or DATABASE_URL, so point it at a scratch
+database, never at production.
+"""
+import random
+import time
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import Items, ShoppingLists, Users
+
+WORDS = ['bakery', 'hardware', 'groceries', 'party', 'camping', 'office',
+         'garden', 'pharmacy', 'school', 'holiday', 'weekend', 'market',
+         'birthday', 'kitchen', 'pets', 'cleaning', 'picnic', 'dinner']
+
+app = create_app('benchmark')
+
+
+def percentile(samples, pct):
+    """Return the pct percentile of a list of samples"""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summary(samples):
+    """Return mean, p50, p95 and p99 of samples in milliseconds"""
+    return {
+        'mean': 1000.0 * sum(samples) / len(samples),
+        'p50': 1000.0 * percentile(samples, 50),
+        'p95': 1000.0 * percentile(samples, 95),
+        'p99': 1000.0 * percentile(samples, 99),
+    }
+
+
+def format_summary(label, samples):
+    stats = summary(samples)
+    return '{:<32} mean {mean:8.2f}ms  p50 {p50:8.2f}ms  p95 {p95:8.2f}ms  p99 {p99:8.2f}ms'.format(
+        label, **stats)
+
+
+def create_user(username):
+    """Create a benchmark user, replacing one left over by an earlier run"""
+    user = Users.query.filter_by(username=username).first()
+    if user:
+        delete_user(user.id)
+    user = Users(username=username, email=username + '@example.com',
+                 password='benchmark')
+    user.save()
+    return user
+
+
+def delete_user(user_id):
+    """Remove a benchmark user and everything it owns"""
+    list_ids = db.session.query(ShoppingLists.id).filter_by(user_id=user_id)
+    Items.query.filter(Items.shopping_list_id.in_(list_ids.subquery())).delete(
+        synchronize_session=False)
+    ShoppingLists.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    Users.query.filter_by(id=user_id).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def create_shopping_lists(user_id, count, batch_size=5000):
+    """Insert count shopping lists with generated names for a user"""
+    start = datetime(2017, 1, 1)
+    for offset in range(0, count, batch_size):
+        rows = []
+        for number in range(offset, min(offset + batch_size, count)):
+            rows.append({
+                'name': '{} {} {}'.format(random.choice(WORDS),
+                                          random.choice(WORDS), number),
+                'due_date': start + timedelta(minutes=number),
+                'user_id': user_id
+            })
+        db.session.execute(ShoppingLists.__table__.insert(), rows)
+        db.session.commit()
+
+
+def timed(func, repeat):
+    """Call func repeat times and return the duration of every call"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def create_items(user_id, per_list, batch_size=5000):
+    """Insert per_list items into every shopping list of a user"""
+    list_ids = [row.id for row in db.session.query(ShoppingLists.id).filter_by(user_id=user_id)]
+    rows = []
+    for list_id in list_ids:
+        for number in range(per_list):
+            rows.append({'name': '{} {}'.format(random.choice(WORDS), number),
+                         'quantity': number, 'shopping_list_id': list_id})
+            if len(rows) == batch_size:
+                db.session.execute(Items.__table__.insert(), rows)
+                rows = []
+    if rows:
+        db.session.execute(Items.__table__.insert(), rows)
+    db.session.commit()
@@ -0,0 +1,14 @@
+import gc
+import os
+
+# the app is imported once in the master and shared with the workers it
+# forks, database connections are only opened by the workers
+preload_app = True
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+
+def when_ready(server):
+    # objects of the preloaded app are left alone by the garbage collector
+    # so the workers keep sharing their memory pages instead of copying them
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
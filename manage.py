@@ -1,13 +1,52 @@
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
-from app import app
-from app.models import db
-
+from app import create_app, db
 
+app = create_app()
 manager = Manager(app)
 migrate = Migrate(app, db)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.command
+def prune_blacklist():
+    """Delete blacklisted tokens that have already expired"""
+    from app.tasks import prune_blacklist as prune
+    print('Removed {} expired tokens'.format(prune()))
+
+
+@manager.command
+def reap_deleted():
+    """Remove deleted accounts and shopping lists in batches"""
+    from app.tasks import reap_deleted as reap
+    counts = reap()
+    print('Removed {users} users, {shopping_lists} shopping lists and '
+          '{items} items'.format(**counts))
+
+
+@manager.option('-u', '--username', dest='username', required=True)
+@manager.option('-f', '--file', dest='path', required=True)
+def import_lists(username, path):
+    """Import shopping lists and items from a .ndjson or .csv file"""
+    from app.importer import Importer, read_csv, read_ndjson
+    from app.models import Users
+    user = Users.query.filter_by(username=username).first()
+    if not user:
+        print('User {} does not exist'.format(username))
+        return
+    reader = read_csv if path.endswith('.csv') else read_ndjson
+
+    def progress(report):
+        print('{shopping_lists} shopping lists, {items} items, '
+              '{error_count} errors'.format(**report))
+    importer = Importer(user.id, batch_size=app.config['IMPORT_BATCH_SIZE'],
+                        progress=progress)
+    with open(path, newline='') as lines:
+        report = importer.run(reader(lines))
+    for error in report['errors']:
+        print('line {line}: {message}'.format(**error))
+    print('Imported {shopping_lists} shopping lists and {items} items'.format(**report))
+
+
 if __name__ == '__main__':
     manager.run()
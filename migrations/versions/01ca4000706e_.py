@@ -0,0 +1,49 @@
+"""delete shopping lists and items with their owner in the database
+
+Revision ID: 01ca4000706e
+Revises: 04f731adf0d1
+Create Date: 2026-10-18 15:02:37.412960
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '01ca4000706e'
+down_revision = '04f731adf0d1'
+branch_labels = None
+depends_on = None
+
+
+def replace_foreign_key(table, column, referred, ondelete):
+    # the name postgres gave the constraints of the first migration
+    name = '{}_{}_fkey'.format(table, column)
+    if op.get_bind().dialect.name == 'sqlite':
+        # sqlite constraints have no name, the naming convention gives
+        # them the same one for the table copy
+        naming_convention = {'fk': '%(table_name)s_%(column_0_name)s_fkey'}
+        with op.batch_alter_table(table, naming_convention=naming_convention) as batch_op:
+            batch_op.drop_constraint(name, type_='foreignkey')
+            batch_op.create_foreign_key(name, referred, [column], ['id'], ondelete=ondelete)
+    else:
+        op.drop_constraint(name, table, type_='foreignkey')
+        op.create_foreign_key(name, table, referred, [column], ['id'], ondelete=ondelete)
+
+
+def restore_search_triggers():
+    # the shopping_lists copies on sqlite drop the search triggers as in
+    # 04f731adf0d1, which restores them
+    context.script.get_revision('04f731adf0d1').module.restore_search_triggers()
+
+
+def upgrade():
+    replace_foreign_key('shopping_lists', 'user_id', 'users', 'CASCADE')
+    replace_foreign_key('items', 'shopping_list_id', 'shopping_lists', 'CASCADE')
+    restore_search_triggers()
+
+
+def downgrade():
+    replace_foreign_key('items', 'shopping_list_id', 'shopping_lists', None)
+    replace_foreign_key('shopping_lists', 'user_id', 'users', None)
+    restore_search_triggers()
@@ -0,0 +1,61 @@
+"""add version stamps to shopping lists
+
+Revision ID: 04f731adf0d1
+Revises: 8a3e96a0c446
+Create Date: 2026-10-18 13:20:44.183027
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '04f731adf0d1'
+down_revision = '8a3e96a0c446'
+branch_labels = None
+depends_on = None
+
+
+def recreate():
+    # sqlite can only add a column with a constant default in place, the
+    # table is copied instead so the rows get the time of the migration
+    return 'always' if op.get_bind().dialect.name == 'sqlite' else 'auto'
+
+
+def restore_search_triggers():
+    # copying shopping_lists on sqlite drops the triggers keeping the
+    # search index of dce976b973b3 up to date, the ids and so the index
+    # entries are unchanged
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite' or not bind.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'shopping_lists_fts'").first():
+        return
+    op.execute("CREATE TRIGGER IF NOT EXISTS shopping_lists_fts_insert AFTER INSERT ON shopping_lists BEGIN "
+               "INSERT INTO shopping_lists_fts(rowid, name) VALUES (new.id, new.name); END")
+    op.execute("CREATE TRIGGER IF NOT EXISTS shopping_lists_fts_delete AFTER DELETE ON shopping_lists BEGIN "
+               "INSERT INTO shopping_lists_fts(shopping_lists_fts, rowid, name) "
+               "VALUES ('delete', old.id, old.name); END")
+    op.execute("CREATE TRIGGER IF NOT EXISTS shopping_lists_fts_update AFTER UPDATE ON shopping_lists BEGIN "
+               "INSERT INTO shopping_lists_fts(shopping_lists_fts, rowid, name) "
+               "VALUES ('delete', old.id, old.name); "
+               "INSERT INTO shopping_lists_fts(rowid, name) VALUES (new.id, new.name); END")
+
+
+def upgrade():
+    with op.batch_alter_table('shopping_lists', recreate=recreate()) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=False))
+    restore_search_triggers()
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('lists_version', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('lists_updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('lists_updated_at')
+        batch_op.drop_column('lists_version')
+    with op.batch_alter_table('shopping_lists') as batch_op:
+        batch_op.drop_column('updated_at')
+        batch_op.drop_column('version')
+    restore_search_triggers()
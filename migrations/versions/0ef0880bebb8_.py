@@ -0,0 +1,26 @@
+"""add composite indexes for shopping lists and items
+
+Revision ID: 0ef0880bebb8
+Revises: dce976b973b3
+Create Date: 2026-10-18 12:05:37.402119
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0ef0880bebb8'
+down_revision = 'dce976b973b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_shopping_lists_user_id_due_date_id', 'shopping_lists', ['user_id', 'due_date', 'id'], unique=False)
+    op.create_index('ix_items_shopping_list_id_id', 'items', ['shopping_list_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_items_shopping_list_id_id', table_name='items')
+    op.drop_index('ix_shopping_lists_user_id_due_date_id', table_name='shopping_lists')
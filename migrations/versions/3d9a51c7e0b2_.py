@@ -0,0 +1,29 @@
+"""index usernames and emails in byte order for prefix searches
+
+Revision ID: 3d9a51c7e0b2
+Revises: bf84293f1a41
+Create Date: 2026-10-18 17:21:05.318442
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3d9a51c7e0b2'
+down_revision = 'bf84293f1a41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # sqlite compares bytes so its unique indexes serve the searches
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_index('ix_users_username_c', 'users', [sa.text('username COLLATE "C"')])
+        op.create_index('ix_users_email_c', 'users', [sa.text('email COLLATE "C"')])
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_users_email_c', table_name='users')
+        op.drop_index('ix_users_username_c', table_name='users')
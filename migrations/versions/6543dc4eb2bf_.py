@@ -0,0 +1,24 @@
+"""add token version to users
+
+Revision ID: 6543dc4eb2bf
+Revises: ba7217289174
+Create Date: 2026-10-18 10:02:11.530961
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6543dc4eb2bf'
+down_revision = 'ba7217289174'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'token_version')
@@ -0,0 +1,26 @@
+"""free the usernames and emails of deleted users
+
+Revision ID: 7c1e2f4a9b63
+Revises: 3d9a51c7e0b2
+Create Date: 2026-10-18 19:02:44.120931
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1e2f4a9b63'
+down_revision = '3d9a51c7e0b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # accounts deleted before soft_delete cleared them still hold their names
+    op.execute('UPDATE users SET username = NULL, email = NULL WHERE deleted_at IS NOT NULL')
+
+
+def downgrade():
+    # the names are gone, the accounts are removed by the reaper either way
+    pass
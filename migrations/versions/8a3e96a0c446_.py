@@ -0,0 +1,28 @@
+"""add indexes for sorting and filtering items
+
+Revision ID: 8a3e96a0c446
+Revises: 0ef0880bebb8
+Create Date: 2026-10-18 12:48:03.661905
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a3e96a0c446'
+down_revision = '0ef0880bebb8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_items_shopping_list_id_name_id', 'items', ['shopping_list_id', 'name', 'id'], unique=False)
+    op.create_index('ix_items_shopping_list_id_status_id', 'items', ['shopping_list_id', 'status', 'id'], unique=False)
+    op.create_index('ix_items_shopping_list_id_bought_from_id', 'items', ['shopping_list_id', 'bought_from', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_items_shopping_list_id_bought_from_id', table_name='items')
+    op.drop_index('ix_items_shopping_list_id_status_id', table_name='items')
+    op.drop_index('ix_items_shopping_list_id_name_id', table_name='items')
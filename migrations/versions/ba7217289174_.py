@@ -0,0 +1,58 @@
+"""store blacklisted tokens as digests with their expiry
+
+Revision ID: ba7217289174
+Revises: 6ff5ad0301b2
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+import hashlib
+from datetime import timedelta
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ba7217289174'
+down_revision = '6ff5ad0301b2'
+branch_labels = None
+depends_on = None
+
+# tokens are issued for 60 minutes so this bounds the expiry of old rows
+TOKEN_LIFETIME = timedelta(minutes=60)
+
+
+def upgrade():
+    op.add_column('blacklist_tokens', sa.Column('token_hash', sa.String(length=64), nullable=True))
+    op.add_column('blacklist_tokens', sa.Column('expires_at', sa.DateTime(), nullable=True))
+    blacklist = sa.table('blacklist_tokens',
+                         sa.column('id', sa.Integer),
+                         sa.column('token', sa.String),
+                         sa.column('token_hash', sa.String),
+                         sa.column('expires_at', sa.DateTime),
+                         sa.column('blacklisted_on', sa.DateTime))
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select([blacklist.c.id, blacklist.c.token, blacklist.c.blacklisted_on])).fetchall()
+    for row_id, token, blacklisted_on in rows:
+        connection.execute(blacklist.update().where(blacklist.c.id == row_id).values(
+            token_hash=hashlib.sha256(token.encode()).hexdigest(),
+            expires_at=blacklisted_on + TOKEN_LIFETIME))
+    with op.batch_alter_table('blacklist_tokens') as batch_op:
+        batch_op.alter_column('token_hash', existing_type=sa.String(length=64), nullable=False)
+        batch_op.alter_column('expires_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.create_unique_constraint('blacklist_tokens_token_hash_key', ['token_hash'])
+        batch_op.create_index(batch_op.f('ix_blacklist_tokens_expires_at'), ['expires_at'], unique=False)
+        # dropping the column drops its unique constraint with it
+        batch_op.drop_column('token')
+
+
+def downgrade():
+    # digests can not be turned back into tokens so revoked rows are dropped
+    op.execute('DELETE FROM blacklist_tokens')
+    with op.batch_alter_table('blacklist_tokens') as batch_op:
+        batch_op.add_column(sa.Column('token', sa.String(length=500), nullable=False))
+        batch_op.create_unique_constraint('blacklist_tokens_token_key', ['token'])
+        batch_op.drop_index(batch_op.f('ix_blacklist_tokens_expires_at'))
+        batch_op.drop_constraint('blacklist_tokens_token_hash_key', type_='unique')
+        batch_op.drop_column('expires_at')
+        batch_op.drop_column('token_hash')
@@ -0,0 +1,40 @@
+"""mark users and shopping lists deleted
+
+Revision ID: bf84293f1a41
+Revises: 01ca4000706e
+Create Date: 2026-10-18 15:48:12.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bf84293f1a41'
+down_revision = '01ca4000706e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.add_column('shopping_lists', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    # reads only ever look at shopping lists that are not deleted
+    op.drop_index('ix_shopping_lists_user_id_due_date_id', table_name='shopping_lists')
+    op.create_index('ix_shopping_lists_user_id_due_date_id', 'shopping_lists', ['user_id', 'due_date', 'id'], unique=False,
+                    postgresql_where=sa.text('deleted_at IS NULL'), sqlite_where=sa.text('deleted_at IS NULL'))
+    op.create_index('ix_shopping_lists_deleted_at', 'shopping_lists', ['deleted_at'], unique=False,
+                    postgresql_where=sa.text('deleted_at IS NOT NULL'), sqlite_where=sa.text('deleted_at IS NOT NULL'))
+    op.create_index('ix_users_deleted_at', 'users', ['deleted_at'], unique=False,
+                    postgresql_where=sa.text('deleted_at IS NOT NULL'), sqlite_where=sa.text('deleted_at IS NOT NULL'))
+
+
+def downgrade():
+    op.drop_index('ix_users_deleted_at', table_name='users')
+    op.drop_index('ix_shopping_lists_deleted_at', table_name='shopping_lists')
+    op.drop_index('ix_shopping_lists_user_id_due_date_id', table_name='shopping_lists')
+    op.create_index('ix_shopping_lists_user_id_due_date_id', 'shopping_lists', ['user_id', 'due_date', 'id'], unique=False)
+    # dropped in place, a batch copy of shopping_lists on sqlite would
+    # lose the search triggers (needs sqlite 3.35)
+    op.execute('ALTER TABLE shopping_lists DROP COLUMN deleted_at')
+    op.execute('ALTER TABLE users DROP COLUMN deleted_at')
@@ -0,0 +1,58 @@
+"""add search indexes for shopping list names
+
+Revision ID: dce976b973b3
+Revises: 6543dc4eb2bf
+Create Date: 2026-10-18 11:20:45.771302
+
+"""
+import logging
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'dce976b973b3'
+down_revision = '6543dc4eb2bf'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.env')
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        available = bind.execute(
+            "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'").first()
+        if not available:
+            # the application falls back to ilike searches without it
+            logger.warning('pg_trgm is not available, skipping the trigram index')
+            return
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.create_index('ix_shopping_lists_name_trgm', 'shopping_lists', ['name'],
+                        postgresql_using='gin',
+                        postgresql_ops={'name': 'gin_trgm_ops'})
+    elif bind.dialect.name == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE shopping_lists_fts USING fts5("
+                   "name, content='shopping_lists', content_rowid='id', tokenize='trigram')")
+        op.execute("CREATE TRIGGER shopping_lists_fts_insert AFTER INSERT ON shopping_lists BEGIN "
+                   "INSERT INTO shopping_lists_fts(rowid, name) VALUES (new.id, new.name); END")
+        op.execute("CREATE TRIGGER shopping_lists_fts_delete AFTER DELETE ON shopping_lists BEGIN "
+                   "INSERT INTO shopping_lists_fts(shopping_lists_fts, rowid, name) "
+                   "VALUES ('delete', old.id, old.name); END")
+        op.execute("CREATE TRIGGER shopping_lists_fts_update AFTER UPDATE ON shopping_lists BEGIN "
+                   "INSERT INTO shopping_lists_fts(shopping_lists_fts, rowid, name) "
+                   "VALUES ('delete', old.id, old.name); "
+                   "INSERT INTO shopping_lists_fts(rowid, name) VALUES (new.id, new.name); END")
+        op.execute("INSERT INTO shopping_lists_fts(shopping_lists_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_shopping_lists_name_trgm')
+    elif bind.dialect.name == 'sqlite':
+        op.execute('DROP TRIGGER IF EXISTS shopping_lists_fts_update')
+        op.execute('DROP TRIGGER IF EXISTS shopping_lists_fts_delete')
+        op.execute('DROP TRIGGER IF EXISTS shopping_lists_fts_insert')
+        op.execute('DROP TABLE IF EXISTS shopping_lists_fts')
@@ -1,4 +1,7 @@
-from app import app
+from app import create_app
+
+# the configuration is named in APP_CONFIG, production by default
+app = create_app()
 
 if __name__ == '__main__':
     app.run()